@@ -0,0 +1,59 @@
+import numpy as np
+from array_ops import make_key, group_cummax
+
+
+class AcceptedMaxTable:
+    # the accepted_max_rating_* features: for every (handle, contest) with an accept, the highest
+    # rating per tag over that contest and all earlier ones, as one int16 row
+    def __init__(self, handle_ids: np.ndarray, contest_ids: np.ndarray, matrix: np.ndarray, tag_count: int):
+        self.handle_ids = handle_ids
+        self.keys = make_key(handle_ids, contest_ids)
+        self.matrix = matrix
+        self.zeros = np.zeros(tag_count, dtype=np.int16)
+
+    @classmethod
+    def from_accepted(
+        cls,
+        handle_ids: np.ndarray,
+        contest_ids: np.ndarray,
+        ratings: np.ndarray,
+        tags: np.ndarray,
+    ) -> 'AcceptedMaxTable':
+        # one entry per accepted problem, tags is the problem's 0/1 row over the tag list
+        handle_ids = np.asarray(handle_ids, dtype=np.int64)
+        contest_ids = np.asarray(contest_ids, dtype=np.int64)
+        tag_count = tags.shape[1]
+        if len(handle_ids) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(empty, empty, np.zeros((0, tag_count), dtype=np.int16), tag_count)
+
+        # a single sweep in contest order: per-contest max, then a running max per handle
+        order = np.lexsort((contest_ids, handle_ids))
+        handle_ids, contest_ids = handle_ids[order], contest_ids[order]
+        values = tags[order].astype(np.int32) * np.asarray(ratings, dtype=np.int32)[order][:, None]
+
+        keys = make_key(handle_ids, contest_ids)
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        per_contest = np.maximum.reduceat(values, starts, axis=0)
+        matrix = group_cummax(per_contest, handle_ids[starts]).astype(np.int16)
+        return cls(handle_ids[starts], contest_ids[starts], matrix, tag_count)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _last_before(self, handle_ids: np.ndarray, contest_ids: np.ndarray) -> np.ndarray:
+        # row of the handle's last accepted contest before the given one, -1 when there is none
+        last = np.searchsorted(self.keys, make_key(handle_ids, contest_ids), side='left') - 1
+        hit = last >= 0
+        hit[hit] = self.handle_ids[last[hit]] == np.asarray(handle_ids)[hit]
+        return np.where(hit, last, -1)
+
+    def before(self, handle_ids: np.ndarray, contest_ids: np.ndarray) -> np.ndarray:
+        rows = self._last_before(np.atleast_1d(handle_ids), np.atleast_1d(contest_ids))
+        ret = np.zeros((len(rows), len(self.zeros)), dtype=np.int16)
+        ret[rows >= 0] = self.matrix[rows[rows >= 0]]
+        return ret
+
+    def before_contest(self, handle_id: int, contest_id: int) -> np.ndarray:
+        row = self._last_before(np.array([handle_id]), np.array([contest_id]))[0]
+        return self.matrix[row] if row >= 0 else self.zeros
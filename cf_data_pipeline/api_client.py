@@ -1,76 +1,148 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import json
 import time
+import threading
 from typing import Optional
+import response_cache
 from config import *
 
 
-def get_json(url: str, api_timeout: float = 10) -> Optional[dict]:
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        # returns 0 when the tokens were taken, otherwise the seconds to wait before retrying
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1):
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def penalize(self, seconds: float):
+        # push the bucket into debt so every caller backs off after a call limit error
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class ApiClient:
+    def __init__(self, rate: float = API_CALL_RATE, burst: float = API_CALL_BURST, pool_size: int = HTTP_POOL_SIZE):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.limiter = TokenBucket(rate, burst)
+
+    def fetch_json(self, url: str, api_timeout: float = 10) -> Optional[dict]:
+        # callers must take a token from self.limiter first
+        try:
+            res = self.session.get(url, timeout=api_timeout)
+            if res.status_code >= 400:
+                body = _parse_failed_body(res)
+                if body is not None:
+                    return body
+            res.raise_for_status()
+            return res.json()
+        except requests.exceptions.Timeout:
+            print(f'[TIMEOUT] {url}')
+            return None
+        except Exception as e:
+            print(f'[API ERROR] {url} -> {e}')
+            return None
+
+    def get_json(self, url: str, api_timeout: float = 10) -> Optional[dict]:
+        self.limiter.acquire()
+        return self.fetch_json(url, api_timeout=api_timeout)
+
+
+def _parse_failed_body(res: requests.Response) -> Optional[dict]:
+    # the API answers errors such as "Call limit exceeded" with a 4xx and a JSON body
     try:
-        res = requests.get(url, timeout=api_timeout)
-        res.raise_for_status()
-        return res.json()
-    except requests.exceptions.Timeout:
-        print(f'[TIMEOUT] {url}')
-        return None
-    except Exception as e:
-        print(f'[API ERROR] {url} -> {e}')
+        body = res.json()
+    except ValueError:
         return None
+    if isinstance(body, dict) and body.get('status') == 'FAILED':
+        return body
+    return None
+
+def is_call_limit_error(res: Optional[dict]) -> bool:
+    return res is not None and "Call limit exceeded" in res.get("comment", "")
+
+
+_client: Optional[ApiClient] = None
+_client_lock = threading.Lock()
+
+def get_client() -> ApiClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ApiClient()
+    return _client
+
+def get_json(url: str, api_timeout: float = 10) -> Optional[dict]:
+    return get_client().get_json(url, api_timeout=api_timeout)
     
-def safe_get_json(url: str, api_timeout, max_retries=5):
+def safe_get_json(url: str, api_timeout, max_retries=5, use_cache: bool = True):
+    cache = response_cache.get_cache() if use_cache else None
+    if cache is not None:
+        cached = cache.get(url)
+        if cached is not None:
+            return cached
+
     for i in range(max_retries):
         res = get_json(url, api_timeout=api_timeout)
         if res is None:
             continue
         if res.get('status') == 'OK':
+            if cache is not None:
+                cache.put(url, res)
             return res
-        elif "Call limit exceeded" in res.get("comment", ""):
-            time.sleep(SLEEP_TIME)
+        elif is_call_limit_error(res):
+            get_client().limiter.penalize(SLEEP_TIME)
         else:
             return None
     return None
 
-def get_contest_list(cache_path = RES_CACHE_DATA_DIR / f'contest_list.json') -> Optional[dict]:
-    if os.path.isfile(cache_path) is True:
+def _load_legacy_cache(cache_path) -> Optional[dict]:
+    # responses cached as plain json before the response cache existed
+    if cache_path is not None and os.path.isfile(cache_path):
         with open(cache_path, encoding='utf-8') as f:
             return json.load(f)
-    
-    try:
-        data = get_json('https://codeforces.com/api/contest.list?gym=false', 10)
-
-        if data['status'] != 'OK':
-            raise ValueError('API status is not OK')
-        
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-        with open(cache_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    return None
+
+def get_contest_list(cache_path = RES_CACHE_DATA_DIR / f'contest_list.json') -> Optional[dict]:
+    data = _load_legacy_cache(cache_path)
+    if data is not None:
         return data
-    except requests.RequestException as e:
-        print(f'Failed to call API {e}')
-        return None
-    except Exception as e:
-        print(f'[ERROR]: {e}')
-        return None
+    return safe_get_json(f'{API_BASE_URL}/contest.list?gym=false', 10)
     
 def get_cf_rated_list_json(cache_path=f'./{RES_CACHE_BASENAME}/user.ratedList.json') -> Optional[dict]:
-    if os.path.isfile(cache_path):
-        with open(cache_path, encoding='utf-8') as f:
-            return json.load(f)
-    
-    req_url = 'https://codeforces.com/api/user.ratedList?activeOnly=false&includeRetired=true'
-    try:
-        data = get_json(req_url, 50)
-        if data['status'] != 'OK':
-            raise ValueError('API status is not OK')
-        
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-        with open(cache_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    data = _load_legacy_cache(cache_path)
+    if data is not None:
         return data
-    except Exception as e:
-        print(f'[EXCEPTION] {e}')
-        return None
+    req_url = f'{API_BASE_URL}/user.ratedList?activeOnly=false&includeRetired=true'
+    return safe_get_json(req_url, 50)
     
 def get_contest_standings(
     contest_id: int,
@@ -83,7 +155,23 @@ def get_contest_standings(
     as_manager: bool = False,
     only_problems: bool = False,
 ) -> Optional[dict]:
-    base_url = f'https://codeforces.com/api/contest.standings?contestId={contest_id}&asManager={"true" if as_manager else "false"}'
+    url, wait_time = get_contest_standings_url(
+        contest_id, from_index, count, handles, room, show_unofficial, participant_types, as_manager, only_problems
+    )
+    return safe_get_json(url, api_timeout=wait_time)
+
+def get_contest_standings_url(
+    contest_id: int,
+    from_index: Optional[int] = None,
+    count: Optional[int] = None,
+    handles: Optional[str] = None,
+    room: Optional[int] = None,
+    show_unofficial: bool = False,
+    participant_types: Optional[str] = None,
+    as_manager: bool = False,
+    only_problems: bool = False,
+) -> tuple[str, float]:
+    base_url = f'{API_BASE_URL}/contest.standings?contestId={contest_id}&asManager={"true" if as_manager else "false"}'
     
     if from_index is not None:
         base_url += f"&from={from_index}"
@@ -107,20 +195,24 @@ def get_contest_standings(
     else:
         wait_time += 10
 
-    return safe_get_json(base_url, api_timeout=wait_time)
+    return base_url, wait_time
 
 def get_rated_users_by_contest(contest_id: int) -> Optional[dict]:
-    url = f'https://codeforces.com/api/user.ratedList?activeOnly=false&includeRetired=true&contestId={contest_id}'
+    url = f'{API_BASE_URL}/user.ratedList?activeOnly=false&includeRetired=true&contestId={contest_id}'
     return safe_get_json(url, api_timeout=90)
 
+def get_user_rating_changes_url(handle: str) -> str:
+    return f'{API_BASE_URL}/user.rating?handle={handle}'
+
 def get_user_rating_changes(handle: str) -> Optional[dict]:
-    url = f'https://codeforces.com/api/user.rating?handle={handle}'
-    return safe_get_json(url, api_timeout=10)
+    return safe_get_json(get_user_rating_changes_url(handle), api_timeout=10)
+
+def get_contest_rating_changes_url(contest_id: int) -> str:
+    return f'{API_BASE_URL}/contest.ratingChanges?contestId={contest_id}'
 
 def get_contest_rating_changes(contest_id: int) -> Optional[dict]:
-    url = f'https://codeforces.com/api/contest.ratingChanges?contestId={contest_id}'
-    return safe_get_json(url, api_timeout=30)
+    return safe_get_json(get_contest_rating_changes_url(contest_id), api_timeout=30)
 
 def get_user_status(handle: str) -> Optional[dict]:
-    url = f'https://codeforces.com/api/user.status?handle={handle}'
+    url = f'{API_BASE_URL}/user.status?handle={handle}'
     return safe_get_json(url, api_timeout=17)
\ No newline at end of file
@@ -0,0 +1,31 @@
+import numpy as np
+
+
+def make_key(high: np.ndarray, low: np.ndarray) -> np.ndarray:
+    # packs two non-negative ids into one sortable int64
+    return (np.asarray(high, dtype=np.int64) << 32) | np.asarray(low, dtype=np.int64)
+
+def lookup_sorted(keys: np.ndarray, queries: np.ndarray) -> np.ndarray:
+    # position of each query in the sorted keys, -1 when absent
+    pos = np.searchsorted(keys, queries)
+    pos = np.minimum(pos, max(len(keys) - 1, 0))
+    found = (keys[pos] == queries) if len(keys) else np.zeros(len(queries), dtype=bool)
+    return np.where(found, pos, -1)
+
+def group_starts(groups: np.ndarray) -> np.ndarray:
+    # index of the first element of the run each element belongs to, groups must be sorted
+    if len(groups) == 0:
+        return np.zeros(0, dtype=np.int64)
+    first = np.ones(len(groups), dtype=bool)
+    first[1:] = groups[1:] != groups[:-1]
+    return np.maximum.accumulate(np.where(first, np.arange(len(groups)), 0))
+
+def group_cummax(values: np.ndarray, groups: np.ndarray) -> np.ndarray:
+    # running max along axis 0 that restarts with every group, groups must be sorted
+    if len(values) == 0:
+        return values
+    low = values.min()
+    span = int(values.max() - low) + 1
+    rank = np.cumsum(np.r_[0, groups[1:] != groups[:-1]]).astype(np.int64)
+    shift = (rank * span).reshape((-1,) + (1,) * (values.ndim - 1))
+    return np.maximum.accumulate(values.astype(np.int64) - low + shift, axis=0) - shift + low
@@ -0,0 +1,75 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from contest_statistics import COLUMNS, ContestStatisticsData, ContestStatisticsTable
+
+
+def _synthetic_statistics(contests: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'contest_id': np.sort(rng.choice(np.arange(1, contests * 2), contests, replace=False))})
+    for col in COLUMNS:
+        df[col] = rng.integers(0, 3000, contests)
+    df['std_rating_rated'] = rng.random(contests) * 500
+    df['unrated_ratio'] = rng.random(contests).round(3)
+    return df
+
+def scan_lookup(df: pd.DataFrame, contest_id: int):
+    # the lookup get_contest_statistics used to do for every dataset row
+    row = df[df['contest_id'] == contest_id]
+    if row.empty:
+        return None
+    data = row.iloc[0]
+    return ContestStatisticsData(
+        contest_id=contest_id,
+        avg_rating_all=int(data['avg_rating_all']),
+        avg_rating_rated_only=int(data['avg_rating_rated_only']),
+        median_rating_rated=int(data['median_rating_rated']),
+        percentile_rated_25th=int(data['25th_percentile_rated']),
+        percentile_rated_75th=int(data['75th_percentile_rated']),
+        std_rating_rated=data['std_rating_rated'],
+        count_total=int(data['count_total']),
+        count_unrated=int(data['count_unrated']),
+        unrated_ratio=data['unrated_ratio']
+    )
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def run_benchmark(args):
+    df = pd.read_csv(args.csv) if args.csv else _synthetic_statistics(args.contests, args.seed)
+    build_time = _timed(lambda: ContestStatisticsTable(df))
+    table = ContestStatisticsTable(df)
+
+    rng = np.random.default_rng(args.seed)
+    ids = df['contest_id'].to_numpy()
+    queries = rng.choice(ids, args.lookups)
+    scan_queries = queries[:args.scan_lookups].tolist()
+
+    # both lookups must agree before their timings mean anything
+    for contest_id in scan_queries[:100]:
+        assert scan_lookup(df, contest_id) == table.get(contest_id), contest_id
+
+    scan_time = _timed(lambda: [scan_lookup(df, c) for c in scan_queries])
+    query_list = queries.tolist()
+    get_time = _timed(lambda: [table.get(c) for c in query_list])
+    locate_time = _timed(lambda: table.column('avg_rating_rated_only', table.locate(queries)))
+
+    per_scan = scan_time / len(scan_queries)
+    per_get = get_time / len(query_list)
+    per_locate = locate_time / len(query_list)
+    print(f'contests: {len(table)}, table built in {build_time * 1e3:.2f} ms')
+    print(f'boolean scan: {per_scan * 1e6:10.2f} us/lookup ({len(scan_queries)} lookups)')
+    print(f'table.get:    {per_get * 1e6:10.2f} us/lookup ({len(query_list)} lookups), {per_scan / per_get:.0f}x')
+    print(f'table.locate: {per_locate * 1e6:10.4f} us/lookup ({len(query_list)} lookups), {per_scan / per_locate:.0f}x')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare contest statistics lookups')
+    parser.add_argument('--csv', help='contest_statistics.csv to use instead of synthetic data')
+    parser.add_argument('--contests', type=int, default=1500)
+    parser.add_argument('--lookups', type=int, default=1000000)
+    parser.add_argument('--scan-lookups', type=int, default=2000, help='the scan is slow, it gets fewer lookups')
+    parser.add_argument('--seed', type=int, default=42)
+    run_benchmark(parser.parse_args())
@@ -0,0 +1,164 @@
+import argparse
+import os
+import resource
+import socket
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _setup_environment(workdir: Path, port: int):
+    # config is read at import time, so the pipeline modules must be imported after this
+    os.environ['CF_API_BASE_URL'] = f'http://127.0.0.1:{port}/api'
+    os.environ['CF_PROCESSED_DATA_DIR'] = str(workdir / 'processed_data')
+    os.environ['CF_RES_CACHE_DATA_DIR'] = str(workdir / 'response_cache')
+
+def _count_rows(db_path: Path, table: str) -> int:
+    if not db_path.is_file():
+        return 0
+    with sqlite3.connect(db_path) as conn:
+        try:
+            return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_benchmark(args) -> list[dict]:
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='cf_bench_'))
+    port = _free_port()
+    _setup_environment(workdir, port)
+
+    import api_client
+    import response_cache
+    import contest_fetcher
+    import problem_fetcher
+    import contest_standing_fetcher
+    import db_contest_user_result
+    import db_rating_change
+    import rating_change_fetcher
+    import storage
+    from config import SAMPLED_HANDLE_PATH, CONTEST_MIN_DATE, CONTEST_MAX_DATE
+    from fake_cf_server import FakeCodeforcesServer, FakeServerConfig, SyntheticData, ReplayData
+
+    if args.replay:
+        data = ReplayData(args.replay)
+    else:
+        data = SyntheticData(args.contests, args.handles, args.participants, seed=args.seed)
+    server_config = FakeServerConfig(
+        latency=args.latency,
+        latency_jitter=args.latency / 2,
+        call_limit_rate=args.call_limit_rate,
+        timeout_rate=args.timeout_rate,
+        timeout_delay=args.timeout_delay,
+        max_calls_per_second=args.max_calls_per_second,
+        seed=args.seed,
+    )
+    server = FakeCodeforcesServer(data, server_config, port=port).start()
+
+    response_cache.cache_enabled = args.with_cache
+    api_client._client = api_client.ApiClient(rate=args.rate, burst=args.burst)
+
+    processed_dir = workdir / 'processed_data'
+    streaming_db_path = processed_dir / 'contest_user_result_streaming.db'
+    rating_db_path = db_rating_change.db_path
+    per_handle_db_path = processed_dir / 'cf_rating_changes_per_handle.db'
+    user_result_db_path = db_contest_user_result.db_path
+
+    def run_per_handle_ratings():
+        db_rating_change.db_path = per_handle_db_path
+        db_rating_change.init_db()
+        handles = storage.load_csv(SAMPLED_HANDLE_PATH)['handle'].tolist()
+        for handle in handles:
+            rating_change_fetcher.fetch_and_store(handle)
+        db_rating_change.db_path = rating_db_path
+
+    def run_streaming_user_results():
+        db_contest_user_result.db_path = streaming_db_path
+        contest_standing_fetcher.process_user_result_streaming(page_size=args.page_size, max_in_flight=args.in_flight)
+        db_contest_user_result.db_path = user_result_db_path
+
+    def sample_handles():
+        handles = [c['handle'] for c in api_client.get_cf_rated_list_json(cache_path=None)['result']]
+        storage.save_csv(SAMPLED_HANDLE_PATH, storage.pd.DataFrame({'handle': handles[:args.sample_handles]}))
+
+    stages = [
+        ('contest_metadata', lambda: contest_fetcher.process_rated_contest_csv(CONTEST_MIN_DATE, CONTEST_MAX_DATE)),
+        ('rated_list', sample_handles),
+        ('problem_metadata', problem_fetcher.process_contest_problem_metadata),
+        ('contest_statistics', lambda: contest_standing_fetcher.process_contest_standings(max_in_flight=args.in_flight)),
+        ('user_results', lambda: contest_standing_fetcher.process_user_result(max_in_flight=args.in_flight)),
+        ('user_results_streaming', run_streaming_user_results),
+        ('rating_changes_per_handle', run_per_handle_ratings),
+    ]
+    tables = [
+        (user_result_db_path, 'contest_user_result'),
+        (streaming_db_path, 'contest_user_result'),
+        (rating_db_path, 'rating_changes'),
+        (per_handle_db_path, 'rating_changes'),
+    ]
+
+    results = list()
+    for name, func in stages:
+        if args.stages and name not in args.stages:
+            continue
+        before = server.stats()
+        rows_before = sum(_count_rows(path, table) for path, table in tables)
+        started = time.perf_counter()
+        func()
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        after = server.stats()
+        rows = sum(_count_rows(path, table) for path, table in tables) - rows_before
+        requests = after['requests'] - before['requests']
+        sent = after['bytes'] - before['bytes']
+
+        results.append({
+            'stage': name,
+            'seconds': round(elapsed, 3),
+            'requests': requests,
+            'requests_per_sec': round(requests / elapsed, 2),
+            'bytes_per_sec': round(sent / elapsed, 1),
+            'sqlite_rows': rows,
+            'rows_per_sec': round(rows / elapsed, 1),
+            'call_limit_errors': after['call_limit_errors'] - before['call_limit_errors'],
+            'peak_rss_mb': round(_peak_rss_mb(), 1),
+        })
+
+    server.stop()
+    df = storage.pd.DataFrame(results)
+    output = Path(args.output) if args.output else workdir / 'benchmark_results.csv'
+    storage.save_csv(output, df)
+    print(df.to_string(index=False))
+    print(f'Results saved to {output}')
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the fetcher stages against a local fake Codeforces API')
+    parser.add_argument('--workdir', help='directory for databases and csv outputs (default: a new temp dir)')
+    parser.add_argument('--output', help='csv file for the results')
+    parser.add_argument('--replay', help='response cache directory to replay instead of synthetic data')
+    parser.add_argument('--stages', nargs='*', help='only run these stages')
+    parser.add_argument('--contests', type=int, default=30)
+    parser.add_argument('--handles', type=int, default=5000)
+    parser.add_argument('--participants', type=int, default=1000)
+    parser.add_argument('--sample-handles', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--call-limit-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-delay', type=float, default=30.0)
+    parser.add_argument('--max-calls-per-second', type=float, default=0.0)
+    parser.add_argument('--rate', type=float, default=1000.0, help='client token bucket rate (calls/sec)')
+    parser.add_argument('--burst', type=float, default=10.0)
+    parser.add_argument('--in-flight', type=int, default=4)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--with-cache', action='store_true', help='keep the response cache enabled')
+    run_benchmark(parser.parse_args())
@@ -1,15 +1,28 @@
-import sqlite3
 from collections import defaultdict
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Iterator, Optional
 import dataclasses
+import itertools
+import multiprocessing
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import storage
 import preprocess
 import config
 import db_rating_change
 import rating_change_fetcher
 import db_contest_user_result
+import db_connection
+import columnar_store
+import columnar_builder
+import handle_dict
 import problem_fetcher
+import retry_queue
+from contest_statistics import ContestStatisticsData, ContestStatisticsTable
+from accepted_max_table import AcceptedMaxTable
+import rating_timeline
+from tag_encoding import TagEncoding
 
 
 @dataclasses.dataclass
@@ -19,35 +32,34 @@ class ContestProblemData:
     division_type: int
     problem_rating: int
     tags: list[str]
-
-@dataclasses.dataclass
-class ContestStatisticsData:
-    contest_id: int
-    avg_rating_all: int
-    avg_rating_rated_only: int
-    median_rating_rated: int
-    percentile_rated_25th: int
-    percentile_rated_75th: int
-    std_rating_rated: float
-    count_total: int
-    count_unrated: int
-    unrated_ratio: float
+    # tags as bits of the tag encoding, set when the problem data is loaded
+    tag_mask: int = 0
 
 df_contest_statistics : pd.DataFrame = None
+# id-indexed view of df_contest_statistics, built with it
+contest_statistics_table: Optional[ContestStatisticsTable] = None
 contest_problem_data : defaultdict[tuple, ContestProblemData] = None
 problem_tag_list : list[str] = None
-handle_rating_cache: dict[tuple, dict[str, int]] = None
-max_rating_handle_cache = dict()
-recent_detla_avg_cache = dict()
-ac_problems_by_handle: dict[str, Optional[list]] = dict()
+problem_tag_encoding: Optional[TagEncoding] = None
+# tag columns of a record, in problem_tag_list order
+accepted_max_columns: list[str] = list()
+problem_tag_columns: list[str] = list()
+rating_timeline_table: Optional[rating_timeline.RatingTimeline] = None
+# features of handles whose history was fetched during the build, newer than the timeline
+handle_rating_cache: dict[str, dict[int, db_rating_change.RatingFeatures]] = dict()
+# prefix-max tag tables of the handles in the current group, keyed by handle_dict id
+accepted_max_by_handle: dict[int, AcceptedMaxTable] = dict()
 contest_id_failed_fetch = set()
+# accepted (contest_id, problem_index) lists keyed by handle_dict id
 handle_ac_submission_cache: Optional[defaultdict] = None
+columnar_dataset_builder: Optional[columnar_builder.ColumnarDatasetBuilder] = None
 
 
 def load_contest_statistics():
-    global df_contest_statistics
+    global df_contest_statistics, contest_statistics_table
     if df_contest_statistics is None:
         df_contest_statistics = storage.load_csv(config.CONTEST_STATISTICS_PATH)
+        contest_statistics_table = ContestStatisticsTable(df_contest_statistics)
 
 def load_and_init_contest_problem_data():
     global contest_problem_data
@@ -56,6 +68,7 @@ def load_and_init_contest_problem_data():
         return
     
     contest_problem_data = defaultdict(ContestProblemData)
+    encoding = preprocess.get_tag_encoding()
     raw_data = storage.load_json(config.CONTEST_PROBLEMS_DATA_PATH)
     for item in raw_data:
         contest_id = item['contest_id']
@@ -69,32 +82,15 @@ def load_and_init_contest_problem_data():
             problem_index=problem_index,
             division_type=division_type,
             problem_rating=problem_rating,
-            tags=problem_tags
+            tags=problem_tags,
+            tag_mask=encoding.mask(problem_tags)
         )
 
         contest_problem_data[(contest_id, problem_index)] = record
 
 def get_contest_statistics(contest_id: int) -> Optional[ContestStatisticsData]:
-    global df_contest_statistics
     load_contest_statistics()
-    row = df_contest_statistics[df_contest_statistics['contest_id'] == contest_id]
-    if not row.empty:
-        data = row.iloc[0]
-        result = ContestStatisticsData(
-            contest_id=contest_id,
-            avg_rating_all=int(data['avg_rating_all']),
-            avg_rating_rated_only=int(data['avg_rating_rated_only']),
-            median_rating_rated=int(data['median_rating_rated']),
-            percentile_rated_25th=int(data['25th_percentile_rated']),
-            percentile_rated_75th=int(data['75th_percentile_rated']),
-            std_rating_rated=data['std_rating_rated'],
-            count_total=int(data['count_total']),
-            count_unrated=int(data['count_unrated']),
-            unrated_ratio=data['unrated_ratio']
-        )
-        return result
-    else:
-        return None
+    return contest_statistics_table.get(contest_id)
 
 def get_problem_info(contest_id: int, problem_idx: int) -> Optional[ContestProblemData]:
     global contest_problem_data
@@ -103,66 +99,71 @@ def get_problem_info(contest_id: int, problem_idx: int) -> Optional[ContestProbl
     ret = contest_problem_data.get((contest_id, problem_idx), None)
 
     if ret is None:
-        if contest_id in contest_id_failed_fetch:
+        # offline builds rely on backfill_build_inputs having fetched everything beforehand
+        if config.DATASET_BUILD_OFFLINE or contest_id in contest_id_failed_fetch:
             return None
 
         path = config.CONTEST_PROBLEMS_DATA_PATH
-        failed = problem_fetcher.fetch_problems([contest_id], path, path)
-        contest_id_failed_fetch |= set(failed)
+        problem_fetcher.fetch_problems([contest_id], path, path)
+        # fetched contests are not fetched again, the problems they lack are simply missing
+        contest_id_failed_fetch.add(contest_id)
 
+        # the fetch rewrote the file
+        contest_problem_data = None
         load_and_init_contest_problem_data()
         ret = contest_problem_data.get((contest_id, problem_idx), None)
 
     return ret
 
-def get_ac_problems_by_handle(handle: str):
+def get_ac_problems_by_handle(handle_id: int):
     global handle_ac_submission_cache
-    if handle in handle_ac_submission_cache:
-        return handle_ac_submission_cache[handle]
+    if handle_id in handle_ac_submission_cache:
+        return handle_ac_submission_cache[handle_id]
     else:
         return None
 
-def get_max_ac_rating_tags_before_contest(handle: str, contest_id: int) -> Optional[defaultdict]:
-    ac_list = get_ac_problems_by_handle(handle)
-    if ac_list is None:
-        return None
-        
-    ret = defaultdict(int)
-
-    for item in ac_list:
-        id, idx = item
-        
-        if id >= contest_id:
-            break
+def get_accepted_max_table(handle_id: int) -> AcceptedMaxTable:
+    # sweeps the handle's accepts once, every row of the handle is then a single lookup
+    global accepted_max_by_handle
+    table = accepted_max_by_handle.get(handle_id)
+    if table is not None:
+        return table
 
+    contest_ids, ratings, tag_masks = list(), list(), list()
+    for id, idx in get_ac_problems_by_handle(handle_id) or list():
         record = get_problem_info(id, idx)
         if record is None:
             continue
+        contest_ids.append(id)
+        ratings.append(record.problem_rating)
+        tag_masks.append(record.tag_mask)
 
-        for tag in record.tags:
-            ret[tag] = max(ret[tag], record.problem_rating)
-    return ret
+    tags = problem_tag_encoding.to_matrix(np.array(tag_masks, dtype=np.uint64))
+    table = AcceptedMaxTable.from_accepted([handle_id] * len(contest_ids), contest_ids, ratings, tags)
+    accepted_max_by_handle[handle_id] = table
+    return table
 
-def get_max_rating_before_contest(handle: str, contest_id: int) -> int:
-    global max_rating_handle_cache
-    if (handle, contest_id) in max_rating_handle_cache:
-        return max_rating_handle_cache[(handle, contest_id)]
+def get_max_ac_rating_tags_before_contest(handle_id: int, contest_id: int) -> np.ndarray:
+    # int16 row over problem_tag_list, zeros when nothing was accepted before the contest
+    return get_accepted_max_table(handle_id).before_contest(handle_id, contest_id)
 
-    rating = db_rating_change.get_max_rating_before_contest(handle, contest_id)
-    max_rating_handle_cache[(handle, contest_id)] = rating
-    return rating
+def get_max_rating_before_contest(handle: str, contest_id: int) -> int:
+    handle_id = handle_dict.lookup(handle)
+    return rating_timeline_table.as_of(handle_id, contest_id)[0] if handle_id is not None else 0
 
 def get_recent_delta_avg(handle: str, contest_id: int) -> int:
-    global recent_detla_avg_cache
-    if (handle, contest_id) in recent_detla_avg_cache:
-        return recent_detla_avg_cache[(handle, contest_id)]
+    handle_id = handle_dict.lookup(handle)
+    return rating_timeline_table.as_of(handle_id, contest_id)[1] if handle_id is not None else 0
 
-    delta_avg = db_rating_change.get_recent_delta_avg(handle, contest_id)
-    recent_detla_avg_cache[(handle, contest_id)] = delta_avg
-    return delta_avg
+def get_rating_features(handle: str, contest_id: int) -> Optional[db_rating_change.RatingFeatures]:
+    # a binary search in the timeline, unless the handle's history was fetched during this build
+    if handle in handle_rating_cache:
+        return handle_rating_cache[handle].get(contest_id)
+    return rating_timeline_table.features(handle_dict.lookup(handle), contest_id)
 
 def get_dataset_record(sql_record) -> dict:
-    handle = sql_record[0]
+    handle_id = sql_record[0]
+    handle = handle_dict.get_handle(handle_id)
     contest_id = sql_record[1]
     problem_index_num = sql_record[2]
     # problem_index_raw = sql_record[3]
@@ -179,22 +180,23 @@ def get_dataset_record(sql_record) -> dict:
     record['division_type'] = problem_data.division_type
     record['problem_index'] = problem_index_num
     record['problem_rating'] = problem_data.problem_rating
-    record['handle'] = handle
+    record['handle_id'] = handle_id
 
-    current_rating = db_rating_change.get_contest_rating_entity(handle, contest_id)
+    rating_features = get_rating_features(handle, contest_id)
     # fetch rating cheanges
-    if current_rating is None:
-        if not rating_change_fetcher.fetch_and_store(handle):
+    if rating_features is None:
+        if config.DATASET_BUILD_OFFLINE or not rating_change_fetcher.fetch_and_store(handle):
             print(f'[WARNING] before rating for {handle} {contest_id} is not found')
             return None
         else:
-            current_rating = db_rating_change.get_contest_rating_entity(handle, contest_id)
+            handle_rating_cache[handle] = db_rating_change.get_handle_rating_features(handle)
+            rating_features = get_rating_features(handle, contest_id)
 
-    if current_rating is None:
+    if rating_features is None:
         return None
-    record['current_rating_before_contest'] = current_rating.old_rating
-    record['max_rating_before_contest'] = get_max_rating_before_contest(handle, contest_id)
-    record['recent_delta_avg'] = get_recent_delta_avg(handle, contest_id)
+    record['current_rating_before_contest'] = rating_features.old_rating
+    record['max_rating_before_contest'] = rating_features.max_rating_before_contest
+    record['recent_delta_avg'] = rating_features.recent_delta_avg
     record['avg_rating_rated_only'] = contest_data.avg_rating_rated_only
     record['median_rating_rated'] = contest_data.median_rating_rated
     record['25th_percentile_rated'] = contest_data.percentile_rated_25th
@@ -204,42 +206,101 @@ def get_dataset_record(sql_record) -> dict:
     record['count_unrated'] = contest_data.count_unrated
     record['unrated_ratio'] = contest_data.unrated_ratio
 
-    rating_max_tag = get_max_ac_rating_tags_before_contest(handle, contest_id)
-
-    global problem_tag_list
-
-    for tag in problem_tag_list:
-        key_name = f'accepted_max_rating_{tag}'
-        record[key_name] = 0
-        if rating_max_tag is not None and tag in rating_max_tag:
-            record[key_name] = rating_max_tag[tag]
-
-    for tag in problem_tag_list:
-        key_name = f'problem_tag_{tag}'
-        if tag in problem_data.tags:
-            record[key_name] = 1
-        else:
-            record[key_name] = 0
+    rating_max_tag = get_max_ac_rating_tags_before_contest(handle_id, contest_id)
+    record.update(zip(accepted_max_columns, rating_max_tag.tolist()))
+    record.update(zip(problem_tag_columns, problem_tag_encoding.to_matrix(problem_data.tag_mask).tolist()))
 
     record['verdict'] = verdict
     return record
 
 def init_dataset_builder():
-    global problem_tag_list, handle_ac_submission_cache
-    problem_tag_list = preprocess.get_problem_tag_list()
-    tag_index = dict()
-
-    for i in range(len(problem_tag_list)):
-        tag_index[problem_tag_list[i]] = i
-
+    # run it and the build under db_connection.read_only_mode
+    global handle_ac_submission_cache
+    load_metadata()
+    load_rating_timeline()
+    handle_dict.load_all()
+    if config.DATASET_BUILD_ENGINE == 'columnar':
+        init_columnar_builder()
+    else:
+        handle_ac_submission_cache = load_all_ac_submission()
+
+def load_metadata():
+    # tag list, problem data and contest statistics, everything that does not come from the dbs
+    global problem_tag_list, problem_tag_encoding, accepted_max_columns, problem_tag_columns
+    problem_tag_encoding = preprocess.get_tag_encoding()
+    problem_tag_list = problem_tag_encoding.tag_list
+    accepted_max_columns = [f'accepted_max_rating_{tag}' for tag in problem_tag_list]
+    problem_tag_columns = [f'problem_tag_{tag}' for tag in problem_tag_list]
     load_and_init_contest_problem_data()
     load_contest_statistics()
-    handle_ac_submission_cache = db_contest_user_result.get_all_ac_submission()
 
-def create_dataset(normalize: bool, chunk_idx: int = 0, random_seed: int = 42):
-    init_dataset_builder()
-    db_path = db_contest_user_result.db_path
+def load_rating_timeline():
+    global rating_timeline_table
+    if rating_timeline_table is None:
+        # every build works through sampled handles, a stale export only needs their histories
+        handles = storage.load_csv(config.SAMPLED_HANDLE_PATH)['handle'].tolist()
+        handle_ids = list(handle_dict.lookup_many(handles).values())
+        rating_timeline_table = rating_timeline.load_or_build(handle_ids=handle_ids)
+
+def init_columnar_builder():
+    global columnar_dataset_builder
+    if columnar_dataset_builder is None:
+        columnar_dataset_builder = columnar_builder.ColumnarDatasetBuilder(
+            contest_problem_data,
+            contest_statistics_table,
+            problem_tag_encoding,
+            rating_timeline_table,
+            fetch_rating=None if config.DATASET_BUILD_OFFLINE else rating_change_fetcher.fetch_and_store,
+        )
 
+def get_problem_contest_ids() -> set[int]:
+    return {item['contest_id'] for item in storage.load_json(config.CONTEST_PROBLEMS_DATA_PATH) or list()}
+
+def backfill_build_inputs(handles: list[str]) -> tuple[list[int], list[str]]:
+    # fetches what building the handles would otherwise fetch row by row: problem data of the
+    # contests they have results in, then rating histories of handles with results in known
+    # contests. returns what is still missing, those rows are skipped by the build
+    ids = handle_dict.lookup_many(handles)
+    contests_by_handle = defaultdict(set)
+    for handle_id, contest_id, _, _ in db_contest_user_result.get_masks_by_handle_ids(sorted(set(ids.values()))):
+        contests_by_handle[handle_id].add(contest_id)
+
+    known = get_problem_contest_ids()
+    missing_contests = sorted(set().union(*contests_by_handle.values()) - known)
+    failed_contests = list()
+    if missing_contests:
+        print(f'[INFO] fetching problem data of {len(missing_contests)} contests before the build')
+        path = config.CONTEST_PROBLEMS_DATA_PATH
+        failed_contests = problem_fetcher.fetch_problems(missing_contests, path, path)
+        retry_queue.enqueue_many(retry_queue.PROBLEM_METADATA, failed_contests)
+        known = get_problem_contest_ids()
+
+    with_results = [handle for handle, handle_id in ids.items() if contests_by_handle[handle_id] & known]
+    failed_handles = rating_change_fetcher.backfill_missing_handles(sorted(with_results))
+
+    # loaded metadata and the rating timeline may predate the backfill
+    reset_dataset_builder()
+    return failed_contests, failed_handles
+
+def load_all_ac_submission() -> defaultdict:
+    # the parquet export is a much cheaper full scan, but only while it matches the db
+    if columnar_store.is_export_fresh('contest_user_result'):
+        return columnar_store.get_all_ac_submission_by_id()
+    return db_contest_user_result.get_all_ac_submission_by_id()
+
+def reset_dataset_builder():
+    # drop loaded metadata so the next init_dataset_builder sees freshly appended data
+    global df_contest_statistics, contest_statistics_table, contest_problem_data
+    global handle_ac_submission_cache, columnar_dataset_builder, rating_timeline_table
+    df_contest_statistics = None
+    contest_statistics_table = None
+    contest_problem_data = None
+    handle_ac_submission_cache = None
+    columnar_dataset_builder = None
+    rating_timeline_table = None
+    contest_id_failed_fetch.clear()
+
+def get_handle_groups(random_seed: int = 42) -> list[list[str]]:
     df_handles = storage.load_csv(config.SAMPLED_HANDLE_PATH)
     handles = df_handles['handle'].tolist()
 
@@ -251,122 +312,167 @@ def create_dataset(normalize: bool, chunk_idx: int = 0, random_seed: int = 42):
     chunk_size = len(handles) // 30
     handle_groups = [handles[i:i + chunk_size] for i in range(0, len(handles), chunk_size)]
     print(f"[INFO] Total {len(handle_groups)} groups of handles, each group has {chunk_size} handles.")
-
+    return handle_groups
+
+def get_dataset_path(i: int):
+    return config.DATASET_DIR / f'dataset_group_{i}.parquet'
+
+def get_dataset_schema() -> pa.Schema:
+    # same columns and order as get_dataset_record, in the narrowest type that holds them
+    fields = [
+        ('contest_id', pa.int32()),
+        ('division_type', pa.int8()),
+        ('problem_index', pa.int8()),
+        ('problem_rating', pa.int16()),
+        ('handle_id', pa.int32()),
+        ('current_rating_before_contest', pa.int16()),
+        ('max_rating_before_contest', pa.int16()),
+        ('recent_delta_avg', pa.int16()),
+        ('avg_rating_rated_only', pa.int16()),
+        ('median_rating_rated', pa.int16()),
+        ('25th_percentile_rated', pa.int16()),
+        ('75th_percentile_rated', pa.int16()),
+        ('count_total', pa.int32()),
+        ('count_unrated', pa.int32()),
+        ('unrated_ratio', pa.float32()),
+    ]
+    fields.extend((col, pa.int16()) for col in accepted_max_columns)
+    fields.extend((col, pa.int8()) for col in problem_tag_columns)
+    fields.append(('verdict', pa.int8()))
+    return pa.schema(fields)
+
+def build_handle_records(handle: str) -> list[dict]:
     global handle_rating_cache
-    global recent_detla_avg_cache
-    global max_rating_handle_cache
-    global ac_problems_by_handle
-
-    for i in range(chunk_idx, len(handle_groups)):
-        ac_problems_by_handle.clear()
-
-        group = handle_groups[i]
-        group_records = list()
-
-        for handle in group:
-            max_rating_handle_cache.clear()
-            recent_detla_avg_cache.clear()
-
-            with sqlite3.connect(db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('SELECT * FROM contest_user_result WHERE handle = ?', (handle,))
-                records = cursor.fetchall()
-
-                if handle_rating_cache is not None:
-                    handle_rating_cache.clear()
-                    
-                for record in records:
-                    group_record = get_dataset_record(record)
-                    if group_record is not None:
-                        group_records.append(group_record)
-                print(f'[INFO] {handle} {len(records)} processed.')
-
-        dataset_name = f'dataset_group_{i}.csv'
-        dataset_path = config.DATASET_DIR / dataset_name
-        df = pd.DataFrame(group_records)
-        storage.save_csv(dataset_path, df)
-        print(f"[INFO] Dataset {i} saved to {dataset_path} with {len(group_records)} records.")
-
-def insert_current_rating_before_contest():
-    import glob
-    import os 
-
-    dataset_files = glob.glob(os.path.join(config.DATASET_DIR, 'dataset_group_*.csv'))
-    for file in dataset_files:
-        print(f'Processing {file}...')
-        df = pd.read_csv(file)
-
-        def get_old_rating(row):
-            ent = db_rating_change.get_contest_rating_entity(row['handle'], int(row['contest_id']))
-            return ent.old_rating if ent is not None else None
-
-        df['current_rating_before_contest'] = df.apply(get_old_rating, axis=1)
-        
-        # Save the updated DataFrame back to the file
-        df.to_csv(file, index=False)
-        print(f'Updated {file} with current ratings.')
-
-def fix_and_update_current_rating_before_contest():
-    import glob
-    import os
-    import pandas as pd
-
-    dataset_files = glob.glob(os.path.join(config.DATASET_DIR, 'dataset_group_*.csv'))
-
-    for file in dataset_files:
-        print(f'Processing {file}...')
-        df = pd.read_csv(file)
-
-        if 'currnet_rating_before_contest' in df.columns:
-            df.drop(columns=['currnet_rating_before_contest'], inplace=True)
-
-        def get_old_rating(row):
-            ent = db_rating_change.get_contest_rating_entity(row['handle'], int(row['contest_id']))
-            return ent.old_rating if ent is not None else None
 
-        df['current_rating_before_contest'] = df.apply(get_old_rating, axis=1)
+    handle_records = list()
 
-        before_count = len(df)
-        df = df.dropna(subset=['current_rating_before_contest'])
-        after_count = len(df)
+    handle_id = handle_dict.lookup(handle)
+    records = db_contest_user_result.get_user_results_by_handle_id(handle_id) if handle_id is not None else list()
 
-        df['current_rating_before_contest'] = df['current_rating_before_contest'].astype(int)
-        print(f' - {before_count - after_count} rows dropped due to missing rating')
-
-        df.to_csv(file, index=False)
-        print(f'Updated {file} with current ratings.')
-
-def insert_problem_rating():
-    import glob
-    import os
-    import pandas as pd
-
-    dataset_files = glob.glob(os.path.join(config.DATASET_DIR, 'dataset_group_*.csv'))
-
-    for file in dataset_files:
-        print(f'Processing {file}...')
-        df = pd.read_csv(file)
+    handle_rating_cache.clear()
+        
+    for record in records:
+        group_record = get_dataset_record(record)
+        if group_record is not None:
+            handle_records.append(group_record)
+    print(f'[INFO] {handle} {len(records)} processed.')
+    return handle_records
+
+def iter_record_frames(handles: list[str]) -> Iterator[pd.DataFrame]:
+    # yields the rows of the handles in order, a bounded batch at a time
+    if config.DATASET_BUILD_ENGINE == 'columnar':
+        for i in range(0, len(handles), config.DATASET_HANDLE_BATCH):
+            yield columnar_dataset_builder.build(handles[i:i + config.DATASET_HANDLE_BATCH])
+        return
 
-        def get_rating(row):
-            contest_id = int(row['contest_id'])
-            problem_index = int(row['problem_index'])
-            problem_data = get_problem_info(contest_id, problem_index)
-            if problem_data is None:
-                print(f'[WARNING] Problem data for contest {contest_id}, index {problem_index} not found.')
-                return None
-            return problem_data.problem_rating
+    global accepted_max_by_handle
+    records = list()
+    for handle in handles:
+        accepted_max_by_handle.clear()
+        records.extend(build_handle_records(handle))
+        if len(records) >= config.DATASET_BATCH_ROWS:
+            yield pd.DataFrame(records)
+            records = list()
+    if records:
+        yield pd.DataFrame(records)
+
+def write_dataset_chunk(dataset_path, frames) -> int:
+    with storage.ParquetChunkWriter(dataset_path, get_dataset_schema(), config.DATASET_BATCH_ROWS) as writer:
+        for df in frames:
+            writer.write(df)
+    return writer.rows_written
+
+def build_dataset_group(i: int, group: list[str]):
+    dataset_path = get_dataset_path(i)
+    rows = write_dataset_chunk(dataset_path, iter_record_frames(group))
+    print(f"[INFO] Dataset {i} saved to {dataset_path} with {rows} records.")
+
+# config values a pool worker copies from the parent, which may have changed them at runtime
+WORKER_SETTINGS = [
+    'DATASET_DIR', 'DATASET_BUILD_ENGINE', 'DATASET_BUILD_OFFLINE', 'DATASET_BATCH_ROWS', 'DATASET_HANDLE_BATCH',
+]
+
+def _init_dataset_worker(settings: dict):
+    # pool workers start from a fresh interpreter, not a fork of the threaded parent, and load
+    # the small tables themselves; the rating timeline and results come from the exports
+    for name, value in settings.items():
+        setattr(config, name, value)
+    db_connection.set_read_only_mode(True)
+    init_dataset_builder()
 
-        df['problem_rating'] = df.apply(get_rating, axis=1)
-        df.dropna(subset=['problem_rating'], inplace=True)
-        df['problem_rating'] = df['problem_rating'].astype(int)
-        
-        cols = list(df.columns)
-        cols.remove('problem_rating')
-        cols.insert(3, 'problem_rating')
-        df = df[cols]
+def prepare_worker_inputs():
+    # exported once here, so every worker maps the same files instead of reading the dbs itself
+    if not rating_timeline.is_fresh():
+        rating_timeline.export()
+    if not columnar_store.is_export_fresh('contest_user_result'):
+        columnar_store.export_all()
+
+def _build_dataset_group_task(i: int, group: list[str]) -> int:
+    build_dataset_group(i, group)
+    return i
+
+def build_dataset_groups(
+    handle_groups: list[list[str]],
+    chunk_indices: list[int],
+    workers: Optional[int] = None,
+    on_done: Optional[Callable[[int], None]] = None,
+):
+    # every chunk only depends on its own group so the files come out the same whatever the
+    # worker count. tables are loaded in whichever processes build, run it under read_only_mode
+    workers = min(workers or config.DATASET_BUILD_WORKERS, len(chunk_indices))
+    if workers <= 1:
+        init_dataset_builder()
+        for i in chunk_indices:
+            build_dataset_group(i, handle_groups[i])
+            if on_done is not None:
+                on_done(i)
+        return
 
-        df.to_csv(file, index=False)
+    prepare_worker_inputs()
+    # forking a process that runs stage, retry and ingest threads can copy a held lock into the child
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    settings = {name: getattr(config, name) for name in WORKER_SETTINGS}
+    print(f"[INFO] Building {len(chunk_indices)} dataset groups with {workers} workers.")
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=context, initializer=_init_dataset_worker, initargs=(settings,)
+    ) as executor:
+        futures = [executor.submit(_build_dataset_group_task, i, handle_groups[i]) for i in chunk_indices]
+        for future in as_completed(futures):
+            i = future.result()
+            if on_done is not None:
+                on_done(i)
+
+def create_dataset(normalize: bool, chunk_idx: int = 0, random_seed: int = 42, workers: Optional[int] = None):
+    handle_groups = get_handle_groups(random_seed)
+    if config.DATASET_BUILD_OFFLINE:
+        backfill_build_inputs(list(itertools.chain.from_iterable(handle_groups[chunk_idx:])))
+    with db_connection.read_only_mode():
+        build_dataset_groups(handle_groups, list(range(chunk_idx, len(handle_groups))), workers)
+
+def rebuild_handles(handles: set[str], random_seed: int = 42):
+    # replace only the rows of the given handles in the chunks that hold them
+    if config.DATASET_BUILD_OFFLINE:
+        backfill_build_inputs(sorted(handles))
+    with db_connection.read_only_mode():
+        init_dataset_builder()
+        handle_groups = get_handle_groups(random_seed)
+
+        for i, group in enumerate(handle_groups):
+            affected = [handle for handle in group if handle in handles]
+            if not affected:
+                continue
+
+            dataset_path = get_dataset_path(i)
+            df = storage.load_parquet(dataset_path)
+            if df is None or 'handle_id' not in df.columns:
+                build_dataset_group(i, group)
+                continue
+
+            affected_ids = list(handle_dict.lookup_many(affected).values())
+            df = df[~df['handle_id'].isin(affected_ids)]
+            rows = write_dataset_chunk(dataset_path, itertools.chain([df], iter_record_frames(affected)))
+            print(f"[INFO] Dataset {i} updated for {len(affected)} handles with {rows - len(df)} records.")
 
 if __name__ == "__main__":
-    load_and_init_contest_problem_data()
-    insert_problem_rating()
+    create_dataset(normalize=False)
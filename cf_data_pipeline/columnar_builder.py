@@ -0,0 +1,179 @@
+from typing import Callable, Optional
+import numpy as np
+import pandas as pd
+import columnar_store
+import db_contest_user_result
+import handle_dict
+from accepted_max_table import AcceptedMaxTable
+from array_ops import make_key, lookup_sorted
+from contest_statistics import ContestStatisticsTable
+from rating_timeline import NULL_RATING, RatingTimeline
+from tag_encoding import TagEncoding
+
+
+# same columns, order and values as build_dataset.get_dataset_record, built a whole chunk at a time
+STAT_COLUMNS = [
+    'avg_rating_rated_only', 'median_rating_rated', '25th_percentile_rated', '75th_percentile_rated',
+    'count_total', 'count_unrated',
+]
+
+
+class ProblemTable:
+    # problem metadata as arrays sorted by (contest_id, problem_index)
+    def __init__(self, problem_data: dict, encoding: TagEncoding):
+        items = sorted(problem_data.values(), key=lambda p: (p.contest_id, p.problem_index))
+        self.keys = make_key([p.contest_id for p in items], [p.problem_index for p in items])
+        self.division_type = np.asarray([p.division_type for p in items])
+        self.problem_rating = np.asarray([p.problem_rating for p in items])
+        # masks come encoded from the problem data, the multi-hot matrix is expanded from them once
+        self.tag_masks = np.asarray([p.tag_mask for p in items], dtype=np.uint64)
+        self.tags = encoding.to_matrix(self.tag_masks).reshape(len(items), len(encoding))
+
+    def locate(self, contest_ids: np.ndarray, problem_indexes: np.ndarray) -> np.ndarray:
+        return lookup_sorted(self.keys, make_key(contest_ids, problem_indexes))
+
+
+def expand_masks(masks: list[tuple[int, int, int, int]]) -> dict[str, np.ndarray]:
+    # (handle_id, contest_id, solved_mask, problem_count) rows -> one row per problem
+    if not masks:
+        empty = np.zeros(0, dtype=np.int64)
+        return {'handle_id': empty, 'contest_id': empty, 'problem_index': empty, 'verdict': empty}
+    handle_ids, contest_ids, solved, counts = (np.asarray(col, dtype=object) for col in zip(*masks))
+    counts = counts.astype(np.int64)
+    starts = np.cumsum(counts) - counts
+    owner = np.repeat(np.arange(len(masks)), counts)
+    problem_index = np.arange(counts.sum()) - starts[owner]
+    if counts.max() < 63:
+        verdict = (solved.astype(np.int64)[owner] >> problem_index) & 1
+    else:
+        # masks wider than int64 stay python ints
+        verdict = np.asarray([(int(solved[o]) >> int(i)) & 1 for o, i in zip(owner, problem_index)], dtype=np.int64)
+    return {
+        'handle_id': handle_ids.astype(np.int64)[owner],
+        'contest_id': contest_ids.astype(np.int64)[owner],
+        'problem_index': problem_index,
+        'verdict': verdict,
+    }
+
+def build_accepted_max_table(
+    rows: dict[str, np.ndarray],
+    problem_pos: np.ndarray,
+    problems: ProblemTable,
+) -> AcceptedMaxTable:
+    # accepts whose problem is unknown are left out, like get_problem_info misses were
+    solved = (rows['verdict'] == 1) & (problem_pos >= 0)
+    ac_pos = problem_pos[solved]
+    return AcceptedMaxTable.from_accepted(
+        rows['handle_id'][solved],
+        rows['contest_id'][solved],
+        problems.problem_rating[ac_pos],
+        problems.tags[ac_pos],
+    )
+
+
+class ColumnarDatasetBuilder:
+    def __init__(
+        self,
+        problem_data: dict,
+        statistics: ContestStatisticsTable,
+        encoding: TagEncoding,
+        timeline: Optional[RatingTimeline] = None,
+        fetch_rating: Optional[Callable[[str], bool]] = None,
+    ):
+        self.tag_list = encoding.tag_list
+        self.problems = ProblemTable(problem_data, encoding)
+        self.statistics = statistics
+        # without a timeline every chunk reads the histories of its own handles
+        self.timeline = timeline
+        # called for handles with results but no rating history, True when something was stored
+        self.fetch_rating = fetch_rating
+        # results come from the parquet export while it matches the db, checked once per build
+        self.use_columnar = columnar_store.is_export_fresh('contest_user_result')
+
+    def read_rows(self, handles: list[str]) -> dict[str, np.ndarray]:
+        if self.use_columnar:
+            df = columnar_store.read_user_results(['handle_id', 'contest_id', 'problem_index_num', 'verdict'], handles)
+            return {
+                'handle_id': df['handle_id'].to_numpy(np.int64),
+                'contest_id': df['contest_id'].to_numpy(np.int64),
+                'problem_index': df['problem_index_num'].to_numpy(np.int64),
+                'verdict': df['verdict'].to_numpy(np.int64),
+            }
+        ids = handle_dict.lookup_many(handles)
+        return expand_masks(db_contest_user_result.get_masks_by_handle_ids(sorted(set(ids.values()))))
+
+    def load_rows(self, handles: list[str]) -> dict[str, np.ndarray]:
+        ids = handle_dict.lookup_many(handles)
+        rows = self.read_rows(handles)
+        # chunks list handles in group order, not id order
+        group_pos = {handle_id: pos for pos, handle_id in enumerate(ids[h] for h in handles if h in ids)}
+        rank = np.asarray([group_pos[h] for h in rows['handle_id'].tolist()], dtype=np.int64)
+        order = np.lexsort((rows['problem_index'], rows['contest_id'], rank))
+        return {name: col[order] for name, col in rows.items()}
+
+    def load_rating_timeline(self, rows: dict[str, np.ndarray], needed: np.ndarray) -> RatingTimeline:
+        handle_ids = np.unique(rows['handle_id'][needed])
+        timeline = self.timeline if self.timeline is not None else RatingTimeline.from_db(handle_ids.tolist())
+
+        missing = handle_ids[~timeline.has_handles(handle_ids)].tolist()
+        if not missing or self.fetch_rating is None:
+            return timeline
+        handles = handle_dict.get_handles(missing)
+        fetched = False
+        for handle_id in missing:
+            handle = handles.get(handle_id)
+            if handle is not None and self.fetch_rating(handle):
+                fetched = True
+            else:
+                print(f'[WARNING] before rating for {handle} is not found')
+        # fetched histories are newer than the shared timeline, reread the chunk's handles
+        return RatingTimeline.from_db(handle_ids.tolist()) if fetched else timeline
+
+    def build(self, handles: list[str]) -> pd.DataFrame:
+        rows = self.load_rows(handles)
+
+        problem_pos = self.problems.locate(rows['contest_id'], rows['problem_index'])
+        has_problem = problem_pos >= 0
+        if not has_problem.all():
+            missing = np.unique(rows['contest_id'][~has_problem])
+            print(f'[WARNING] {int((~has_problem).sum())} rows skipped, problem data not found for contests {missing.tolist()}')
+
+        timeline = self.load_rating_timeline(rows, has_problem)
+        rating = timeline.lookup(rows['handle_id'], rows['contest_id'])
+        stat_pos = self.statistics.locate(rows['contest_id'])
+        has_stats = stat_pos >= 0
+        lost = has_problem & rating['found'] & ~has_stats
+        if lost.any():
+            print(f'[WARNING] contest statistics not found for contests {np.unique(rows["contest_id"][lost]).tolist()}')
+
+        accepted_max_table = build_accepted_max_table(rows, problem_pos, self.problems)
+        keep = has_problem & rating['found'] & has_stats
+        problem_pos, stat_pos = problem_pos[keep], stat_pos[keep]
+        rating = {name: col[keep] for name, col in rating.items()}
+
+        old_rating = rating['old_rating'].astype(np.int64)
+        if (old_rating == NULL_RATING).any():
+            old_rating = np.where(old_rating == NULL_RATING, np.nan, old_rating)
+
+        columns = {
+            'contest_id': rows['contest_id'][keep],
+            'division_type': self.problems.division_type[problem_pos],
+            'problem_index': rows['problem_index'][keep],
+            'problem_rating': self.problems.problem_rating[problem_pos],
+            'handle_id': rows['handle_id'][keep],
+            'current_rating_before_contest': old_rating,
+            'max_rating_before_contest': rating['max_rating_before_contest'],
+            'recent_delta_avg': rating['recent_delta_avg'],
+        }
+        for col in STAT_COLUMNS:
+            columns[col] = self.statistics.column(col, stat_pos).astype(np.int64)
+        columns['unrated_ratio'] = self.statistics.column('unrated_ratio', stat_pos)
+
+        accepted_max = accepted_max_table.before(columns['handle_id'], columns['contest_id'])
+        problem_tags = self.problems.tags[problem_pos]
+        for i, tag in enumerate(self.tag_list):
+            columns[f'accepted_max_rating_{tag}'] = accepted_max[:, i]
+        for i, tag in enumerate(self.tag_list):
+            columns[f'problem_tag_{tag}'] = problem_tags[:, i]
+        columns['verdict'] = rows['verdict'][keep]
+        return pd.DataFrame(columns)
@@ -0,0 +1,235 @@
+import shutil
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import db_connection
+import db_contest_user_result
+import db_rating_change
+import handle_dict
+import storage
+from config import COLUMNAR_DATA_DIR, COLUMNAR_CONTEST_RANGE
+
+
+MANIFEST_NAME = 'export_manifest.json'
+# bumped whenever the exported columns change, older exports count as stale
+EXPORT_FORMAT = 2
+PARTITION_KEY = 'contest_range'
+EXPORT_FETCH_ROWS = 65536
+EXPORT_ROW_GROUP_ROWS = 1 << 20
+
+# table -> source db, columns and the order rows are written in
+TABLES = {
+    'contest_user_result': (
+        db_contest_user_result.db_path,
+        ['handle_id', 'contest_id', 'problem_index_num', 'problem_index_raw', 'verdict'],
+        ['handle_id', 'contest_id', 'problem_index_num'],
+    ),
+    'rating_changes': (
+        db_rating_change.db_path,
+        ['handle_id', 'contest_id', 'old_rating', 'new_rating'],
+        ['handle_id', 'contest_id'],
+    ),
+}
+
+# table the contest bounds are read from, and a cheap query that changes whenever the contents do.
+# rating rows are only ever inserted, so the last rowid is enough there
+SOURCES = {
+    'contest_user_result': ('contest_user_mask', 'SELECT COUNT(*), TOTAL(solved_mask) FROM contest_user_mask'),
+    'rating_changes': ('rating_changes', 'SELECT MAX(rowid) FROM rating_changes'),
+}
+
+SCHEMAS = {
+    'contest_user_result': pa.schema([
+        ('handle_id', pa.int32()),
+        ('contest_id', pa.int32()),
+        ('problem_index_num', pa.int8()),
+        ('problem_index_raw', pa.dictionary(pa.int8(), pa.string())),
+        ('verdict', pa.int8()),
+    ]),
+    'rating_changes': pa.schema([
+        ('handle_id', pa.int32()),
+        ('contest_id', pa.int32()),
+        ('old_rating', pa.int16()),
+        ('new_rating', pa.int16()),
+    ]),
+}
+
+
+def get_table_dir(table: str, out_dir: Path = COLUMNAR_DATA_DIR) -> Path:
+    return Path(out_dir) / table
+
+def get_range_start(contest_id: int, range_size: int = COLUMNAR_CONTEST_RANGE) -> int:
+    return contest_id // range_size * range_size
+
+def get_source_version(table: str) -> list:
+    db_path = TABLES[table][0]
+    if not Path(db_path).is_file():
+        return list()
+    conn = db_connection.get_connection(db_path)
+    return list(conn.execute(SOURCES[table][1]).fetchone())
+
+def _load_manifest(out_dir: Path) -> Optional[dict]:
+    path = Path(out_dir) / MANIFEST_NAME
+    return storage.load_json(path) if path.is_file() else None
+
+def _export_partition(conn, table: str, start: int, end: int, path: Path) -> int:
+    # rows come sorted from sqlite in batches and go out through a row group writer, so the
+    # partition is never held as python tuples. partitions without rows get no file
+    columns, sort_keys = TABLES[table][1], TABLES[table][2]
+    cursor = conn.execute(
+        f'SELECT {", ".join(columns)} FROM {table} WHERE contest_id >= ? AND contest_id < ? '
+        f'ORDER BY {", ".join(sort_keys)}',
+        (start, end)
+    )
+    writer = storage.ParquetChunkWriter(path, SCHEMAS[table], batch_rows=EXPORT_ROW_GROUP_ROWS)
+    rows = 0
+    try:
+        while True:
+            batch = cursor.fetchmany(EXPORT_FETCH_ROWS)
+            if not batch:
+                break
+            writer.write(pd.DataFrame.from_records(batch, columns=columns))
+            rows += len(batch)
+    except BaseException:
+        writer.abort()
+        raise
+    if rows == 0:
+        writer.abort()
+    else:
+        writer.close()
+    return rows
+
+def export_table(table: str, out_dir: Path = COLUMNAR_DATA_DIR, range_size: int = COLUMNAR_CONTEST_RANGE) -> int:
+    db_path = TABLES[table][0]
+    table_dir = get_table_dir(table, out_dir)
+    tmp_dir = table_dir.with_name(f'{table}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    conn = db_connection.get_connection(db_path)
+    lo, hi = conn.execute(f'SELECT MIN(contest_id), MAX(contest_id) FROM {SOURCES[table][0]}').fetchone()
+    total = 0
+    if lo is not None:
+        for start in range(get_range_start(lo, range_size), hi + 1, range_size):
+            partition_path = tmp_dir / f'{PARTITION_KEY}={start}' / 'part-0.parquet'
+            rows = _export_partition(conn, table, start, start + range_size, partition_path)
+            if not rows:
+                continue
+            total += rows
+            print(f'[columnar_store] {table} contests {start}-{start + range_size - 1}: {rows} rows')
+
+    shutil.rmtree(table_dir, ignore_errors=True)
+    tmp_dir.replace(table_dir)
+    return total
+
+def export_all(out_dir: Path = COLUMNAR_DATA_DIR, range_size: int = COLUMNAR_CONTEST_RANGE):
+    manifest = {'format': EXPORT_FORMAT, 'range_size': range_size, 'tables': dict()}
+    for table in TABLES:
+        if not Path(TABLES[table][0]).is_file():
+            print(f'[columnar_store] {TABLES[table][0]} not found, {table} skipped')
+            continue
+        version = get_source_version(table)
+        rows = export_table(table, out_dir, range_size)
+        manifest['tables'][table] = version
+        print(f'[columnar_store] exported {rows} rows of {table}')
+    storage.save_json(Path(out_dir) / MANIFEST_NAME, manifest)
+
+def is_export_fresh(table: str, out_dir: Path = COLUMNAR_DATA_DIR) -> bool:
+    manifest = _load_manifest(out_dir)
+    if manifest is None or manifest.get('format') != EXPORT_FORMAT or table not in manifest['tables']:
+        return False
+    return manifest['tables'][table] == get_source_version(table)
+
+def _dataset(table: str, out_dir: Path) -> ds.Dataset:
+    partitioning = ds.partitioning(pa.schema([(PARTITION_KEY, pa.int32())]), flavor='hive')
+    return ds.dataset(get_table_dir(table, out_dir), format='parquet', partitioning=partitioning)
+
+def _build_filter(
+    handles: Optional[list[str]],
+    contest_min: Optional[int],
+    contest_max: Optional[int],
+    range_size: int,
+) -> Optional[ds.Expression]:
+    # bounds on contest_range prune whole partitions, the rest is pushed down to row groups
+    expr = None
+    def add(e):
+        nonlocal expr
+        expr = e if expr is None else expr & e
+
+    if contest_min is not None:
+        add(ds.field(PARTITION_KEY) >= get_range_start(contest_min, range_size))
+        add(ds.field('contest_id') >= contest_min)
+    if contest_max is not None:
+        add(ds.field(PARTITION_KEY) <= get_range_start(contest_max, range_size))
+        add(ds.field('contest_id') <= contest_max)
+    if handles is not None:
+        add(ds.field('handle_id').isin(list(handle_dict.lookup_many(handles).values())))
+    return expr
+
+def read_table(
+    table: str,
+    columns: Optional[list[str]] = None,
+    handles: Optional[list[str]] = None,
+    contest_min: Optional[int] = None,
+    contest_max: Optional[int] = None,
+    filter: Optional[ds.Expression] = None,
+    out_dir: Path = COLUMNAR_DATA_DIR,
+) -> pa.Table:
+    manifest = _load_manifest(out_dir)
+    range_size = manifest['range_size'] if manifest else COLUMNAR_CONTEST_RANGE
+    expr = _build_filter(handles, contest_min, contest_max, range_size)
+    if filter is not None:
+        expr = filter if expr is None else expr & filter
+    columns = columns if columns is not None else TABLES[table][1]
+    return _dataset(table, out_dir).to_table(columns=columns, filter=expr)
+
+def read_user_results(
+    columns: Optional[list[str]] = None,
+    handles: Optional[list[str]] = None,
+    contest_min: Optional[int] = None,
+    contest_max: Optional[int] = None,
+    accepted_only: bool = False,
+    out_dir: Path = COLUMNAR_DATA_DIR,
+) -> pd.DataFrame:
+    verdict = ds.field('verdict') == 1 if accepted_only else None
+    return read_table(
+        'contest_user_result', columns, handles, contest_min, contest_max, verdict, out_dir
+    ).to_pandas()
+
+def read_rating_changes(
+    columns: Optional[list[str]] = None,
+    handles: Optional[list[str]] = None,
+    contest_min: Optional[int] = None,
+    contest_max: Optional[int] = None,
+    out_dir: Path = COLUMNAR_DATA_DIR,
+) -> pd.DataFrame:
+    return read_table('rating_changes', columns, handles, contest_min, contest_max, None, out_dir).to_pandas()
+
+def get_all_ac_submission_by_id(out_dir: Path = COLUMNAR_DATA_DIR) -> defaultdict:
+    # same shape as db_contest_user_result.get_all_ac_submission_by_id
+    df = read_user_results(['handle_id', 'contest_id', 'problem_index_num'], accepted_only=True, out_dir=out_dir)
+    df = df.sort_values(['handle_id', 'contest_id', 'problem_index_num'], kind='stable')
+
+    ret = defaultdict(list)
+    handle_ids = df['handle_id'].to_numpy()
+    pairs = list(zip(df['contest_id'].tolist(), df['problem_index_num'].tolist()))
+    if not pairs:
+        return ret
+    boundaries = [0, *(np.flatnonzero(handle_ids[1:] != handle_ids[:-1]) + 1).tolist(), len(handle_ids)]
+    for begin, end in zip(boundaries, boundaries[1:]):
+        ret[int(handle_ids[begin])] = pairs[begin:end]
+    return ret
+
+def get_all_ac_submission(out_dir: Path = COLUMNAR_DATA_DIR) -> defaultdict:
+    by_id = get_all_ac_submission_by_id(out_dir)
+    handle_dict.load_all()
+    handles = handle_dict.get_handles(by_id.keys())
+    return defaultdict(list, {handles[handle_id]: ac_list for handle_id, ac_list in by_id.items()})
+
+if __name__ == "__main__":
+    export_all()
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 
@@ -6,14 +7,71 @@ RATED_CONTEST_METADATA_BASENAME = "rated_contest_metadata"
 CONTEST_PROBLEMS_BASENAME = 'contest_problems_data'
 PROCESSED_BASENAME = 'processed_data'
 RES_CACHE_BASENAME = 'response_cache'
+CONTEST_MIN_DATE = '2020-01-01'
+CONTEST_MAX_DATE = '2025-03-01'
 SLEEP_TIME = 2.1
+API_CALL_RATE = 1 / SLEEP_TIME
+API_CALL_BURST = 1
+HTTP_POOL_SIZE = 8
+FETCH_MAX_IN_FLIGHT = 4
+STANDINGS_PAGE_SIZE = 2000
+# contest ids per parquet partition of the columnar export
+COLUMNAR_CONTEST_RANGE = 500
+# 'columnar' builds a chunk with array joins, 'rows' keeps the per-record builder
+DATASET_BUILD_ENGINE = 'columnar'
+# dataset chunks are parquet files written in row groups of this many rows, the columnar
+# builder works through a group this many handles at a time
+DATASET_BATCH_ROWS = 65536
+DATASET_HANDLE_BATCH = 256
+# the builder never fetches: missing problem data and rating histories are backfilled in one
+# batched pass before the build and rows still missing afterwards are skipped
+DATASET_BUILD_OFFLINE = os.environ.get('CF_DATASET_BUILD_OFFLINE', '1') != '0'
+# processes building dataset chunks, 1 builds them in this process
+DATASET_BUILD_WORKERS = int(os.environ.get('CF_DATASET_BUILD_WORKERS', os.cpu_count() or 1))
+SQLITE_CACHE_SIZE_KB = 256 * 1024
+SQLITE_MMAP_SIZE = 4 * 1024 ** 3
+SQLITE_CACHED_STATEMENTS = 256
+# the ingestion writer commits once this many rows are queued or after the interval
+INGEST_BATCH_ROWS = 200000
+INGEST_FLUSH_INTERVAL = 1.0
+INGEST_MAX_PENDING = 256
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 60 * 60
+RETRY_MAX_ATTEMPTS = 8
+RETRY_DRAIN_WORKERS = 2
+RES_CACHE_MAX_BYTES = 8 * 1024 ** 3
+RES_CACHE_UNFINISHED_TTL = 60 * 60
+# seconds per endpoint, None means the response never changes
+RES_CACHE_TTL = {
+    'contest.list': 24 * 60 * 60,
+    'user.ratedList': 7 * 24 * 60 * 60,
+    'contest.standings': None,
+    'contest.ratingChanges': None,
+    'user.rating': 24 * 60 * 60,
+    'user.status': 60 * 60,
+}
+DEFAULT_API_BASE_URL = 'https://codeforces.com/api'
+API_BASE_URL = os.environ.get('CF_API_BASE_URL', DEFAULT_API_BASE_URL)
 DB_RATING_NAME = 'cf_rating_changes.db'
 CONTEST_STATISTICS_NAME = 'contest_statistics.csv'
 DATA_PIPELINE_DIR = BASE_DIR / 'cf_data_pipeline'
-PROCESSED_DATA_DIR = DATA_PIPELINE_DIR / PROCESSED_BASENAME
-RES_CACHE_DATA_DIR = DATA_PIPELINE_DIR / RES_CACHE_BASENAME
+PROCESSED_DATA_DIR = Path(os.environ.get('CF_PROCESSED_DATA_DIR', DATA_PIPELINE_DIR / PROCESSED_BASENAME))
+RES_CACHE_DATA_DIR = Path(os.environ.get('CF_RES_CACHE_DATA_DIR', DATA_PIPELINE_DIR / RES_CACHE_BASENAME))
+# answers of another server, like fake_cf_server, must not end up in the real data or cache
+if API_BASE_URL != DEFAULT_API_BASE_URL and not (
+    'CF_PROCESSED_DATA_DIR' in os.environ and 'CF_RES_CACHE_DATA_DIR' in os.environ
+):
+    raise RuntimeError(
+        f'CF_API_BASE_URL is {API_BASE_URL}, set CF_PROCESSED_DATA_DIR and CF_RES_CACHE_DATA_DIR '
+        'to a separate directory as well'
+    )
 DATASET_DIR = BASE_DIR / 'dataset'
+COLUMNAR_DATA_DIR = PROCESSED_DATA_DIR / 'columnar'
+RATING_TIMELINE_DIR = PROCESSED_DATA_DIR / 'rating_timeline'
+FEATURE_STORE_DIR = PROCESSED_DATA_DIR / 'feature_store'
 RATING_DB_PATH = PROCESSED_DATA_DIR / DB_RATING_NAME
+SELECTED_USERS_PATH = PROCESSED_DATA_DIR / 'selected_users.csv'
 SAMPLED_HANDLE_PATH = PROCESSED_DATA_DIR / 'sampled_handles.csv'
 CONTEST_STATISTICS_PATH = PROCESSED_DATA_DIR / CONTEST_STATISTICS_NAME
 CONTEST_PROBLEMS_DATA_PATH = PROCESSED_DATA_DIR / f'{CONTEST_PROBLEMS_BASENAME}.json'
+RATED_CONTEST_METADATA_PATH = PROCESSED_DATA_DIR / f'{RATED_CONTEST_METADATA_BASENAME}.csv'
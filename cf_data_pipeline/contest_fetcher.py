@@ -1,9 +1,8 @@
 import pandas as pd
 from datetime import datetime
-import time
 from api_client import get_contest_list, safe_get_json
 from storage import save_csv, load_csv
-from config import PROCESSED_DATA_DIR, RATED_CONTEST_METADATA_BASENAME, SLEEP_TIME
+from config import PROCESSED_DATA_DIR, RATED_CONTEST_METADATA_BASENAME, API_BASE_URL, CONTEST_MIN_DATE, CONTEST_MAX_DATE
 from preprocess import get_division_type
 
 
@@ -33,7 +32,6 @@ def process_rated_contest_csv(min_date: str, max_date: str):
             'division_type': division,
             'contest_date': start_dt
         })
-        time.sleep(SLEEP_TIME)
 
     df = pd.DataFrame(result)
     save_path = PROCESSED_DATA_DIR / f'{RATED_CONTEST_METADATA_BASENAME}.csv'
@@ -45,7 +43,7 @@ def get_rated_contest_df() -> pd.DataFrame:
     df = load_csv(path)
     if df is None:
         print("Contest metadata not found. Fetching from API...")
-        process_rated_contest_csv('2020-01-01', '2025-03-01')
+        process_rated_contest_csv(CONTEST_MIN_DATE, CONTEST_MAX_DATE)
         df = load_csv(path)
     return df
 
@@ -74,7 +72,7 @@ def retry_failed_contests(failed_ids: list[int], existing_csv_path: str, save_cs
     }
 
     new_records = []
-    base_url = 'https://codeforces.com/api/contest.ratingChanges?contestId='
+    base_url = f'{API_BASE_URL}/contest.ratingChanges?contestId='
 
     for cid in ids_to_retry:
         url = f'{base_url}{cid}'
@@ -97,8 +95,6 @@ def retry_failed_contests(failed_ids: list[int], existing_csv_path: str, save_cs
             'contest_date': start_dt
         })
 
-        time.sleep(SLEEP_TIME)
-
     if new_records:
         df_new = pd.DataFrame(new_records)
         df_combined = pd.concat([existing_df, df_new], ignore_index=True)
@@ -1,10 +1,17 @@
-import time
+import asyncio
+from typing import Callable, Optional
 import pandas as pd
 from contest_fetcher import get_rated_contest_df
 import storage
 import api_client
 import db_contest_user_result
-from config import SLEEP_TIME, PROCESSED_DATA_DIR
+import db_rating_change
+import rating_change_fetcher
+import fetch_engine
+import ingest_writer
+import response_cache
+import retry_queue
+from config import CONTEST_STATISTICS_PATH, FETCH_MAX_IN_FLIGHT, STANDINGS_PAGE_SIZE
 
 
 def is_provisional_or_unrated_handle(handle: str) -> bool:
@@ -68,60 +75,178 @@ def get_records_from_contest_result(item: dict) -> list[tuple]:
             records.append(record)
     return records
 
-def process_contest_standings():
-    rated_contests = get_rated_contest_df()
-    contests = rated_contests['contest_id'].tolist()
+def fetch_contest_statistics(
+    contests: list[int],
+    max_in_flight: int = FETCH_MAX_IN_FLIGHT,
+    store_rating_changes: bool = True,
+    enqueue_failed: bool = True
+) -> tuple[list[dict], list[int]]:
     entity_list = list()
-    failed_cid = list()
-    total_failed = list()
 
-    for contest_id in contests:
-        res_rating_changes = api_client.get_contest_rating_changes(contest_id)
-        time.sleep(SLEEP_TIME)
-        if res_rating_changes is None:
-            failed_cid.append(contest_id)
-            continue
-        items = res_rating_changes['result']
-        entity = get_entity_from_rating_change(items)
-        print(f"[INFO] {contest_id} - {entity}")
-        entity_list.append(entity)
-    
-    for contest_id in failed_cid:
-        res_rating_changes = api_client.get_contest_rating_changes(contest_id)
-        if res_rating_changes is None:
-            total_failed.append(contest_id)
-            continue
-
-        time.sleep(SLEEP_TIME)
+    if store_rating_changes:
+        db_rating_change.init_db()
+
+    def on_rating_changes(contest_id: int, res_rating_changes: dict):
         items = res_rating_changes['result']
         entity = get_entity_from_rating_change(items)
         print(f"[INFO] {contest_id} - {entity}")
         entity_list.append(entity)
+        if store_rating_changes:
+            rating_change_fetcher.store_contest_rating_changes(res_rating_changes)
+
+    def make_jobs(contest_ids: list[int]) -> list:
+        return [(cid, api_client.get_contest_rating_changes_url(cid), 30) for cid in contest_ids]
+
+    total_failed = fetch_engine.run_fetch(make_jobs(contests), on_rating_changes, max_in_flight)
+    if store_rating_changes:
+        ingest_writer.flush()
+    if enqueue_failed:
+        retry_queue.enqueue_many(retry_queue.CONTEST_STATISTICS, total_failed)
+
+    # results arrive out of order, keep the csv in contest list order
+    order = {cid: i for i, cid in enumerate(contests)}
+    entity_list.sort(key=lambda e: order.get(e['contest_id'], len(order)))
+    return entity_list, total_failed
+
+def process_contest_standings(max_in_flight: int = FETCH_MAX_IN_FLIGHT, store_rating_changes: bool = True):
+    rated_contests = get_rated_contest_df()
+    contests = rated_contests['contest_id'].tolist()
+    entity_list, total_failed = fetch_contest_statistics(contests, max_in_flight, store_rating_changes)
 
     df = pd.DataFrame(entity_list)
-    contest_data_path = PROCESSED_DATA_DIR / f'contest_statistics.csv'
-    storage.save_csv(contest_data_path, df)
+    storage.save_csv(CONTEST_STATISTICS_PATH, df)
     print(f'Failed contests: {total_failed}')
+    response_cache.print_stats()
+
+def append_contest_statistics(
+    contests: list[int],
+    max_in_flight: int = FETCH_MAX_IN_FLIGHT,
+    enqueue_failed: bool = True
+) -> list[int]:
+    entity_list, total_failed = fetch_contest_statistics(contests, max_in_flight, enqueue_failed=enqueue_failed)
 
-def process_user_result():
+    df = storage.load_csv(CONTEST_STATISTICS_PATH)
+    df_new = pd.DataFrame(entity_list)
+    if len(df_new) == 0:
+        return total_failed
+    if df is not None:
+        df = pd.concat([df, df_new], ignore_index=True)
+        df.drop_duplicates(subset='contest_id', keep='last', inplace=True)
+    else:
+        df = df_new
+    storage.save_csv(CONTEST_STATISTICS_PATH, df)
+    print(f'[INFO] {len(df_new)} contest statistics appended, failed: {total_failed}')
+    return total_failed
+
+def process_user_result(max_in_flight: int = FETCH_MAX_IN_FLIGHT):
     db_contest_user_result.init_db()
 
     rated_contests = get_rated_contest_df()
     contests = rated_contests['contest_id'].tolist()
 
+    def on_standings(contest_id: int, data: dict):
+        records = get_records_from_contest_result(data['result'])
+        db_contest_user_result.submit_user_results(records)
+
+    jobs = list()
     for contest_id in contests:
-        data = api_client.get_contest_standings(
+        url, wait_time = api_client.get_contest_standings_url(
             contest_id,
             only_problems=False,
             show_unofficial=False,
             participant_types='CONTESTANT'
         )
-        time.sleep(SLEEP_TIME)
+        jobs.append((contest_id, url, wait_time))
 
+    failed = fetch_engine.run_fetch(jobs, on_standings, max_in_flight)
+    ingest_writer.flush()
+    for contest_id in failed:
+        print(f"[ERROR] Failed to fetch contest standings for {contest_id}")
+    retry_queue.enqueue_many(retry_queue.CONTEST_STANDINGS, failed)
+    response_cache.print_stats()
+
+async def stream_contest_user_result(
+    engine: fetch_engine.FetchEngine,
+    contest_id: int,
+    page_size: int,
+    on_committed: Optional[Callable[[], None]] = None,
+    on_failed: Optional[Callable[[], None]] = None
+) -> bool:
+    # on_committed runs once the last page of the contest is in the db, on_failed when the
+    # writer drops a page, which leaves the stored progress at the page before it
+    next_index, done = db_contest_user_result.get_standings_progress(contest_id)
+    if done and on_committed is not None:
+        on_committed()
+
+    lost = list()
+
+    def on_lost():
+        lost.append(contest_id)
+        if on_failed is not None:
+            on_failed()
+
+    while not done:
+        # later pages would only be refetched on resume, stop at the first lost one
+        if lost:
+            return False
+        url, wait_time = api_client.get_contest_standings_url(
+            contest_id,
+            from_index=next_index,
+            count=page_size,
+            show_unofficial=False,
+            participant_types='CONTESTANT'
+        )
+        # pages are only needed once, the progress table makes them resumable
+        data = await engine.fetch(url, wait_time, use_cache=False)
         if data is None:
-            print(f"[ERROR] Failed to fetch contest standings for {contest_id}")
-            continue
+            return False
+
+        page = data['result']
+        row_count = len(page['rows'])
+        records = get_records_from_contest_result(page)
+        del data, page
+
+        from_index = next_index
+        next_index += row_count
+        done = row_count < page_size
+        db_contest_user_result.submit_user_results_page(
+            contest_id, records, from_index, next_index, done, on_committed if done else None, on_lost
+        )
+    return True
+
+def process_user_result_streaming(
+    page_size: int = STANDINGS_PAGE_SIZE,
+    max_in_flight: int = FETCH_MAX_IN_FLIGHT,
+    contest_ids: Optional[list[int]] = None,
+    on_contest_done: Optional[Callable[[int], None]] = None,
+    enqueue_failed: bool = True,
+) -> list[int]:
+    db_contest_user_result.init_db()
+
+    if contest_ids is None:
+        rated_contests = get_rated_contest_df()
+        contest_ids = rated_contests['contest_id'].tolist()
+
+    # contests with a page the writer dropped, reported on the writer thread
+    lost = set()
+
+    async def run_contest(engine: fetch_engine.FetchEngine, contest_id: int) -> bool:
+        on_committed = None
+        if on_contest_done is not None:
+            # a dropped page is reported before the last page commits
+            on_committed = lambda: contest_id in lost or on_contest_done(contest_id)
+        on_failed = lambda: lost.add(contest_id)
+        return await stream_contest_user_result(engine, contest_id, page_size, on_committed, on_failed)
+
+    async def run() -> list[bool]:
+        engine = fetch_engine.FetchEngine(max_in_flight=max_in_flight)
+        return await asyncio.gather(*[run_contest(engine, contest_id) for contest_id in contest_ids])
 
-        data = data['result']
-        records = get_records_from_contest_result(data)
-        db_contest_user_result.insert_user_results(records)
+    results = asyncio.run(run())
+    ingest_writer.flush()
+    failed = [contest_id for contest_id, ok in zip(contest_ids, results) if not ok or contest_id in lost]
+    for contest_id in failed:
+        print(f"[ERROR] Failed to fetch contest standings for {contest_id}")
+    if enqueue_failed:
+        retry_queue.enqueue_many(retry_queue.CONTEST_STANDINGS, failed)
+    return failed
@@ -0,0 +1,72 @@
+import dataclasses
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+
+@dataclasses.dataclass
+class ContestStatisticsData:
+    contest_id: int
+    avg_rating_all: int
+    avg_rating_rated_only: int
+    median_rating_rated: int
+    percentile_rated_25th: int
+    percentile_rated_75th: int
+    std_rating_rated: float
+    count_total: int
+    count_unrated: int
+    unrated_ratio: float
+
+COLUMNS = [
+    'avg_rating_all', 'avg_rating_rated_only', 'median_rating_rated', '25th_percentile_rated',
+    '75th_percentile_rated', 'std_rating_rated', 'count_total', 'count_unrated', 'unrated_ratio',
+]
+
+
+class ContestStatisticsTable:
+    # contest statistics as column arrays, with a dense contest_id -> row array in front
+    def __init__(self, df: pd.DataFrame):
+        # a duplicated contest keeps its first row, like the old boolean scan did
+        df = df.drop_duplicates('contest_id', keep='first')
+        self.contest_ids = df['contest_id'].to_numpy(dtype=np.int64)
+        size = int(self.contest_ids.max()) + 1 if len(self.contest_ids) else 0
+        self.row_of = np.full(size, -1, dtype=np.int32)
+        self.row_of[self.contest_ids] = np.arange(len(self.contest_ids), dtype=np.int32)
+        self.columns = {col: df[col].to_numpy() for col in COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.contest_ids)
+
+    def locate(self, contest_ids) -> np.ndarray:
+        # row of every contest, -1 for contests without statistics
+        contest_ids = np.asarray(contest_ids, dtype=np.int64)
+        inside = (contest_ids >= 0) & (contest_ids < len(self.row_of))
+        rows = np.full(contest_ids.shape, -1, dtype=np.int32)
+        rows[inside] = self.row_of[contest_ids[inside]]
+        return rows
+
+    def row(self, contest_id: int) -> int:
+        if 0 <= contest_id < len(self.row_of):
+            return int(self.row_of[contest_id])
+        return -1
+
+    def column(self, name: str, rows: np.ndarray) -> np.ndarray:
+        return self.columns[name][rows]
+
+    def get(self, contest_id: int) -> Optional[ContestStatisticsData]:
+        row = self.row(contest_id)
+        if row < 0:
+            return None
+        col = self.columns
+        return ContestStatisticsData(
+            contest_id=contest_id,
+            avg_rating_all=int(col['avg_rating_all'][row]),
+            avg_rating_rated_only=int(col['avg_rating_rated_only'][row]),
+            median_rating_rated=int(col['median_rating_rated'][row]),
+            percentile_rated_25th=int(col['25th_percentile_rated'][row]),
+            percentile_rated_75th=int(col['75th_percentile_rated'][row]),
+            std_rating_rated=col['std_rating_rated'][row],
+            count_total=int(col['count_total'][row]),
+            count_unrated=int(col['count_unrated'][row]),
+            unrated_ratio=col['unrated_ratio'][row]
+        )
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Union
+from config import SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE, SQLITE_CACHED_STATEMENTS
+
+
+_local = threading.local()
+
+
+def set_read_only_mode(enabled: bool):
+    # dataset builds only read, so many processes can share one file without taking write locks.
+    # the mode belongs to the calling thread, writers on other threads keep their connections
+    _local.read_only = enabled
+
+def is_read_only_mode() -> bool:
+    return getattr(_local, 'read_only', False)
+
+@contextmanager
+def read_only_mode(enabled: bool = True):
+    # for threads that go on to other work afterwards, like the stage runner's
+    previous = is_read_only_mode()
+    set_read_only_mode(enabled)
+    try:
+        yield
+    finally:
+        set_read_only_mode(previous)
+
+def _open(db_path: Path, read_only: bool) -> sqlite3.Connection:
+    if read_only:
+        conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, cached_statements=SQLITE_CACHED_STATEMENTS)
+        conn.execute('PRAGMA query_only = ON')
+    else:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=60, cached_statements=SQLITE_CACHED_STATEMENTS)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+def get_connection(db_path: Union[str, Path], write: bool = False) -> sqlite3.Connection:
+    # one long-lived connection per thread, process and file; reopened after a fork
+    db_path = Path(db_path)
+    read_only = is_read_only_mode() and not write
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = dict()
+
+    key = (str(db_path.resolve()), read_only)
+    conn = _local.connections.get(key)
+    if conn is None:
+        conn = _open(db_path, read_only)
+        _local.connections[key] = conn
+    return conn
+
+def close_all():
+    connections = getattr(_local, 'connections', None)
+    if not connections or getattr(_local, 'pid', None) != os.getpid():
+        return
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
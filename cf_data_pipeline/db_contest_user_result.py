@@ -1,83 +1,337 @@
-import sqlite3
-from typing import Optional
+import db_connection
+import db_migration
+import handle_dict
+import ingest_writer
+from typing import Callable, Optional
 from collections import defaultdict
 import config
 
 db_path = config.PROCESSED_DATA_DIR / 'contest_user_result.db'
+# solved masks are sqlite's signed 64-bit INTEGER, bit 63 is the sign bit.
+# problems at this index or later are skipped and logged instead of failing the whole write
+MASK_BITS = 63
 
 
-def init_db():
-    if db_path.is_file():
-        print(f'{db_path} already exist.')
-        return
+def _intern_handles(conn):
+    handle_dict.replace_handle_column(conn, 'contest_user_result', '''
+        CREATE TABLE contest_user_result_new (
+            handle_id INTEGER NOT NULL,
+            contest_id INTEGER NOT NULL,
+            problem_index_num INTEGER NOT NULL,
+            problem_index_raw TEXT NOT NULL,
+            verdict INTEGER NOT NULL,
+            PRIMARY KEY (contest_id, handle_id, problem_index_num)
+        )
+    ''', ['contest_id', 'problem_index_num', 'problem_index_raw', 'verdict'])
+    conn.execute('''
+        CREATE INDEX idx_user_result_handle
+        ON contest_user_result(handle_id, contest_id, verdict, problem_index_num, problem_index_raw)
+    ''')
+
+def _pack_verdicts(conn):
+    # one bitmask per (handle, contest), bit i set when problem i was solved
+    conn.execute('''
+        CREATE TABLE contest_problems (
+            contest_id INTEGER NOT NULL,
+            problem_index_num INTEGER NOT NULL,
+            problem_index_raw TEXT NOT NULL,
+            PRIMARY KEY (contest_id, problem_index_num)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE contest_user_mask (
+            handle_id INTEGER NOT NULL,
+            contest_id INTEGER NOT NULL,
+            solved_mask INTEGER NOT NULL,
+            problem_count INTEGER NOT NULL,
+            PRIMARY KEY (handle_id, contest_id)
+        ) WITHOUT ROWID
+    ''')
+    wide = [row[0] for row in conn.execute(
+        'SELECT DISTINCT contest_id FROM contest_user_result WHERE problem_index_num >= ?', (MASK_BITS,)
+    )]
+    if wide:
+        print(f'[migration] problems from index {MASK_BITS} on do not fit a mask, skipped in contests {wide}')
+    conn.execute('''
+        INSERT OR IGNORE INTO contest_problems(contest_id, problem_index_num, problem_index_raw)
+        SELECT contest_id, problem_index_num, MIN(problem_index_raw)
+        FROM contest_user_result WHERE problem_index_num < ? GROUP BY contest_id, problem_index_num
+    ''', (MASK_BITS,))
+    conn.execute('''
+        INSERT INTO contest_user_mask(handle_id, contest_id, solved_mask, problem_count)
+        SELECT handle_id, contest_id,
+            SUM(CASE WHEN verdict = 1 THEN 1 << problem_index_num ELSE 0 END),
+            MAX(problem_index_num) + 1
+        FROM contest_user_result WHERE problem_index_num < ? GROUP BY handle_id, contest_id
+    ''', (MASK_BITS,))
+    conn.execute('CREATE INDEX idx_user_mask_contest ON contest_user_mask(contest_id)')
+    conn.execute('DROP TABLE contest_user_result')
+    # row-shaped view for ad hoc queries and the columnar export
+    conn.execute('''
+        CREATE VIEW contest_user_result AS
+        SELECT m.handle_id, m.contest_id, p.problem_index_num, p.problem_index_raw,
+            (m.solved_mask >> p.problem_index_num) & 1 AS verdict
+        FROM contest_user_mask m
+        JOIN contest_problems p ON p.contest_id = m.contest_id AND p.problem_index_num < m.problem_count
+    ''')
 
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    with sqlite3.connect(db_path) as conn:
+MIGRATIONS: list[db_migration.Migration] = [
+    (1, 'create contest_user_result and standings_progress', [
         '''
-        entity = {
-                    'contest_id': contest_id,
-                    'handle': handle,
-                }
-                entity['problem_index_num'] = idx
-                entity['problem_index_raw'] = problems[idx]['index']
-                entity['verdict'] = 1 if item['points'] > 0 else 0
+        CREATE TABLE IF NOT EXISTS contest_user_result (
+            handle TEXT NOT NULL,
+            contest_id INTEGER NOT NULL,
+            problem_index_num INTEGER NOT NULL,
+            problem_index_raw TEXT NOT NULL,
+            verdict INTEGER NOT NULL,
+            PRIMARY KEY (contest_id, handle, problem_index_num)
+        )
+        ''',
+        # next standings index (1-based) to fetch for contests ingested page by page
         '''
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS contest_user_result (
-                handle TEXT NOT NULL,
-                contest_id INTEGER NOT NULL,
-                problem_index_num INTEGER NOT NULL,
-                problem_index_raw TEXT NOT NULL,
-                verdict INTEGER NOT NULL,
-                PRIMARY KEY (contest_id, handle, problem_index_num)
-            )
-        ''')
+        CREATE TABLE IF NOT EXISTS standings_progress (
+            contest_id INTEGER PRIMARY KEY,
+            next_index INTEGER NOT NULL,
+            done INTEGER NOT NULL
+        )
+        ''',
+    ]),
+    # the dataset builder reads by handle, the primary key leads with contest_id.
+    # the index carries every column so handle lookups never touch the table.
+    (2, 'add handle-first covering index', [
+        '''
+        CREATE INDEX IF NOT EXISTS idx_user_result_handle
+        ON contest_user_result(handle, contest_id, verdict, problem_index_num, problem_index_raw)
+        ''',
+    ]),
+    (3, 'analyze', ['ANALYZE']),
+    (4, 'store handle ids from handle_dict', _intern_handles),
+    (5, 'analyze', ['ANALYZE']),
+    (6, 'pack verdicts into per-contest bitmasks', _pack_verdicts),
+    (7, 'analyze', ['ANALYZE']),
+]
+
+HOT_QUERIES: dict[str, tuple[str, tuple]] = {
+    'get_masks_by_handle_id': (
+        'SELECT contest_id, solved_mask, problem_count FROM contest_user_mask WHERE handle_id = ? ORDER BY contest_id',
+        (1,)
+    ),
+    'get_accepted_problems_before_contest': (
+        'SELECT contest_id, solved_mask FROM contest_user_mask WHERE handle_id = ? AND contest_id < ? AND solved_mask != 0',
+        (1, 2000)
+    ),
+    'get_verdict': (
+        'SELECT solved_mask, problem_count FROM contest_user_mask WHERE handle_id = ? AND contest_id = ?',
+        (1, 2000)
+    ),
+    'get_handles_in_contests': ('SELECT handle_id FROM contest_user_mask WHERE contest_id = ?', (2000,)),
+}
+
+
+INSERT_PROBLEM_SQL = '''
+    INSERT OR IGNORE INTO contest_problems(contest_id, problem_index_num, problem_index_raw)
+    VALUES (?, ?, ?)'''
+# a solved bit is never cleared, so replaying a page is harmless
+UPSERT_MASK_SQL = '''
+    INSERT INTO contest_user_mask(handle_id, contest_id, solved_mask, problem_count)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(handle_id, contest_id) DO UPDATE SET
+        solved_mask = solved_mask | excluded.solved_mask,
+        problem_count = MAX(problem_count, excluded.problem_count)'''
+UPSERT_PROGRESS_SQL = '''
+    INSERT OR REPLACE INTO standings_progress(contest_id, next_index, done)
+    VALUES (?, ?, ?)'''
+# a queued page only moves the progress on from where the page before it left off, so a page
+# after one the writer dropped cannot carry the progress past the lost rows
+START_PROGRESS_SQL = '''
+    INSERT OR IGNORE INTO standings_progress(contest_id, next_index, done)
+    VALUES (?, 1, 0)'''
+ADVANCE_PROGRESS_SQL = '''
+    UPDATE standings_progress SET next_index = ?, done = ?
+    WHERE contest_id = ? AND next_index = ?'''
+
+# contest_id -> problem_index_raw by problem_index_num
+_problem_index_raw: dict[int, list[str]] = dict()
+
+
+def init_db():
+    db_migration.migrate(db_path, MIGRATIONS)
+
+def pack_records(records: list[tuple]) -> list[tuple[str, list]]:
+    # records are (handle, contest_id, problem_index_num, problem_index_raw, verdict) rows
+    masks = dict()
+    problems = set()
+    wide = set()
+    for handle, contest_id, problem_index_num, problem_index_raw, verdict in records:
+        if problem_index_num >= MASK_BITS:
+            wide.add(contest_id)
+            continue
+        mask, count = masks.get((handle, contest_id), (0, 0))
+        if verdict == 1:
+            mask |= 1 << problem_index_num
+        masks[(handle, contest_id)] = (mask, max(count, problem_index_num + 1))
+        problems.add((contest_id, problem_index_num, problem_index_raw))
+    if wide:
+        print(f'[WARNING] problems from index {MASK_BITS} on do not fit a mask, skipped in contests {sorted(wide)}')
+
+    ids = handle_dict.intern_many(handle for handle, _ in masks)
+    return [
+        (INSERT_PROBLEM_SQL, sorted(problems)),
+        (UPSERT_MASK_SQL, [(ids[handle], contest_id, mask, count) for (handle, contest_id), (mask, count) in masks.items()]),
+    ]
+
+def _execute(statements: list[tuple[str, list]]):
+    with db_connection.get_connection(db_path, write=True) as conn:
+        for sql, rows in statements:
+            conn.executemany(sql, rows)
         conn.commit()
 
 def insert_user_result(record: tuple):
-    with sqlite3.connect(db_path) as conn:
-        conn.execute('''
-            INSERT OR IGNORE INTO contest_user_result(handle, contest_id, problem_index_num, problem_index_raw, verdict)
-            VALUES (?, ?, ?, ?, ?)''', record)
-        conn.commit()
+    _execute(pack_records([record]))
 
 def insert_user_results(records: list):
-    with sqlite3.connect(db_path) as conn:
-        conn.executemany('''
-            INSERT OR IGNORE INTO contest_user_result(handle, contest_id, problem_index_num, problem_index_raw, verdict)
-            VALUES (?, ?, ?, ?, ?)''', records)
-        conn.commit()
+    _execute(pack_records(records))
+
+def insert_user_results_page(contest_id: int, records: list, next_index: int, done: bool):
+    # rows and progress share one transaction so a crash never skips or half-writes a page
+    _execute(pack_records(records) + [(UPSERT_PROGRESS_SQL, [(contest_id, next_index, 1 if done else 0)])])
+
+def submit_user_results(records: list, on_commit: Optional[Callable[[], None]] = None):
+    ingest_writer.submit(db_path, pack_records(records), on_commit)
+
+def submit_user_results_page(
+    contest_id: int,
+    records: list,
+    from_index: int,
+    next_index: int,
+    done: bool,
+    on_commit: Optional[Callable[[], None]] = None,
+    on_failure: Optional[Callable[[], None]] = None,
+):
+    # same guarantee as insert_user_results_page, rows and progress commit together.
+    # on_failure runs when the writer drops the page
+    ingest_writer.submit(
+        db_path,
+        pack_records(records) + [
+            (START_PROGRESS_SQL, [(contest_id,)]),
+            (ADVANCE_PROGRESS_SQL, [(next_index, 1 if done else 0, contest_id, from_index)]),
+        ],
+        on_commit,
+        on_failure,
+    )
+
+def get_standings_progress(contest_id: int) -> tuple[int, bool]:
+    with db_connection.get_connection(db_path) as conn:
+        cursor = conn.execute('SELECT next_index, done FROM standings_progress WHERE contest_id = ?', (contest_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return 1, False
+        return row[0], bool(row[1])
+
+def get_handles_in_contests(contest_ids: list[int]) -> set[str]:
+    with db_connection.get_connection(db_path) as conn:
+        handle_ids = set()
+        for contest_id in contest_ids:
+            cursor = conn.execute('SELECT handle_id FROM contest_user_mask WHERE contest_id = ?', (contest_id,))
+            handle_ids.update(row[0] for row in cursor.fetchall())
+        return set(handle_dict.get_handles(handle_ids).values())
+
+def get_problem_index_raw(contest_id: int) -> list[str]:
+    index_raw = _problem_index_raw.get(contest_id)
+    if index_raw is None:
+        with db_connection.get_connection(db_path) as conn:
+            cursor = conn.execute('''
+                SELECT problem_index_raw FROM contest_problems WHERE contest_id = ? ORDER BY problem_index_num
+            ''', (contest_id,))
+            index_raw = [row[0] for row in cursor.fetchall()]
+        if index_raw:
+            _problem_index_raw[contest_id] = index_raw
+    return index_raw
+
+def get_masks_by_handle_id(handle_id: int) -> list[tuple[int, int, int]]:
+    # (contest_id, solved_mask, problem_count) in contest order
+    with db_connection.get_connection(db_path) as conn:
+        cursor = conn.execute('''
+            SELECT contest_id, solved_mask, problem_count FROM contest_user_mask WHERE handle_id = ? ORDER BY contest_id
+        ''', (handle_id,))
+        return cursor.fetchall()
+
+def get_masks_by_handle_ids(handle_ids: list[int], batch_size: int = 500) -> list[tuple[int, int, int, int]]:
+    # (handle_id, contest_id, solved_mask, problem_count) ordered by handle_id and contest
+    rows = list()
+    with db_connection.get_connection(db_path) as conn:
+        for i in range(0, len(handle_ids), batch_size):
+            batch = handle_ids[i:i + batch_size]
+            cursor = conn.execute(f'''
+                SELECT handle_id, contest_id, solved_mask, problem_count FROM contest_user_mask
+                WHERE handle_id IN ({",".join("?" * len(batch))})
+            ''', batch)
+            rows.extend(cursor.fetchall())
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return rows
+
+def get_user_results_by_handle_id(handle_id: int) -> list[tuple]:
+    # expands the masks back into (handle_id, contest_id, problem_index_num, problem_index_raw, verdict) rows
+    rows = list()
+    for contest_id, mask, count in get_masks_by_handle_id(handle_id):
+        index_raw = get_problem_index_raw(contest_id)
+        for idx in range(count):
+            rows.append((handle_id, contest_id, idx, index_raw[idx], (mask >> idx) & 1))
+    return rows
+
+def get_user_results_by_handle(handle: str) -> list[tuple]:
+    handle_id = handle_dict.lookup(handle)
+    if handle_id is None:
+        return list()
+    return [(handle, *row[1:]) for row in get_user_results_by_handle_id(handle_id)]
+
+def iter_solved(mask: int):
+    idx = 0
+    while mask:
+        if mask & 1:
+            yield idx
+        mask >>= 1
+        idx += 1
 
 def get_accepted_problems_before_contest(handle: str, contest_id: int) -> Optional[list]:
-    with sqlite3.connect(db_path) as conn:
+    handle_id = handle_dict.lookup(handle)
+    if handle_id is None:
+        return list()
+    with db_connection.get_connection(db_path) as conn:
         cursor = conn.execute('''
-            SELECT contest_id, problem_index_num FROM contest_user_result WHERE handle = ? AND verdict = 1 AND contest_id < ?
-        ''', (handle, contest_id))
-        rows = cursor.fetchall()
-        return rows
-    
-def get_all_ac_submission() -> Optional[defaultdict]:
-    with sqlite3.connect(db_path) as conn:
+            SELECT contest_id, solved_mask FROM contest_user_mask
+            WHERE handle_id = ? AND contest_id < ? AND solved_mask != 0 ORDER BY contest_id
+        ''', (handle_id, contest_id))
+        return [(cid, idx) for cid, mask in cursor.fetchall() for idx in iter_solved(mask)]
+
+def get_all_ac_submission_by_id() -> Optional[defaultdict]:
+    with db_connection.get_connection(db_path) as conn:
+        # primary key order, so every list comes out sorted by (contest_id, problem_index_num)
         cursor = conn.execute('''
-            SELECT handle, contest_id, problem_index_num FROM contest_user_result WHERE verdict = 1
+            SELECT handle_id, contest_id, solved_mask FROM contest_user_mask WHERE solved_mask != 0
         ''')
-        rows = cursor.fetchall()
-
         ret = defaultdict(list)
-        for handle, contest_id, problem_index_num in rows:
-            ret[handle].append((contest_id, problem_index_num))
-
-        for ac_list in ret.values():
-            ac_list.sort()
-
+        for handle_id, contest_id, mask in cursor:
+            ac_list = ret[handle_id]
+            for idx in iter_solved(mask):
+                ac_list.append((contest_id, idx))
         return ret
 
+def get_all_ac_submission() -> Optional[defaultdict]:
+    by_id = get_all_ac_submission_by_id()
+    handle_dict.load_all()
+    handles = handle_dict.get_handles(by_id.keys())
+    return defaultdict(list, {handles[handle_id]: ac_list for handle_id, ac_list in by_id.items()})
+
 def get_verdict(handle: str, contest_id: int, problem_index_num: int) -> int:
-    with sqlite3.connect(db_path) as conn:
+    handle_id = handle_dict.lookup(handle)
+    if handle_id is None:
+        return -1
+    with db_connection.get_connection(db_path) as conn:
         cursor = conn.execute('''
-            SELECT verdict FROM contest_user_result WHERE handle = ? AND contest_id = ? AND problem_index_num = ?
-        ''', (handle, contest_id, problem_index_num))
+            SELECT solved_mask, problem_count FROM contest_user_mask WHERE handle_id = ? AND contest_id = ?
+        ''', (handle_id, contest_id))
         row = cursor.fetchone()
-        if row is not None:
-            return row[0]
-    return -1
\ No newline at end of file
+        if row is not None and problem_index_num < row[1]:
+            return (row[0] >> problem_index_num) & 1
+    return -1
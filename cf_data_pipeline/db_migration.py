@@ -0,0 +1,64 @@
+from pathlib import Path
+from typing import Callable, Union
+import sqlite3
+import threading
+import db_connection
+
+
+# (version, description, statements or a callable taking the connection)
+Migration = tuple[int, str, Union[list[str], Callable[[sqlite3.Connection], None]]]
+
+# init_db is called from several stage threads, and a migration may migrate another db
+_lock = threading.RLock()
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(db_path: Union[str, Path], migrations: list[Migration]) -> int:
+    db_path = Path(db_path)
+    with _lock:
+        return _migrate(db_path, migrations)
+
+def _migrate(db_path: Path, migrations: list[Migration]) -> int:
+    conn = db_connection.get_connection(db_path, write=True)
+    version = get_version(conn)
+
+    for target, description, step in sorted(migrations, key=lambda m: m[0]):
+        if target <= version:
+            continue
+        print(f'[migration] {db_path.name}: {version} -> {target} {description}')
+        with conn:
+            if callable(step):
+                step(conn)
+            else:
+                for statement in step:
+                    conn.execute(statement)
+            # PRAGMA does not take parameters, the version is always an int
+            conn.execute(f'PRAGMA user_version = {int(target)}')
+        version = target
+    return version
+
+def explain_query_plan(db_path: Union[str, Path], qry: str, params: tuple = ()) -> list[str]:
+    conn = db_connection.get_connection(db_path)
+    cursor = conn.execute(f'EXPLAIN QUERY PLAN {qry}', params)
+    return [row[-1] for row in cursor.fetchall()]
+
+def report_query_plans(db_path: Union[str, Path], queries: dict[str, tuple[str, tuple]]):
+    for name, (qry, params) in queries.items():
+        print(f'[query plan] {Path(db_path).name} {name}')
+        for line in explain_query_plan(db_path, qry, params):
+            print(f'    {line}')
+
+def report_hot_query_plans():
+    import db_contest_user_result
+    import db_rating_change
+    report_query_plans(db_contest_user_result.db_path, db_contest_user_result.HOT_QUERIES)
+    report_query_plans(db_rating_change.db_path, db_rating_change.HOT_QUERIES)
+
+if __name__ == "__main__":
+    import db_contest_user_result
+    import db_rating_change
+    db_contest_user_result.init_db()
+    db_rating_change.init_db()
+    report_hot_query_plans()
@@ -1,5 +1,10 @@
-import sqlite3
-from typing import Optional
+import db_connection
+import db_migration
+import handle_dict
+import ingest_writer
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Optional
 from dataclasses import dataclass
 from config import DB_RATING_NAME, PROCESSED_DATA_DIR
 
@@ -11,42 +16,104 @@ class RatingChange:
     old_rating: int
     new_rating: int
 
+@dataclass
+class RatingFeatures:
+    old_rating: Optional[int]
+    new_rating: Optional[int]
+    max_rating_before_contest: int
+    recent_delta_avg: int
+
+def _intern_handles(conn):
+    handle_dict.replace_handle_column(conn, 'rating_changes', '''
+        CREATE TABLE rating_changes_new (
+            handle_id INTEGER NOT NULL,
+            contest_id INTEGER NOT NULL,
+            old_rating INTEGER,
+            new_rating INTEGER,
+            PRIMARY KEY (handle_id, contest_id)
+        )
+    ''', ['contest_id', 'old_rating', 'new_rating'])
+
+MIGRATIONS: list[db_migration.Migration] = [
+    (1, 'create rating_changes', [
+        '''
+        CREATE TABLE IF NOT EXISTS rating_changes (
+            handle TEXT NOT NULL,
+            contest_id INTEGER NOT NULL,
+            old_rating INTEGER,
+            new_rating INTEGER,
+            PRIMARY KEY (handle, contest_id)
+        )
+        ''',
+    ]),
+    # the primary key already leads with handle, statistics let the planner prefer it
+    (2, 'analyze', ['ANALYZE']),
+    (3, 'store handle ids from handle_dict', _intern_handles),
+    (4, 'analyze', ['ANALYZE']),
+]
+
+HOT_QUERIES: dict[str, tuple[str, tuple]] = {
+    'get_rating_history': (
+        'SELECT contest_id, old_rating, new_rating FROM rating_changes WHERE handle_id = ? ORDER BY contest_id',
+        (1,)
+    ),
+    'get_max_rating_before_contest': (
+        'SELECT MAX(new_rating), MAX(old_rating) FROM rating_changes WHERE handle_id = ? AND contest_id < ?',
+        (1, 2000)
+    ),
+    'get_contest_rating_entity': (
+        'SELECT old_rating, new_rating FROM rating_changes WHERE handle_id = ? AND contest_id = ?',
+        (1, 2000)
+    ),
+}
+
+
+INSERT_RATING_CHANGE_SQL = '''
+    INSERT OR IGNORE INTO rating_changes(handle_id, contest_id, old_rating, new_rating)
+    VALUES (?, ?, ?, ?)'''
+
+
 def init_db():
-    if db_path.is_file():
-        print(f'{DB_RATING_NAME} already exist.')
-        return
-    
-    db_path.parent.mkdir(parents=True, exist_ok=True)
-    with sqlite3.connect(db_path) as conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS rating_changes (
-                handle TEXT NOT NULL,
-                contest_id INTEGER NOT NULL,
-                old_rating INTEGER,
-                new_rating INTEGER,
-                PRIMARY KEY (handle, contest_id)
-            )
-        ''')
-        conn.commit()
+    db_migration.migrate(db_path, MIGRATIONS)
 
 def insert_rating_changes(records: list):
-    with sqlite3.connect(db_path) as conn:
-        conn.executemany('''
-            INSERT OR IGNORE INTO rating_changes(handle, contest_id, old_rating, new_rating)
-            VALUES (?, ?, ?, ?)''', records)
+    with db_connection.get_connection(db_path, write=True) as conn:
+        conn.executemany(INSERT_RATING_CHANGE_SQL, handle_dict.encode_records(records))
         conn.commit()
 
+def submit_rating_changes(records: list, on_commit: Optional[Callable[[], None]] = None):
+    ingest_writer.submit(db_path, [(INSERT_RATING_CHANGE_SQL, handle_dict.encode_records(records))], on_commit)
+
+# every history starts at old_rating 0, a handle whose first stored contest does not was only
+# seen in the bulk contest.ratingChanges ingest and still lacks the contests before that window.
+# sqlite takes old_rating from the row that holds MIN(contest_id)
+COMPLETE_HISTORY_SQL = '''
+    SELECT handle_id, MIN(contest_id), old_rating FROM rating_changes
+    WHERE handle_id IN ({}) GROUP BY handle_id
+'''
+
+# an unknown handle looks up as None, which matches no row
 def has_rating_data(handle: str) -> bool:
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.execute('SELECT 1 FROM rating_changes WHERE handle = ? LIMIT 1', (handle,))
-        return cursor.fetchone() is not None
+    return handle in get_handles_with_rating_data([handle])
+
+def get_handles_with_rating_data(handles: list[str], batch_size: int = 500) -> set[str]:
+    # handles whose whole history is stored, the others need user.rating
+    ids = handle_dict.lookup_many(handles)
+    handle_ids = list(ids.values())
+    stored = set()
+    with db_connection.get_connection(db_path) as conn:
+        for i in range(0, len(handle_ids), batch_size):
+            batch = handle_ids[i:i + batch_size]
+            cursor = conn.execute(COMPLETE_HISTORY_SQL.format(",".join("?" * len(batch))), batch)
+            stored.update(handle_id for handle_id, _, old_rating in cursor.fetchall() if old_rating == 0)
+    return {handle for handle, handle_id in ids.items() if handle_id in stored}
 
 def get_contest_rating_entity(handle: str, contest_id: int) -> Optional[RatingChange]:
-    with sqlite3.connect(db_path) as conn:
+    with db_connection.get_connection(db_path) as conn:
         qry = '''
-            SELECT old_rating, new_rating FROM rating_changes WHERE handle = ? AND contest_id = ?
+            SELECT old_rating, new_rating FROM rating_changes WHERE handle_id = ? AND contest_id = ?
         '''
-        cursor = conn.execute(qry, (handle, contest_id))
+        cursor = conn.execute(qry, (handle_dict.lookup(handle), contest_id))
         row = cursor.fetchone()
         if row is not None:
             return RatingChange(
@@ -56,36 +123,162 @@ def get_contest_rating_entity(handle: str, contest_id: int) -> Optional[RatingCh
     return None
 
 def is_provisional_handle(handle: str) -> bool:
-    with sqlite3.connect(db_path) as conn:
+    with db_connection.get_connection(db_path) as conn:
         cursor = conn.execute('''
-            SELECT COUNT(*) FROM rating_changes WHERE handle = ?
-        ''', (handle,))
+            SELECT COUNT(*) FROM rating_changes WHERE handle_id = ?
+        ''', (handle_dict.lookup(handle),))
         count = cursor.fetchone()[0]
         return count < 5
     
 def get_recent_delta_avg(handle: str, pivot_contest_id: int, count: int = 3) -> int:
-    with sqlite3.connect(db_path) as conn:
+    with db_connection.get_connection(db_path) as conn:
         delta_qry = '''
             SELECT AVG(delta) FROM (
                 SELECT new_rating - old_rating AS delta
                 FROM rating_changes
-                WHERE handle = ? AND contest_id < ?
+                WHERE handle_id = ? AND contest_id < ?
                 ORDER BY contest_id DESC
                 LIMIT ?
             )
         '''
-        cursor = conn.execute(delta_qry, (handle, pivot_contest_id, count))
+        cursor = conn.execute(delta_qry, (handle_dict.lookup(handle), pivot_contest_id, count))
         row = cursor.fetchone()
         delta_avg = row[0] if row[0] is not None else 0
         return int(delta_avg)
     
 def get_max_rating_before_contest(handle: str, contest_id: int) -> int:
-    with sqlite3.connect(db_path) as conn:
+    with db_connection.get_connection(db_path) as conn:
         cursor = conn.execute('''
-            SELECT MAX(new_rating), MAX(old_rating) FROM rating_changes WHERE handle = ? AND contest_id < ?
-        ''', (handle, contest_id))
+            SELECT MAX(new_rating), MAX(old_rating) FROM rating_changes WHERE handle_id = ? AND contest_id < ?
+        ''', (handle_dict.lookup(handle), contest_id))
         row = cursor.fetchone()
         rating = row[0] if row[0] is not None else 0
         if row[1] is not None and row[1] > rating:
             rating = row[1]
         return rating
+
+def get_handle_rating_features(handle: str, count: int = 3) -> dict[int, RatingFeatures]:
+    # same values as get_contest_rating_entity, get_max_rating_before_contest and
+    # get_recent_delta_avg for every contest of the handle, in a single query
+    count = int(count)
+    qry = f'''
+        SELECT
+            contest_id,
+            old_rating,
+            new_rating,
+            MAX(MAX(COALESCE(new_rating, 0), COALESCE(old_rating, 0))) OVER (
+                ORDER BY contest_id ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+            ),
+            AVG(new_rating - old_rating) OVER (
+                ORDER BY contest_id ROWS BETWEEN {count} PRECEDING AND 1 PRECEDING
+            )
+        FROM rating_changes
+        WHERE handle_id = ?
+        ORDER BY contest_id
+    '''
+    with db_connection.get_connection(db_path) as conn:
+        cursor = conn.execute(qry, (handle_dict.lookup(handle),))
+        return {
+            contest_id: RatingFeatures(
+                old_rating=old_rating,
+                new_rating=new_rating,
+                max_rating_before_contest=max_before if max_before is not None else 0,
+                recent_delta_avg=int(delta_avg) if delta_avg is not None else 0
+            )
+            for contest_id, old_rating, new_rating, max_before, delta_avg in cursor.fetchall()
+        }
+
+def get_rating_history(handle: str) -> list[tuple]:
+    with db_connection.get_connection(db_path) as conn:
+        cursor = conn.execute('''
+            SELECT contest_id, old_rating, new_rating FROM rating_changes WHERE handle_id = ? ORDER BY contest_id
+        ''', (handle_dict.lookup(handle),))
+        return cursor.fetchall()
+
+def get_rating_history_by_handle_ids(handle_ids: list[int], batch_size: int = 500) -> list[tuple]:
+    # (handle_id, contest_id, old_rating, new_rating) ordered by handle_id and contest
+    rows = list()
+    with db_connection.get_connection(db_path) as conn:
+        for i in range(0, len(handle_ids), batch_size):
+            batch = handle_ids[i:i + batch_size]
+            cursor = conn.execute(f'''
+                SELECT handle_id, contest_id, old_rating, new_rating FROM rating_changes
+                WHERE handle_id IN ({",".join("?" * len(batch))})
+            ''', batch)
+            rows.extend(cursor.fetchall())
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return rows
+
+def get_all_rating_history() -> list[tuple]:
+    # (handle_id, contest_id, old_rating, new_rating) of every handle, in primary key order
+    with db_connection.get_connection(db_path) as conn:
+        cursor = conn.execute('''
+            SELECT handle_id, contest_id, old_rating, new_rating FROM rating_changes ORDER BY handle_id, contest_id
+        ''')
+        return cursor.fetchall()
+
+def _history_queries(handle_ids: Optional[list[int]], batch_size: int = 500) -> list[tuple[str, list]]:
+    # (where clause, params) pairs; ascending disjoint id batches keep the concatenated rows in key order
+    if handle_ids is None:
+        return [('', [])]
+    handle_ids = sorted(set(handle_ids))
+    return [
+        (f'WHERE handle_id IN ({",".join("?" * len(batch))})', batch)
+        for batch in (handle_ids[i:i + batch_size] for i in range(0, len(handle_ids), batch_size))
+    ]
+
+def count_rating_history(handle_ids: Optional[list[int]] = None) -> int:
+    with db_connection.get_connection(db_path) as conn:
+        return sum(
+            conn.execute(f'SELECT COUNT(*) FROM rating_changes {where}', params).fetchone()[0]
+            for where, params in _history_queries(handle_ids)
+        )
+
+def iter_rating_history(handle_ids: Optional[list[int]] = None, null_rating: int = 0, batch_rows: int = 65536):
+    # batches of (handle_id, contest_id, old_rating, new_rating) ordered by handle_id and contest,
+    # NULL ratings come back as null_rating so a batch converts straight to an int array
+    with db_connection.get_connection(db_path) as conn:
+        for where, params in _history_queries(handle_ids):
+            cursor = conn.execute(f'''
+                SELECT handle_id, contest_id, COALESCE(old_rating, ?), COALESCE(new_rating, ?) FROM rating_changes
+                {where} ORDER BY handle_id, contest_id
+            ''', [null_rating, null_rating] + params)
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                yield rows
+
+def get_data_version() -> Optional[int]:
+    # rows are only ever inserted, the last rowid changes whenever the contents do
+    with db_connection.get_connection(db_path) as conn:
+        return conn.execute('SELECT MAX(rowid) FROM rating_changes').fetchone()[0]
+
+def get_rating_features_for_pairs(pairs: list[tuple[str, int]], count: int = 3) -> dict[tuple[str, int], RatingFeatures]:
+    # pairs may name contests the handle was not rated in, those get old/new rating None
+    by_handle = defaultdict(list)
+    for handle, contest_id in pairs:
+        by_handle[handle].append(contest_id)
+
+    ret = dict()
+    for handle, contest_ids in by_handle.items():
+        history = get_rating_history(handle)
+        history_ids = [row[0] for row in history]
+        prefix_max = [0]
+        deltas = list()
+        for _, old_rating, new_rating in history:
+            prefix_max.append(max(prefix_max[-1], new_rating or 0, old_rating or 0))
+            # a NULL rating has no delta but still takes its place in the window, like AVG in sql
+            deltas.append(new_rating - old_rating if old_rating is not None and new_rating is not None else None)
+
+        for contest_id in contest_ids:
+            pos = bisect_left(history_ids, contest_id)
+            recent = [delta for delta in deltas[max(0, pos - count):pos] if delta is not None]
+            row = history[pos] if pos < len(history) and history_ids[pos] == contest_id else None
+            ret[(handle, contest_id)] = RatingFeatures(
+                old_rating=row[1] if row is not None else None,
+                new_rating=row[2] if row is not None else None,
+                max_rating_before_contest=prefix_max[pos],
+                recent_delta_avg=int(sum(recent) / len(recent)) if recent else 0
+            )
+    return ret
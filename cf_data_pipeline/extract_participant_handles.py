@@ -1,10 +1,10 @@
 import pandas as pd
-import time
 from typing import Union
 from pathlib import Path
 from api_client import get_rated_users_by_contest
-from storage import save_csv
-from config import SLEEP_TIME, PROCESSED_DATA_DIR
+from storage import save_csv, load_csv
+import retry_queue
+from config import PROCESSED_DATA_DIR
 
 
 def extract_handles_from_contests(
@@ -38,16 +38,34 @@ def extract_handles_from_contests(
                 }
                 records.append(entity)
                 seen.add(handle)
-
-            time.sleep(SLEEP_TIME)
         except Exception as e:
             print(f'[ERROR] {e}')
+            skipped_contests.append(cid)
     df = pd.DataFrame(records)
     save_csv(save_csv_path, df)
     print(f'{len(df)} handles stored.')
     print(f'Contests {skipped_contests} skipped.')
 
-    if len(skipped_contests) > 0:
-        with open('./skipped_contest.txt', 'w', encoding='utf-8') as f:
-            for i in skipped_contests:
-                f.write(f'{i}\n')
+    retry_queue.enqueue_many(retry_queue.CONTEST_HANDLES, skipped_contests)
+
+def append_handles_from_contest(
+    contest_id: int,
+    save_csv_path: Union[str, Path] = PROCESSED_DATA_DIR / 'selected_handles.csv'
+) -> bool:
+    res = get_rated_users_by_contest(contest_id)
+    if res is None or res.get('status') != 'OK':
+        return False
+
+    df = load_csv(save_csv_path)
+    seen = set(df['handle']) if df is not None else set()
+    records = [
+        {'handle': item['handle'], 'max_rating': item['maxRating']}
+        for item in res['result']
+        if item['handle'] not in seen
+    ]
+    if records:
+        df_new = pd.DataFrame(records).drop_duplicates(subset='handle')
+        df = pd.concat([df, df_new], ignore_index=True) if df is not None else df_new
+        save_csv(save_csv_path, df)
+    print(f'{len(records)} handles from contest {contest_id} stored.')
+    return True
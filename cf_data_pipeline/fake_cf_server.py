@@ -0,0 +1,307 @@
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit, parse_qs
+from response_cache import ResponseCache
+
+
+@dataclass
+class FakeServerConfig:
+    latency: float = 0.05
+    latency_jitter: float = 0.02
+    call_limit_rate: float = 0.0
+    timeout_rate: float = 0.0
+    timeout_delay: float = 60.0
+    # enforce a real budget like codeforces does, 0 disables it
+    max_calls_per_second: float = 0.0
+    seed: int = 42
+
+
+class SyntheticData:
+    def __init__(
+        self,
+        contest_count: int = 50,
+        handle_count: int = 5000,
+        participants_per_contest: int = 1000,
+        problems_per_contest: int = 6,
+        seed: int = 42,
+    ):
+        rng = random.Random(seed)
+        self.handles = [f'user{i}' for i in range(handle_count)]
+        self.problem_tags = ['implementation', 'math', 'greedy', 'dp', 'data structures', 'graphs', 'strings']
+        self.contests = list()
+        self.participants = dict()
+        self.rating_changes = dict()
+        self.user_history = {handle: list() for handle in self.handles}
+
+        current = {handle: 0 for handle in self.handles}
+        start = int(datetime(2022, 1, 1).timestamp())
+        for i in range(contest_count):
+            contest_id = 1000 + i
+            division = rng.choice(['Div. 1', 'Div. 2', 'Div. 3', 'Div. 4'])
+            self.contests.append({
+                'id': contest_id,
+                'name': f'Codeforces Round {900 + i} ({division})',
+                'type': 'CF',
+                'phase': 'FINISHED',
+                'durationSeconds': 7200,
+                'startTimeSeconds': start + i * 7 * 24 * 3600,
+                'problems': [
+                    {
+                        'contestId': contest_id,
+                        'index': chr(ord('A') + p),
+                        'name': f'Problem {p}',
+                        'rating': 800 + 300 * p,
+                        'tags': rng.sample(self.problem_tags, 2),
+                    }
+                    for p in range(problems_per_contest)
+                ],
+            })
+
+            picked = rng.sample(range(handle_count), min(participants_per_contest, handle_count))
+            rows = list()
+            changes = list()
+            for rank, h in enumerate(picked):
+                handle = self.handles[h]
+                solved = rng.randint(0, problems_per_contest)
+                rows.append((handle, solved))
+                old_rating = current[handle]
+                new_rating = max(0, old_rating + rng.randint(-80, 120) if old_rating > 0 else rng.randint(800, 1600))
+                current[handle] = new_rating
+                change = {
+                    'contestId': contest_id,
+                    'contestName': self.contests[-1]['name'],
+                    'handle': handle,
+                    'rank': rank + 1,
+                    'ratingUpdateTimeSeconds': self.contests[-1]['startTimeSeconds'] + 7200,
+                    'oldRating': old_rating,
+                    'newRating': new_rating,
+                }
+                changes.append(change)
+                self.user_history[handle].append(change)
+            self.participants[contest_id] = rows
+            self.rating_changes[contest_id] = changes
+        self.current = current
+
+    def contest_list(self, params: dict) -> dict:
+        result = [{k: v for k, v in c.items() if k != 'problems'} for c in reversed(self.contests)]
+        return {'status': 'OK', 'result': result}
+
+    def contest_standings(self, params: dict) -> Optional[dict]:
+        contest_id = int(params.get('contestId', 0))
+        contest = next((c for c in self.contests if c['id'] == contest_id), None)
+        if contest is None:
+            return None
+        rows = self.participants[contest_id]
+        from_index = int(params.get('from', 1))
+        count = int(params.get('count', len(rows)))
+        page = rows[from_index - 1:from_index - 1 + count]
+        problem_count = len(contest['problems'])
+        return {'status': 'OK', 'result': {
+            'contest': {k: v for k, v in contest.items() if k != 'problems'},
+            'problems': contest['problems'],
+            'rows': [
+                {
+                    'party': {'contestId': contest_id, 'members': [{'handle': handle}], 'participantType': 'CONTESTANT'},
+                    'rank': from_index + i,
+                    'points': float(solved),
+                    'problemResults': [{'points': 1.0 if p < solved else 0.0} for p in range(problem_count)],
+                }
+                for i, (handle, solved) in enumerate(page)
+            ],
+        }}
+
+    def contest_rating_changes(self, params: dict) -> Optional[dict]:
+        contest_id = int(params.get('contestId', 0))
+        if contest_id not in self.rating_changes:
+            return None
+        return {'status': 'OK', 'result': self.rating_changes[contest_id]}
+
+    def user_rating(self, params: dict) -> Optional[dict]:
+        handle = params.get('handle', '')
+        if handle not in self.user_history:
+            return None
+        return {'status': 'OK', 'result': self.user_history[handle]}
+
+    def user_rated_list(self, params: dict) -> dict:
+        result = list()
+        for handle in self.handles:
+            history = self.user_history[handle]
+            if not history:
+                continue
+            result.append({
+                'handle': handle,
+                'rating': self.current[handle],
+                'maxRating': max(item['newRating'] for item in history),
+            })
+        return {'status': 'OK', 'result': result}
+
+    def respond(self, method: str, params: dict) -> Optional[dict]:
+        handlers = {
+            'contest.list': self.contest_list,
+            'contest.standings': self.contest_standings,
+            'contest.ratingChanges': self.contest_rating_changes,
+            'user.rating': self.user_rating,
+            'user.ratedList': self.user_rated_list,
+        }
+        handler = handlers.get(method)
+        return handler(params) if handler is not None else None
+
+
+class ReplayData:
+    # cache keys hold the host, requests are looked up as if they went to the recorded api
+    def __init__(self, cache_dir, recorded_base_url: str = 'https://codeforces.com/api'):
+        self.cache = ResponseCache(cache_dir)
+        self.recorded_host = urlsplit(recorded_base_url).netloc
+
+    def respond(self, method: str, params: dict, url: str) -> Optional[dict]:
+        parts = urlsplit(url)
+        return self.cache.get(f'https://{self.recorded_host}{parts.path}?{parts.query}', ignore_expiry=True)
+
+
+class FakeCodeforcesServer:
+    def __init__(self, data, config: Optional[FakeServerConfig] = None, host: str = '127.0.0.1', port: int = 0):
+        self.data = data
+        self.config = config if config is not None else FakeServerConfig()
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.bytes_sent = 0
+        self.call_limit_count = 0
+        self.last_call_at = 0.0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/api'
+
+    def _draw(self) -> tuple[float, bool, bool]:
+        with self.lock:
+            self.request_count += 1
+            now = time.monotonic()
+            over_budget = False
+            if self.config.max_calls_per_second > 0:
+                over_budget = now - self.last_call_at < 1 / self.config.max_calls_per_second
+                if not over_budget:
+                    self.last_call_at = now
+            call_limited = over_budget or self.rng.random() < self.config.call_limit_rate
+            timed_out = self.rng.random() < self.config.timeout_rate
+            delay = max(0.0, self.config.latency + self.rng.uniform(-1, 1) * self.config.latency_jitter)
+            if call_limited:
+                self.call_limit_count += 1
+            return delay, call_limited, timed_out
+
+    def _send(self, handler: BaseHTTPRequestHandler, code: int, body: dict):
+        payload = json.dumps(body, separators=(',', ':')).encode('utf-8')
+        handler.send_response(code)
+        handler.send_header('Content-Type', 'application/json;charset=UTF-8')
+        handler.send_header('Content-Length', str(len(payload)))
+        handler.end_headers()
+        try:
+            handler.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        with self.lock:
+            self.bytes_sent += len(payload)
+
+    def handle(self, handler: BaseHTTPRequestHandler):
+        delay, call_limited, timed_out = self._draw()
+        if timed_out:
+            time.sleep(self.config.timeout_delay)
+            return
+        time.sleep(delay)
+
+        if call_limited:
+            self._send(handler, 503, {'status': 'FAILED', 'comment': 'Call limit exceeded'})
+            return
+
+        parts = urlsplit(handler.path)
+        method = parts.path.rstrip('/').rsplit('/', 1)[-1]
+        params = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        if isinstance(self.data, ReplayData):
+            body = self.data.respond(method, params, handler.path)
+        else:
+            body = self.data.respond(method, params)
+
+        if body is None:
+            self._send(handler, 400, {'status': 'FAILED', 'comment': f'{method}: not found'})
+        else:
+            self._send(handler, 200, body)
+
+    def start(self) -> 'FakeCodeforcesServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'requests': self.request_count,
+                'bytes': self.bytes_sent,
+                'call_limit_errors': self.call_limit_count,
+            }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in for the Codeforces API')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--replay', help='response cache directory to replay instead of synthetic data')
+    parser.add_argument(
+        '--replay-base-url', default='https://codeforces.com/api', help='api the replayed cache was recorded from'
+    )
+    parser.add_argument('--workdir', help='directory for the pipeline data of runs against this server')
+    parser.add_argument('--contests', type=int, default=50)
+    parser.add_argument('--handles', type=int, default=5000)
+    parser.add_argument('--participants', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--call-limit-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--max-calls-per-second', type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.replay:
+        data = ReplayData(args.replay, args.replay_base_url)
+    else:
+        data = SyntheticData(args.contests, args.handles, args.participants)
+    config = FakeServerConfig(
+        latency=args.latency,
+        call_limit_rate=args.call_limit_rate,
+        timeout_rate=args.timeout_rate,
+        max_calls_per_second=args.max_calls_per_second,
+    )
+    fake = FakeCodeforcesServer(data, config, port=args.port)
+    # the pipeline refuses a non-default api unless its data and cache dirs are moved too
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='fake_cf_'))
+    print(f'Serving fake Codeforces API at {fake.base_url}, point the pipeline at it with')
+    print(f'  export CF_API_BASE_URL={fake.base_url}')
+    print(f'  export CF_PROCESSED_DATA_DIR={workdir / "processed_data"}')
+    print(f'  export CF_RES_CACHE_DATA_DIR={workdir / "response_cache"}')
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
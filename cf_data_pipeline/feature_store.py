@@ -0,0 +1,259 @@
+import inspect
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import build_dataset
+import columnar_builder
+import columnar_store
+import db_contest_user_result
+import db_rating_change
+import handle_dict
+import preprocess
+import rating_timeline
+import storage
+from accepted_max_table import AcceptedMaxTable
+from contest_statistics import ContestStatisticsTable
+from tag_encoding import TagEncoding
+from stage_runner import fingerprint_files, fingerprint_values
+from config import (
+    FEATURE_STORE_DIR, DATASET_DIR, SAMPLED_HANDLE_PATH, CONTEST_PROBLEMS_DATA_PATH, CONTEST_STATISTICS_PATH,
+)
+
+
+PIPELINE_DIR = Path(__file__).resolve().parent
+
+
+@dataclass
+class FeatureFamily:
+    name: str
+    keys: list[str]
+    # families whose stored tables compute reads, their fingerprints are part of this one
+    deps: list[str]
+    # cheap values that change whenever the inputs outside the store do
+    get_inputs: Callable[[], tuple]
+    compute: Callable[[dict[str, pd.DataFrame]], pd.DataFrame]
+    # functions and classes compute builds the table with. the source of their modules, and of
+    # every pipeline module those import, is part of the fingerprint
+    helpers: list = field(default_factory=list)
+
+
+def compute_results(deps: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    # one row per sampled handle and problem of the contests they took part in
+    handles = storage.load_csv(SAMPLED_HANDLE_PATH)['handle'].tolist()
+    handle_ids = sorted(handle_dict.lookup_many(handles).values())
+    rows = columnar_builder.expand_masks(db_contest_user_result.get_masks_by_handle_ids(handle_ids))
+    return pd.DataFrame(rows)[['handle_id', 'contest_id', 'problem_index', 'verdict']]
+
+def compute_problem_tags(deps: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    problems = columnar_builder.ProblemTable(build_dataset.contest_problem_data, build_dataset.problem_tag_encoding)
+    columns = {
+        'contest_id': problems.keys >> 32,
+        'problem_index': problems.keys & 0xffffffff,
+        'division_type': problems.division_type,
+        'problem_rating': problems.problem_rating,
+    }
+    for i, tag in enumerate(build_dataset.problem_tag_list):
+        columns[f'problem_tag_{tag}'] = problems.tags[:, i]
+    return pd.DataFrame(columns)
+
+def compute_contest_statistics(deps: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    table: ContestStatisticsTable = build_dataset.contest_statistics_table
+    rows = np.arange(len(table))
+    columns = {'contest_id': table.contest_ids}
+    for col in columnar_builder.STAT_COLUMNS:
+        columns[col] = table.column(col, rows).astype(np.int64)
+    columns['unrated_ratio'] = table.column('unrated_ratio', rows)
+    return pd.DataFrame(columns)
+
+def compute_rating(deps: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    # features of every contest a sampled handle was rated in, the only pairs that make dataset rows
+    handles = storage.load_csv(SAMPLED_HANDLE_PATH)['handle'].tolist()
+    sampled = np.asarray(sorted(handle_dict.lookup_many(handles).values()), dtype=np.int64)
+    timeline = rating_timeline.load_or_build(handle_ids=sampled.tolist())
+    keys = timeline.keys[np.isin(timeline.keys >> 32, sampled)]
+    handle_ids, contest_ids = keys >> 32, keys & 0xffffffff
+    rating = timeline.lookup(handle_ids, contest_ids)
+    # no rating before the contest is a null, not a NaN cast into the int16 column
+    missing = rating['old_rating'] == rating_timeline.NULL_RATING
+    old_rating = pd.arrays.IntegerArray(np.where(missing, 0, rating['old_rating']).astype(np.int16), missing)
+    return pd.DataFrame({
+        'handle_id': handle_ids,
+        'contest_id': contest_ids,
+        'current_rating_before_contest': old_rating,
+        'max_rating_before_contest': rating['max_rating_before_contest'],
+        'recent_delta_avg': rating['recent_delta_avg'],
+    })
+
+def compute_accepted_max(deps: dict[str, pd.DataFrame]) -> pd.DataFrame:
+    # a row for every (handle, contest) of the results, accepts of unknown problems are left out
+    results, problem_tags = deps['results'], deps['problem_tags']
+    tag_columns = [col for col in problem_tags.columns if col.startswith('problem_tag_')]
+    accepted = results[results['verdict'] == 1].merge(problem_tags, on=['contest_id', 'problem_index'])
+    table = AcceptedMaxTable.from_accepted(
+        accepted['handle_id'].to_numpy(),
+        accepted['contest_id'].to_numpy(),
+        accepted['problem_rating'].to_numpy(),
+        accepted[tag_columns].to_numpy(),
+    )
+
+    pairs = results[['handle_id', 'contest_id']].drop_duplicates()
+    values = table.before(pairs['handle_id'].to_numpy(), pairs['contest_id'].to_numpy())
+    columns = {'handle_id': pairs['handle_id'].to_numpy(), 'contest_id': pairs['contest_id'].to_numpy()}
+    for i, col in enumerate(tag_columns):
+        columns[col.replace('problem_tag_', 'accepted_max_rating_', 1)] = values[:, i]
+    return pd.DataFrame(columns)
+
+
+FAMILIES = {family.name: family for family in [
+    FeatureFamily(
+        'results', ['handle_id', 'contest_id', 'problem_index'], [],
+        lambda: (columnar_store.get_source_version('contest_user_result'), fingerprint_files(SAMPLED_HANDLE_PATH)),
+        compute_results,
+        [columnar_builder.expand_masks]
+    ),
+    FeatureFamily(
+        'problem_tags', ['contest_id', 'problem_index'], [],
+        lambda: (fingerprint_files(CONTEST_PROBLEMS_DATA_PATH), preprocess.get_problem_tag_list()),
+        compute_problem_tags,
+        [columnar_builder.ProblemTable, TagEncoding]
+    ),
+    FeatureFamily(
+        'contest_statistics', ['contest_id'], [],
+        lambda: (fingerprint_files(CONTEST_STATISTICS_PATH),),
+        compute_contest_statistics,
+        [ContestStatisticsTable]
+    ),
+    FeatureFamily(
+        'rating', ['handle_id', 'contest_id'], [],
+        lambda: (db_rating_change.get_data_version(), rating_timeline.FORMAT, fingerprint_files(SAMPLED_HANDLE_PATH)),
+        compute_rating,
+        [rating_timeline.RatingTimeline, db_rating_change.iter_rating_history]
+    ),
+    FeatureFamily(
+        'accepted_max', ['handle_id', 'contest_id'], ['results', 'problem_tags'],
+        lambda: (),
+        compute_accepted_max,
+        [AcceptedMaxTable]
+    ),
+]}
+# a dataset row needs problem data, a rating entry and contest statistics, so these always join
+REQUIRED_FAMILIES = ['problem_tags', 'rating', 'contest_statistics']
+
+
+def get_family_path(name: str, store_dir: Path = FEATURE_STORE_DIR) -> Path:
+    return Path(store_dir) / f'{name}.parquet'
+
+def _pipeline_module(obj):
+    module = obj if inspect.ismodule(obj) else sys.modules.get(getattr(obj, '__module__', None))
+    path = getattr(module, '__file__', None)
+    return module if path is not None and Path(path).resolve().parent == PIPELINE_DIR else None
+
+def get_module_sources(helpers: list) -> list[str]:
+    # a change anywhere a helper reaches, not just in the helper itself, must invalidate the family
+    pending = [module for module in map(_pipeline_module, helpers) if module is not None]
+    sources = dict()
+    while pending:
+        module = pending.pop()
+        if module.__name__ in sources:
+            continue
+        sources[module.__name__] = inspect.getsource(module)
+        for value in vars(module).values():
+            dep = _pipeline_module(value)
+            if dep is not None and dep.__name__ not in sources:
+                pending.append(dep)
+    return [sources[name] for name in sorted(sources)]
+
+def get_fingerprint(name: str) -> str:
+    # inputs, the code that computes the family and everything it reads from the store
+    family = FAMILIES[name]
+    return fingerprint_values(
+        family.get_inputs(),
+        inspect.getsource(family.compute),
+        get_module_sources(family.helpers),
+        [get_fingerprint(dep) for dep in family.deps],
+    )
+
+def get_family_schema(columns: list[str]) -> pa.Schema:
+    dataset_schema = build_dataset.get_dataset_schema()
+    return pa.schema([dataset_schema.field(col) for col in columns])
+
+def is_fresh(name: str, store_dir: Path = FEATURE_STORE_DIR) -> bool:
+    manifest_path = get_family_path(name, store_dir).with_suffix('.json')
+    if not manifest_path.is_file() or not get_family_path(name, store_dir).is_file():
+        return False
+    return storage.load_json(manifest_path).get('fingerprint') == get_fingerprint(name)
+
+def load_family(name: str, columns: Optional[list[str]] = None, store_dir: Path = FEATURE_STORE_DIR) -> pd.DataFrame:
+    return pq.read_table(get_family_path(name, store_dir), columns=columns, memory_map=True).to_pandas()
+
+def with_deps(names: list[str]) -> list[str]:
+    # the families and everything they read, dependencies first
+    wanted = set()
+    def add(name: str):
+        if name not in wanted:
+            wanted.add(name)
+            for dep in FAMILIES[name].deps:
+                add(dep)
+    for name in names:
+        add(name)
+    return [name for name in FAMILIES if name in wanted]
+
+def materialize(names: Optional[list[str]] = None, force: bool = False, store_dir: Path = FEATURE_STORE_DIR) -> list[str]:
+    # recomputes the families whose fingerprint changed, returns their names
+    build_dataset.load_metadata()
+    handle_dict.load_all()
+
+    recomputed = list()
+    for name in with_deps(names or list(FAMILIES)):
+        if not force and is_fresh(name, store_dir):
+            continue
+
+        family = FAMILIES[name]
+        fingerprint = get_fingerprint(name)
+        df = family.compute({dep: load_family(dep, store_dir=store_dir) for dep in family.deps})
+        df = df.sort_values(family.keys, kind='stable')
+        path = get_family_path(name, store_dir)
+        with storage.ParquetChunkWriter(path, get_family_schema(list(df.columns))) as writer:
+            writer.write(df)
+        storage.save_json(path.with_suffix('.json'), {'fingerprint': fingerprint, 'rows': len(df)})
+        recomputed.append(name)
+        print(f'[feature_store] {name}: {len(df)} rows computed')
+    return recomputed
+
+def assemble_training_set(
+    families: Optional[list[str]] = None,
+    columns: Optional[list[str]] = None,
+    store_dir: Path = FEATURE_STORE_DIR,
+) -> pd.DataFrame:
+    # joins the cached families onto the results, families left out only filter rows
+    families = families or ['rating', 'contest_statistics', 'accepted_max', 'problem_tags']
+    materialize(['results', *REQUIRED_FAMILIES, *families], store_dir=store_dir)
+
+    df = load_family('results', store_dir=store_dir)
+    for name in [*REQUIRED_FAMILIES, *[name for name in families if name not in REQUIRED_FAMILIES]]:
+        keys = FAMILIES[name].keys
+        family_columns = None if name in families else keys
+        if columns is not None and family_columns is None:
+            family_columns = [col for col in pq.read_schema(get_family_path(name, store_dir)).names if col in columns or col in keys]
+        df = df.merge(load_family(name, family_columns, store_dir), on=keys, how='inner')
+
+    order = [field.name for field in build_dataset.get_dataset_schema() if field.name in df.columns]
+    if columns is not None:
+        order = [col for col in order if col in columns]
+    df = df.sort_values(['handle_id', 'contest_id', 'problem_index'], kind='stable', ignore_index=True)
+    return df[order]
+
+def export_training_set(path: Path = DATASET_DIR / 'training_set.parquet', families: Optional[list[str]] = None) -> int:
+    df = assemble_training_set(families)
+    with storage.ParquetChunkWriter(path, get_family_schema(list(df.columns))) as writer:
+        writer.write(df)
+    print(f'[feature_store] training set with {len(df)} rows saved to {path}')
+    return len(df)
+
+if __name__ == "__main__":
+    export_training_set(families=sys.argv[1:] or None)
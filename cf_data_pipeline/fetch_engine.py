@@ -0,0 +1,123 @@
+import asyncio
+from typing import Any, Callable, Hashable, Iterable, Optional
+import api_client
+import response_cache
+from config import FETCH_MAX_IN_FLIGHT, SLEEP_TIME
+
+
+# (key, url, timeout) - the key is handed back to the result callback untouched
+FetchJob = tuple[Hashable, str, float]
+ResultCallback = Callable[[Hashable, dict], Any]
+
+
+class FetchEngine:
+    def __init__(
+        self,
+        max_in_flight: int = FETCH_MAX_IN_FLIGHT,
+        max_retries: int = 5,
+        client: Optional[api_client.ApiClient] = None,
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_retries = max_retries
+        self.client = client if client is not None else api_client.get_client()
+        self.limit = self.max_in_flight
+        self.in_flight = 0
+        self.success_streak = 0
+        # created inside the running loop, see _condition
+        self.cond: Optional[asyncio.Condition] = None
+        self.cond_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _acquire_token(self):
+        while True:
+            wait = self.client.limiter.try_acquire()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _condition(self) -> asyncio.Condition:
+        # a condition belongs to one loop, an engine reused by another asyncio.run gets a new one
+        loop = asyncio.get_running_loop()
+        if self.cond is None or self.cond_loop is not loop:
+            self.cond = asyncio.Condition()
+            self.cond_loop = loop
+        return self.cond
+
+    async def _enter(self):
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def _leave(self):
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            cond.notify_all()
+
+    def _on_call_limit(self):
+        # multiplicative decrease on the in-flight window, the shared bucket makes everyone wait
+        self.limit = max(1, self.limit // 2)
+        self.success_streak = 0
+        self.client.limiter.penalize(SLEEP_TIME)
+        print(f'[FETCH] call limit exceeded, in-flight limit -> {self.limit}')
+
+    def _on_success(self):
+        self.success_streak += 1
+        if self.limit < self.max_in_flight and self.success_streak >= self.limit:
+            self.limit += 1
+            self.success_streak = 0
+
+    async def fetch(self, url: str, api_timeout: float, use_cache: bool = True) -> Optional[dict]:
+        cache = response_cache.get_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(url)
+            if cached is not None:
+                return cached
+
+        for _ in range(self.max_retries):
+            await self._enter()
+            try:
+                await self._acquire_token()
+                res = await asyncio.to_thread(self.client.fetch_json, url, api_timeout)
+            finally:
+                await self._leave()
+
+            if res is None:
+                continue
+            if res.get('status') == 'OK':
+                self._on_success()
+                if cache is not None:
+                    cache.put(url, res)
+                return res
+            if api_client.is_call_limit_error(res):
+                self._on_call_limit()
+                continue
+            return None
+        return None
+
+    async def _run_job(self, job: FetchJob) -> tuple[Hashable, Optional[dict]]:
+        key, url, api_timeout = job
+        return key, await self.fetch(url, api_timeout)
+
+    async def run(self, jobs: Iterable[FetchJob], on_result: ResultCallback) -> list[Hashable]:
+        self.cond = asyncio.Condition()
+        self.cond_loop = asyncio.get_running_loop()
+        failed = list()
+        tasks = [asyncio.create_task(self._run_job(job)) for job in jobs]
+
+        for next_done in asyncio.as_completed(tasks):
+            key, res = await next_done
+            if res is None:
+                failed.append(key)
+                continue
+            try:
+                on_result(key, res)
+            except Exception as e:
+                print(f'[FETCH] result handler failed for {key}: {e}')
+                failed.append(key)
+        return failed
+
+
+def run_fetch(jobs: Iterable[FetchJob], on_result: ResultCallback, max_in_flight: int = FETCH_MAX_IN_FLIGHT) -> list[Hashable]:
+    engine = FetchEngine(max_in_flight=max_in_flight)
+    return asyncio.run(engine.run(jobs, on_result))
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+from typing import Iterable, Optional
+import db_connection
+import db_migration
+from config import PROCESSED_DATA_DIR
+
+
+# dense integer ids for handles, shared by every store so rows and indexes hold an int instead of the text
+db_path = PROCESSED_DATA_DIR / 'handle_dict.db'
+
+MIGRATIONS: list[db_migration.Migration] = [
+    (1, 'create handles', [
+        '''
+        CREATE TABLE IF NOT EXISTS handles (
+            handle_id INTEGER PRIMARY KEY,
+            handle TEXT NOT NULL UNIQUE
+        )
+        ''',
+    ]),
+]
+
+_lock = threading.Lock()
+_initialized = False
+_ids: dict[str, int] = dict()
+_handles: dict[int, str] = dict()
+
+
+def init_db():
+    global _initialized
+    if not _initialized:
+        db_migration.migrate(db_path, MIGRATIONS)
+        _initialized = True
+
+def _remember(rows: Iterable[tuple[int, str]]):
+    for handle_id, handle in rows:
+        _ids[handle] = handle_id
+        _handles[handle_id] = handle
+
+def _select(conn: sqlite3.Connection, column: str, values: list, batch_size: int = 500) -> list[tuple[int, str]]:
+    rows = list()
+    for i in range(0, len(values), batch_size):
+        batch = values[i:i + batch_size]
+        cursor = conn.execute(
+            f'SELECT handle_id, handle FROM handles WHERE {column} IN ({",".join("?" * len(batch))})', batch
+        )
+        rows.extend(cursor.fetchall())
+    return rows
+
+def intern_many(handles: Iterable[str]) -> dict[str, int]:
+    # assigns ids to unseen handles, ids never change once given out
+    handles = set(handles)
+    with _lock:
+        # sorted so the same input always gets the same ids
+        missing = sorted(handle for handle in handles if handle not in _ids)
+        if missing:
+            init_db()
+            conn = db_connection.get_connection(db_path, write=True)
+            with conn:
+                conn.executemany('INSERT OR IGNORE INTO handles(handle) VALUES (?)', [(h,) for h in missing])
+            _remember(_select(conn, 'handle', missing))
+        return {handle: _ids[handle] for handle in handles}
+
+def intern(handle: str) -> int:
+    return intern_many([handle])[handle]
+
+def lookup_many(handles: Iterable[str]) -> dict[str, int]:
+    # handles that were never stored are left out
+    handles = set(handles)
+    with _lock:
+        missing = [handle for handle in handles if handle not in _ids]
+        if missing and db_path.is_file():
+            _remember(_select(db_connection.get_connection(db_path), 'handle', missing))
+        return {handle: _ids[handle] for handle in handles if handle in _ids}
+
+def lookup(handle: str) -> Optional[int]:
+    handle_id = _ids.get(handle)
+    if handle_id is not None:
+        return handle_id
+    return lookup_many([handle]).get(handle)
+
+def get_handles(handle_ids: Iterable[int]) -> dict[int, str]:
+    handle_ids = set(handle_ids)
+    with _lock:
+        missing = [handle_id for handle_id in handle_ids if handle_id not in _handles]
+        if missing and db_path.is_file():
+            _remember(_select(db_connection.get_connection(db_path), 'handle_id', missing))
+        return {handle_id: _handles[handle_id] for handle_id in handle_ids if handle_id in _handles}
+
+def get_handle(handle_id: int) -> Optional[str]:
+    handle = _handles.get(handle_id)
+    if handle is not None:
+        return handle
+    return get_handles([handle_id]).get(handle_id)
+
+def load_all():
+    # bulk readers translate many ids at once, one scan beats thousands of IN batches
+    if not db_path.is_file():
+        return
+    with _lock:
+        _remember(db_connection.get_connection(db_path).execute('SELECT handle_id, handle FROM handles'))
+
+def encode_records(records: list[tuple]) -> list[tuple]:
+    # swaps the leading handle of each record for its id
+    ids = intern_many(record[0] for record in records)
+    return [(ids[record[0]], *record[1:]) for record in records]
+
+def replace_handle_column(conn: sqlite3.Connection, table: str, create_sql: str, columns: list[str]):
+    # migration helper: rewrites table with handle_id in place of handle, create_sql must create {table}_new
+    handles = [row[0] for row in conn.execute(f'SELECT DISTINCT handle FROM {table}')]
+    ids = intern_many(handles)
+    conn.execute('CREATE TEMP TABLE handle_map (handle TEXT PRIMARY KEY, handle_id INTEGER NOT NULL)')
+    conn.executemany('INSERT INTO temp.handle_map(handle, handle_id) VALUES (?, ?)', ids.items())
+    conn.execute(create_sql)
+    conn.execute(f'''
+        INSERT INTO {table}_new(handle_id, {", ".join(columns)})
+        SELECT m.handle_id, {", ".join(f"t.{c}" for c in columns)}
+        FROM {table} t JOIN temp.handle_map m ON m.handle = t.handle
+    ''')
+    conn.execute(f'DROP TABLE {table}')
+    conn.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    conn.execute('DROP TABLE temp.handle_map')
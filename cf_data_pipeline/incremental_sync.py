@@ -0,0 +1,196 @@
+import sqlite3
+import time
+from datetime import datetime
+from typing import Optional
+import pandas as pd
+import api_client
+import build_dataset
+import contest_standing_fetcher
+import db_contest_user_result
+import retry_queue
+import storage
+from contest_fetcher import get_rated_contest_df
+from problem_fetcher import fetch_problems
+from preprocess import get_division_type
+from stage_runner import MANIFEST_PATH
+from config import API_BASE_URL, CONTEST_MIN_DATE, CONTEST_PROBLEMS_DATA_PATH, RATED_CONTEST_METADATA_PATH, SAMPLED_HANDLE_PATH
+
+
+# every dataset keeps its own mark so a sync interrupted halfway resumes at the right step
+SYNC_DATASETS = ['contest_metadata', 'problem_metadata', 'contest_statistics', 'user_results', 'dataset']
+# contests are picked by id, not start time, within this window before the watermark: a round still
+# running at the last sync may start before or with one that finished and moved the watermark
+SYNC_LOOKBACK = 14 * 24 * 60 * 60
+
+
+def _connect() -> sqlite3.Connection:
+    MANIFEST_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(MANIFEST_PATH)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS watermarks (
+            dataset TEXT PRIMARY KEY,
+            last_contest_id INTEGER NOT NULL,
+            last_start_time INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS synced_contests (
+            dataset TEXT NOT NULL,
+            contest_id INTEGER NOT NULL,
+            PRIMARY KEY (dataset, contest_id)
+        )
+    ''')
+    return conn
+
+def get_watermark(dataset: str) -> Optional[tuple[int, int]]:
+    with _connect() as conn:
+        cursor = conn.execute('SELECT last_contest_id, last_start_time FROM watermarks WHERE dataset = ?', (dataset,))
+        return cursor.fetchone()
+
+def set_watermark(dataset: str, contest_id: int, start_time: int):
+    with _connect() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO watermarks(dataset, last_contest_id, last_start_time, updated_at)
+            VALUES (?, ?, ?, ?)''', (dataset, contest_id, start_time, time.time()))
+        conn.commit()
+
+def get_synced_contests(dataset: str) -> set[int]:
+    with _connect() as conn:
+        return {row[0] for row in conn.execute('SELECT contest_id FROM synced_contests WHERE dataset = ?', (dataset,))}
+
+def mark_synced(dataset: str, contest_ids: list[int]):
+    with _connect() as conn:
+        conn.executemany(
+            'INSERT OR IGNORE INTO synced_contests(dataset, contest_id) VALUES (?, ?)',
+            [(dataset, int(contest_id)) for contest_id in contest_ids]
+        )
+        conn.commit()
+
+def _to_timestamp(contest_date) -> int:
+    return int(pd.Timestamp(contest_date).to_pydatetime().timestamp())
+
+def _with_start_time(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    df['start_time'] = df['contest_date'].map(_to_timestamp)
+    return df.sort_values('start_time')
+
+def init_watermarks(df: pd.DataFrame):
+    # data built before incremental sync existed covers the whole metadata file
+    if len(df) == 0:
+        return
+    df = _with_start_time(df)
+    last = df.iloc[-1]
+    for dataset in SYNC_DATASETS:
+        watermark = get_watermark(dataset)
+        if watermark is None:
+            mark_synced(dataset, df['contest_id'].tolist())
+            set_watermark(dataset, int(last['contest_id']), int(last['start_time']))
+        elif not get_synced_contests(dataset):
+            # watermarks kept before contest ids were recorded cover everything up to them
+            mark_synced(dataset, df.loc[df['start_time'] <= watermark[1], 'contest_id'].tolist())
+
+def get_contests_after(df: pd.DataFrame, dataset: str) -> pd.DataFrame:
+    # contests of the lookback window and later that the dataset has not synced yet
+    df = _with_start_time(df)
+    watermark = get_watermark(dataset)
+    if watermark is None:
+        return df
+    recent = df[df['start_time'] > watermark[1] - SYNC_LOOKBACK]
+    return recent[~recent['contest_id'].isin(get_synced_contests(dataset))]
+
+def _advance(dataset: str, df: pd.DataFrame):
+    # the watermark only moves forward, contests found late in the lookback window leave it alone
+    if len(df) == 0:
+        return
+    mark_synced(dataset, df['contest_id'].tolist())
+    last = df.iloc[-1]
+    watermark = get_watermark(dataset)
+    if watermark is None or int(last['start_time']) > watermark[1]:
+        set_watermark(dataset, int(last['contest_id']), int(last['start_time']))
+
+def sync_contest_metadata(existing: pd.DataFrame) -> pd.DataFrame:
+    # the cached contest list would hide contests that finished since the last run
+    res = api_client.safe_get_json(f'{API_BASE_URL}/contest.list?gym=false', 10, use_cache=False)
+    if res is None:
+        print('[sync] Contest list fetch failed.')
+        return existing
+
+    watermark = get_watermark('contest_metadata')
+    timestamp_min = int(datetime.strptime(CONTEST_MIN_DATE, "%Y-%m-%d").timestamp())
+    if watermark is not None:
+        timestamp_min = max(timestamp_min, watermark[1] - SYNC_LOOKBACK)
+    existing_ids = set(existing['contest_id'])
+
+    records = list()
+    for item in res['result']:
+        if item['phase'] != 'FINISHED' or item['id'] in existing_ids:
+            continue
+        if item['startTimeSeconds'] < timestamp_min:
+            continue
+        records.append({
+            'contest_id': item['id'],
+            'division_type': get_division_type(item['name']),
+            'contest_date': datetime.fromtimestamp(item['startTimeSeconds']),
+        })
+
+    if len(records) == 0:
+        print('[sync] No new contests.')
+        return existing
+
+    df_new = pd.DataFrame(records)
+    df = pd.concat([existing, df_new], ignore_index=True)
+    storage.save_csv(RATED_CONTEST_METADATA_PATH, df)
+    _advance('contest_metadata', _with_start_time(df_new))
+    print(f'[sync] {len(df_new)} new contests appended.')
+    return df
+
+def sync_problem_metadata(df: pd.DataFrame):
+    pending = get_contests_after(df, 'problem_metadata')
+    if len(pending) == 0:
+        return
+    failed = fetch_problems(pending['contest_id'].tolist(), CONTEST_PROBLEMS_DATA_PATH, CONTEST_PROBLEMS_DATA_PATH)
+    if failed:
+        # the watermark moves on, the retry queue fetches these later
+        print(f'[sync] problem metadata failed for {failed}, queued for retry')
+        retry_queue.enqueue_many(retry_queue.PROBLEM_METADATA, failed)
+    _advance('problem_metadata', pending)
+
+def sync_contest_statistics(df: pd.DataFrame):
+    pending = get_contests_after(df, 'contest_statistics')
+    if len(pending) == 0:
+        return
+    contest_standing_fetcher.append_contest_statistics(pending['contest_id'].tolist())
+    _advance('contest_statistics', pending)
+
+def sync_user_results(df: pd.DataFrame):
+    pending = get_contests_after(df, 'user_results')
+    if len(pending) == 0:
+        return
+    contest_standing_fetcher.process_user_result_streaming(contest_ids=pending['contest_id'].tolist())
+    _advance('user_results', pending)
+
+def sync_dataset(df: pd.DataFrame):
+    pending = get_contests_after(df, 'dataset')
+    if len(pending) == 0:
+        return
+
+    sampled = set(storage.load_csv(SAMPLED_HANDLE_PATH)['handle'].tolist())
+    affected = db_contest_user_result.get_handles_in_contests(pending['contest_id'].tolist()) & sampled
+    print(f'[sync] {len(affected)} sampled handles took part in {len(pending)} new contests.')
+    if affected:
+        build_dataset.reset_dataset_builder()
+        build_dataset.rebuild_handles(affected)
+    _advance('dataset', pending)
+
+def sync_new_contests():
+    existing = get_rated_contest_df()
+    init_watermarks(existing)
+    df = sync_contest_metadata(existing)
+    sync_problem_metadata(df)
+    sync_contest_statistics(df)
+    sync_user_results(df)
+    sync_dataset(df)
+
+if __name__ == "__main__":
+    sync_new_contests()
@@ -0,0 +1,226 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional, Union
+import db_connection
+from config import INGEST_BATCH_ROWS, INGEST_FLUSH_INTERVAL, INGEST_MAX_PENDING
+
+
+@dataclass
+class WriteUnit:
+    db_path: Path
+    # (sql, rows) pairs run with executemany, all in the same transaction
+    statements: list[tuple[str, list]]
+    row_count: int
+    # called on the writer thread once the unit is committed
+    on_commit: Optional[Callable[[], None]] = None
+    # called on the writer thread when the unit is dropped, before callbacks of later units
+    on_failure: Optional[Callable[[], None]] = None
+
+
+class IngestWriter:
+    # owns the write connections; fetchers hand over rows and many units share one commit
+    def __init__(
+        self,
+        batch_rows: int = INGEST_BATCH_ROWS,
+        flush_interval: float = INGEST_FLUSH_INTERVAL,
+        max_pending: int = INGEST_MAX_PENDING,
+    ):
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        # submit blocks once max_pending units are waiting, which throttles the fetchers
+        self.queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._loop, name='ingest-writer', daemon=True)
+        self.lock = threading.Lock()
+        self.committed_units = 0
+        self.committed_rows = 0
+        self.failed_units = 0
+        self.transactions = 0
+
+    def start(self) -> 'IngestWriter':
+        self.thread.start()
+        return self
+
+    def submit(
+        self,
+        db_path: Union[str, Path],
+        statements: list[tuple[str, list]],
+        on_commit: Optional[Callable[[], None]] = None,
+        on_failure: Optional[Callable[[], None]] = None,
+        timeout: Optional[float] = None,
+    ):
+        # must not be called from a callback, the writer would wait on itself
+        row_count = sum(len(rows) for _, rows in statements)
+        self.queue.put(WriteUnit(Path(db_path), statements, row_count, on_commit, on_failure), timeout=timeout)
+
+    def pending(self) -> int:
+        return self.queue.qsize()
+
+    def flush(self):
+        # returns after everything submitted before the call is committed and its callbacks ran
+        if not self.thread.is_alive():
+            return
+        event = threading.Event()
+        self.queue.put(event)
+        # a writer that died never sets the event, stop waiting once the thread is gone
+        while not event.wait(timeout=1.0):
+            if not self.thread.is_alive():
+                print('[ingest_writer] writer thread exited before the flush completed')
+                return
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'committed_units': self.committed_units,
+                'committed_rows': self.committed_rows,
+                'failed_units': self.failed_units,
+                'transactions': self.transactions,
+            }
+
+    def _loop(self):
+        try:
+            while True:
+                batch, markers, stop = self._collect()
+                if batch:
+                    self._commit(batch)
+                for event in markers:
+                    event.set()
+                if stop:
+                    return
+        finally:
+            self._release_waiters()
+
+    def _release_waiters(self):
+        # flushes queued behind the exit would otherwise wait forever
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _collect(self) -> tuple[list[WriteUnit], list[threading.Event], bool]:
+        batch = list()
+        markers = list()
+        rows = 0
+        item = self.queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            if item is None:
+                return batch, markers, True
+            if isinstance(item, threading.Event):
+                markers.append(item)
+                return batch, markers, False
+
+            batch.append(item)
+            rows += item.row_count
+            remaining = deadline - time.monotonic()
+            if rows >= self.batch_rows or remaining <= 0:
+                return batch, markers, False
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                return batch, markers, False
+
+    def _apply(self, conn: sqlite3.Connection, unit: WriteUnit):
+        for sql, rows in unit.statements:
+            conn.executemany(sql, rows)
+
+    def _commit(self, batch: list[WriteUnit]):
+        by_db: dict[Path, list[WriteUnit]] = dict()
+        for unit in batch:
+            by_db.setdefault(unit.db_path, list()).append(unit)
+
+        for db_path, units in by_db.items():
+            try:
+                conn = db_connection.get_connection(db_path, write=True)
+            except Exception as e:
+                print(f'[ingest_writer] dropped {len(units)} units, {db_path.name} could not be opened: {e}')
+                with self.lock:
+                    self.failed_units += len(units)
+                self._run_callbacks(units, 'on_failure')
+                continue
+            try:
+                with conn:
+                    for unit in units:
+                        self._apply(conn, unit)
+                committed = units
+                transactions = 1
+            except Exception as e:
+                # one bad unit must not drop the rest of the batch, nor kill the writer thread
+                print(f'[ingest_writer] batch of {len(units)} units failed, retrying one by one: {e}')
+                committed = list()
+                transactions = 0
+                for unit in units:
+                    try:
+                        with conn:
+                            self._apply(conn, unit)
+                        committed.append(unit)
+                        transactions += 1
+                    except Exception as e:
+                        print(f'[ingest_writer] dropped a unit of {unit.row_count} rows for {db_path.name}: {e}')
+
+            with self.lock:
+                self.committed_units += len(committed)
+                self.committed_rows += sum(unit.row_count for unit in committed)
+                self.failed_units += len(units) - len(committed)
+                self.transactions += transactions
+
+            # submitters hear about dropped units before any later unit reports its commit
+            committed_ids = {id(unit) for unit in committed}
+            self._run_callbacks([unit for unit in units if id(unit) not in committed_ids], 'on_failure')
+            self._run_callbacks(committed, 'on_commit')
+
+    def _run_callbacks(self, units: list[WriteUnit], name: str):
+        for unit in units:
+            callback = getattr(unit, name)
+            if callback is None:
+                continue
+            try:
+                callback()
+            except Exception as e:
+                print(f'[ingest_writer] {name} callback failed: {e}')
+
+
+_writer: Optional[IngestWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> IngestWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.thread.is_alive():
+            _writer = IngestWriter().start()
+        return _writer
+
+def submit(
+    db_path: Union[str, Path],
+    statements: list[tuple[str, list]],
+    on_commit: Optional[Callable[[], None]] = None,
+    on_failure: Optional[Callable[[], None]] = None,
+):
+    get_writer().submit(db_path, statements, on_commit, on_failure)
+
+def flush():
+    with _writer_lock:
+        writer = _writer
+    if writer is not None:
+        writer.flush()
+
+@atexit.register
+def close_writer():
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
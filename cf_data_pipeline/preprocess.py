@@ -1,9 +1,11 @@
 from config import PROCESSED_DATA_DIR, DATA_PIPELINE_DIR
 import storage
+from tag_encoding import TagEncoding, TagGroups
 
 
 _problem_tags_list: list = None
 _problem_tag_index_dict: dict = None
+_tag_encoding: TagEncoding = None
 
 def get_division_type(title: str) -> int:
     title = title.lower()
@@ -53,6 +55,16 @@ def get_problem_tag_list() -> list[str]:
 
     return _problem_tags_list
 
+def get_tag_encoding() -> TagEncoding:
+    # bit positions follow problem_tags.txt, the same order as the dataset's tag columns
+    global _tag_encoding
+    if _tag_encoding is None:
+        _tag_encoding = TagEncoding(get_problem_tag_list())
+    return _tag_encoding
+
+def get_tag_groups() -> TagGroups:
+    return TagGroups(get_tag_encoding(), get_tag_group_map())
+
 def get_problem_tag_index_dict() -> dict[str, int]:
     global _problem_tag_index_dict
     if _problem_tag_index_dict is not None:
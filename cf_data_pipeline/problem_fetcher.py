@@ -1,8 +1,8 @@
-import time
-from api_client import get_contest_standings
+import fetch_engine
+from api_client import get_contest_standings, get_contest_standings_url
 from contest_fetcher import get_rated_contest_df
 from storage import save_json, load_json
-from config import PROCESSED_DATA_DIR, CONTEST_PROBLEMS_BASENAME, SLEEP_TIME
+from config import PROCESSED_DATA_DIR, CONTEST_PROBLEMS_BASENAME, FETCH_MAX_IN_FLIGHT
 
 
 def process_contest_problem_metadata():
@@ -36,15 +36,20 @@ def process_contest_problem_metadata():
             }
             records.append(record)
 
-        time.sleep(SLEEP_TIME)
-
     save_path = PROCESSED_DATA_DIR / f'{CONTEST_PROBLEMS_BASENAME}.json'
     save_json(save_path, records)
     print(f"[Done] {len(records)} problems saved.")
     print(f"[Failed] {len(failed_ids)} contests")
     return failed_ids
 
-def fetch_problems(failed_ids: list[int], existing_json_path: str, save_json_path: str) -> list:
+def fetch_problems(
+    failed_ids: list[int],
+    existing_json_path: str,
+    save_json_path: str,
+    max_in_flight: int = FETCH_MAX_IN_FLIGHT,
+) -> list:
+    # all contests are fetched in one batch and the file is written once at the end.
+    # returns the contests whose fetch failed, contests with unrated problems are not retried
     contest_df = get_rated_contest_df()
     division_lookup = contest_df.set_index('contest_id')['division_type'].to_dict()
     failed_to_fetch = []
@@ -54,21 +59,33 @@ def fetch_problems(failed_ids: list[int], existing_json_path: str, save_json_pat
         print(f"[retry_failed_problems] Failed to load: {existing_json_path}")
         existing = []
 
+    fetched = dict()
+
+    def on_problems(cid: int, res: dict):
+        fetched[cid] = res['result']['problems']
+
+    jobs = list()
+    for cid in failed_ids:
+        url, wait_time = get_contest_standings_url(cid, only_problems=True)
+        jobs.append((cid, url, wait_time))
+    fetch_engine.run_fetch(jobs, on_problems, max_in_flight)
+
     new_records = []
+    unrated = []
 
     for cid in failed_ids:
-        res = get_contest_standings(cid, only_problems=True)
-        if res is None or res.get('status') != 'OK':
+        if cid not in fetched:
             print(f"[Retry Fail] Contest {cid}")
             failed_to_fetch.append(cid)
             continue
 
-        for i, problem in enumerate(res['result']['problems']):
-            if 'rating' not in problem:
-                print(f"[Skip] Contest {cid} / Problem {i} has no rating")
-                failed_to_fetch.append(cid)
-                break
+        # a contest with an unrated problem is left out whole, refetching will not change that
+        if any('rating' not in problem for problem in fetched[cid]):
+            print(f"[Skip] Contest {cid} has problems without rating")
+            unrated.append(cid)
+            continue
 
+        for i, problem in enumerate(fetched[cid]):
             record = {
                 "contest_id": cid,
                 "division_type": division_lookup.get(cid, -1),
@@ -79,9 +96,10 @@ def fetch_problems(failed_ids: list[int], existing_json_path: str, save_json_pat
             }
             new_records.append(record)
 
-        time.sleep(SLEEP_TIME)
-
-    all_records = existing + new_records
-    save_json(save_json_path, all_records)
-    print(f"[Retry Success] {len(new_records)} problems added.")
+    # refetched contests replace their earlier records instead of repeating them
+    merged = dict()
+    for record in existing + new_records:
+        merged[(record['contest_id'], record['problem_index_num'])] = record
+    save_json(save_json_path, list(merged.values()))
+    print(f"[Retry Success] {len(new_records)} problems added, {len(unrated)} contests without ratings skipped.")
     return failed_to_fetch
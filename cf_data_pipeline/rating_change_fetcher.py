@@ -1,16 +1,20 @@
-from typing import Optional
+from typing import Callable, Optional
 import api_client, db_rating_change
+import fetch_engine
+import ingest_writer
+import retry_queue
+from config import API_BASE_URL, FETCH_MAX_IN_FLIGHT
 
 
 def get_contest_rating_changes(contest_id: int) -> Optional[dict]:
-    req_url = f'https://codeforces.com/api/contest.ratingChanges?contestId={contest_id}'
+    req_url = f'{API_BASE_URL}/contest.ratingChanges?contestId={contest_id}'
     res = api_client.safe_get_json(req_url, 50)
     if res is None or res['status'] != 'OK':
         return None
     return res
 
 def get_rating_changes(handle: str) -> Optional[dict]:
-    req_url = f'https://codeforces.com/api/user.rating?handle={handle}'
+    req_url = f'{API_BASE_URL}/user.rating?handle={handle}'
     res = api_client.safe_get_json(req_url, 10)
     if res is None or res['status'] != 'OK':
         return None
@@ -32,19 +36,83 @@ def process_rating_changes(json_data: dict) -> list:
         records.append((handle, contest_id, old_rating, new_rating))
     return records
 
-def fetch_and_store(handle: str) -> bool:
-    # already stored handle
-    if db_rating_change.has_rating_data(handle):
-        return True
+def process_contest_rating_changes(json_data: dict) -> list:
+    # one contest.ratingChanges response holds a row for every rated participant
+    return [
+        (item['handle'], item['contestId'], item['oldRating'], item['newRating'])
+        for item in json_data['result']
+    ]
+
+def store_contest_rating_changes(json_data: dict) -> int:
+    records = process_contest_rating_changes(json_data)
+    if len(records) > 0:
+        db_rating_change.submit_rating_changes(records)
+    return len(records)
+
+def ingest_contest_rating_changes(contest_ids: list[int], max_in_flight: int = FETCH_MAX_IN_FLIGHT) -> list[int]:
+    db_rating_change.init_db()
+    total = 0
+
+    def on_rating_changes(contest_id: int, res: dict):
+        nonlocal total
+        total += store_contest_rating_changes(res)
+
+    jobs = [(cid, api_client.get_contest_rating_changes_url(cid), 30) for cid in contest_ids]
+    failed = fetch_engine.run_fetch(jobs, on_rating_changes, max_in_flight)
+    ingest_writer.flush()
+    print(f'[INFO] {total} rating changes stored from {len(contest_ids) - len(failed)} contests.')
+    return failed
+
+def ingest_handle_rating_changes(handles: list[str], max_in_flight: int = FETCH_MAX_IN_FLIGHT) -> list[str]:
+    # user.rating of many handles through the fetch engine, returns the handles with nothing stored
+    db_rating_change.init_db()
+    empty = list()
+
+    def on_rating_changes(handle: str, res: dict):
+        records = process_rating_changes(res)
+        if not records:
+            print(f'[WARNING] {handle} has no rating history')
+            empty.append(handle)
+            return
+        db_rating_change.submit_rating_changes(records)
 
+    jobs = [(handle, api_client.get_user_rating_changes_url(handle), 10) for handle in handles]
+    failed = fetch_engine.run_fetch(jobs, on_rating_changes, max_in_flight) + empty
+    ingest_writer.flush()
+    print(f'[INFO] rating history stored for {len(handles) - len(failed)} / {len(handles)} handles.')
+    return failed
+
+def backfill_missing_handles(handles: list[str]) -> list[str]:
+    # per-handle fallback for handles the per-contest ingestion did not cover
+    stored = db_rating_change.get_handles_with_rating_data(handles)
+    missing = [handle for handle in handles if handle not in stored]
+    print(f'[INFO] {len(missing)} / {len(handles)} handles need user.rating')
+    if not missing:
+        return list()
+
+    failed_handles = ingest_handle_rating_changes(missing)
+    retry_queue.enqueue_many(retry_queue.RATING_HISTORY, failed_handles)
+    return failed_handles
+
+def fetch_and_submit(handle: str, on_commit: Optional[Callable[[], None]] = None) -> bool:
+    # hands the history to the ingestion writer, on_commit runs once it is stored
     data = get_rating_changes(handle)
     if data is None:
         return False
     records = process_rating_changes(data)
-    try:
-        db_rating_change.insert_rating_changes(records)
-        print(f'Handle {handle} complete.')
+    if not records:
+        print(f'[WARNING] {handle} has no rating history')
+        return False
+    db_rating_change.submit_rating_changes(records, on_commit)
+    print(f'Handle {handle} complete.')
+    return True
+
+def fetch_and_store(handle: str) -> bool:
+    # already stored handle
+    if db_rating_change.has_rating_data(handle):
         return True
-    except Exception as e:
-        print(f'[EXCEPTION] {e}')
-        return False
\ No newline at end of file
+    committed = list()
+    if not fetch_and_submit(handle, lambda: committed.append(handle)):
+        return False
+    ingest_writer.flush()
+    return len(committed) > 0
\ No newline at end of file
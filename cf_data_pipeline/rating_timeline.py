@@ -0,0 +1,204 @@
+import shutil
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import db_rating_change
+import storage
+from array_ops import make_key, group_cummax
+from config import RATING_TIMELINE_DIR
+
+
+MANIFEST_NAME = 'manifest.json'
+# bumped whenever the stored arrays change, older files count as stale
+FORMAT = 1
+ARRAYS = ['keys', 'old_rating', 'new_rating', 'prefix_max', 'delta_sum', 'delta_count']
+# stands for a NULL rating in the int32 columns
+NULL_RATING = np.iinfo(np.int32).min
+RECENT_DELTA_COUNT = 3
+
+
+class RatingTimeline:
+    # every handle's rating history as flat arrays sorted by (handle_id, contest_id) keys.
+    # prefix_max is the running max rating of the handle up to and including each entry,
+    # delta_sum and delta_count are prefix sums over all entries with a leading 0, so any
+    # window of a handle's contests is two subtractions
+    def __init__(self, arrays: dict[str, np.ndarray]):
+        self.keys = arrays['keys']
+        self.old_rating = arrays['old_rating']
+        self.new_rating = arrays['new_rating']
+        self.prefix_max = arrays['prefix_max']
+        self.delta_sum = arrays['delta_sum']
+        self.delta_count = arrays['delta_count']
+
+    @classmethod
+    def from_arrays(
+        cls, handle_ids: np.ndarray, contest_ids: np.ndarray, old_rating: np.ndarray, new_rating: np.ndarray
+    ) -> 'RatingTimeline':
+        # columns ordered by handle_id and contest, NULL ratings already NULL_RATING
+        handle_ids = np.asarray(handle_ids, dtype=np.int64)
+        old_rating = np.asarray(old_rating, dtype=np.int32)
+        new_rating = np.asarray(new_rating, dtype=np.int32)
+        old_null, new_null = old_rating == NULL_RATING, new_rating == NULL_RATING
+
+        # a NULL rating counts as 0 for the max and the delta is skipped, like the sql it replaces
+        peak = np.maximum(np.where(new_null, 0, new_rating), np.where(old_null, 0, old_rating))
+        valid = ~(old_null | new_null)
+        delta = np.where(valid, new_rating.astype(np.int64) - old_rating, 0)
+        return cls({
+            'keys': make_key(handle_ids, np.asarray(contest_ids, dtype=np.int64)),
+            'old_rating': old_rating,
+            'new_rating': new_rating,
+            'prefix_max': group_cummax(peak, handle_ids).astype(np.int32),
+            'delta_sum': np.r_[0, np.cumsum(delta)].astype(np.int64),
+            'delta_count': np.r_[0, np.cumsum(valid)].astype(np.int32),
+        })
+
+    @classmethod
+    def from_rows(cls, rows: list[tuple]) -> 'RatingTimeline':
+        # (handle_id, contest_id, old_rating, new_rating) ordered by handle_id and contest
+        return cls.from_arrays(
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [NULL_RATING if row[2] is None else row[2] for row in rows],
+            [NULL_RATING if row[3] is None else row[3] for row in rows],
+        )
+
+    @classmethod
+    def from_db(cls, handle_ids: Optional[list[int]] = None) -> 'RatingTimeline':
+        # rows are streamed into one preallocated array instead of a list of tuples
+        columns = np.empty((db_rating_change.count_rating_history(handle_ids), 4), dtype=np.int64)
+        filled = 0
+        for rows in db_rating_change.iter_rating_history(handle_ids, int(NULL_RATING)):
+            batch = np.array(rows, dtype=np.int64)
+            # rows inserted since the count only grow the array
+            if filled + len(batch) > len(columns):
+                columns = np.concatenate([columns[:filled], np.empty((len(batch), 4), dtype=np.int64)])
+            columns[filled:filled + len(batch)] = batch
+            filled += len(batch)
+        columns = columns[:filled]
+        return cls.from_arrays(columns[:, 0], columns[:, 1], columns[:, 2], columns[:, 3])
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def has_handles(self, handle_ids) -> np.ndarray:
+        handle_ids = np.asarray(handle_ids, dtype=np.int64)
+        start = np.searchsorted(self.keys, make_key(handle_ids, 0))
+        inside = start < len(self.keys)
+        ret = np.zeros(len(handle_ids), dtype=bool)
+        ret[inside] = (self.keys[start[inside]] >> 32) == handle_ids[inside]
+        return ret
+
+    def lookup(self, handle_ids, contest_ids, count: int = RECENT_DELTA_COUNT) -> dict[str, np.ndarray]:
+        # rating features as of each (handle, contest), found tells whether the handle was rated in it
+        handle_ids = np.asarray(handle_ids, dtype=np.int64)
+        keys = make_key(handle_ids, contest_ids)
+        start = np.searchsorted(self.keys, make_key(handle_ids, 0))
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+
+        # max over every earlier contest of the handle, 0 before the first one
+        max_before = np.zeros(len(keys), dtype=np.int32)
+        has_prev = pos > start
+        max_before[has_prev] = self.prefix_max[pos[has_prev] - 1]
+
+        # average delta of up to `count` earlier contests, truncated like int() does
+        window = np.maximum(pos - count, start)
+        total = self.delta_sum[pos] - self.delta_sum[window]
+        cnt = self.delta_count[pos] - self.delta_count[window]
+        recent = np.zeros(len(keys), dtype=np.int64)
+        has_delta = cnt > 0
+        recent[has_delta] = np.trunc(total[has_delta] / cnt[has_delta])
+
+        old_rating = np.full(len(keys), NULL_RATING, dtype=np.int32)
+        new_rating = np.full(len(keys), NULL_RATING, dtype=np.int32)
+        old_rating[found] = self.old_rating[pos[found]]
+        new_rating[found] = self.new_rating[pos[found]]
+        return {
+            'found': found,
+            'old_rating': old_rating,
+            'new_rating': new_rating,
+            'max_rating_before_contest': max_before,
+            'recent_delta_avg': recent,
+        }
+
+    def _locate_one(self, handle_id: int, contest_id: int) -> tuple[int, int, bool]:
+        # scalar version of the searches in lookup: (first entry of the handle, position, found)
+        key = (int(handle_id) << 32) | int(contest_id)
+        start = int(np.searchsorted(self.keys, int(handle_id) << 32))
+        pos = int(np.searchsorted(self.keys, key))
+        return start, pos, pos < len(self.keys) and int(self.keys[pos]) == key
+
+    def _as_of_one(self, start: int, pos: int, count: int) -> tuple[int, int]:
+        max_before = int(self.prefix_max[pos - 1]) if pos > start else 0
+        window = max(pos - count, start)
+        cnt = int(self.delta_count[pos] - self.delta_count[window])
+        total = int(self.delta_sum[pos] - self.delta_sum[window])
+        return max_before, int(total / cnt) if cnt > 0 else 0
+
+    def as_of(self, handle_id: int, contest_id: int, count: int = RECENT_DELTA_COUNT) -> tuple[int, int]:
+        # (max rating before the contest, recent delta average) whether or not the handle took part
+        start, pos, _ = self._locate_one(handle_id, contest_id)
+        return self._as_of_one(start, pos, count)
+
+    def features(
+        self, handle_id: Optional[int], contest_id: int, count: int = RECENT_DELTA_COUNT
+    ) -> Optional[db_rating_change.RatingFeatures]:
+        # same as db_rating_change.get_handle_rating_features(handle).get(contest_id)
+        if handle_id is None:
+            return None
+        start, pos, found = self._locate_one(handle_id, contest_id)
+        if not found:
+            return None
+        old_rating, new_rating = int(self.old_rating[pos]), int(self.new_rating[pos])
+        max_before, recent = self._as_of_one(start, pos, count)
+        return db_rating_change.RatingFeatures(
+            old_rating=None if old_rating == NULL_RATING else old_rating,
+            new_rating=None if new_rating == NULL_RATING else new_rating,
+            max_rating_before_contest=max_before,
+            recent_delta_avg=recent
+        )
+
+    def save(self, out_dir: Path, source_version: Optional[int]):
+        out_dir = Path(out_dir)
+        tmp_dir = out_dir.with_name(f'{out_dir.name}.tmp')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        for name in ARRAYS:
+            np.save(tmp_dir / f'{name}.npy', getattr(self, name))
+        storage.save_json(tmp_dir / MANIFEST_NAME, {
+            'format': FORMAT, 'source_version': source_version, 'entries': len(self),
+        })
+        shutil.rmtree(out_dir, ignore_errors=True)
+        tmp_dir.replace(out_dir)
+
+    @classmethod
+    def load(cls, out_dir: Path, mmap: bool = True) -> 'RatingTimeline':
+        # memory-mapped arrays are shared through the page cache by every process that opens them
+        mmap_mode = 'r' if mmap else None
+        return cls({name: np.load(Path(out_dir) / f'{name}.npy', mmap_mode=mmap_mode) for name in ARRAYS})
+
+
+def is_fresh(out_dir: Path = RATING_TIMELINE_DIR) -> bool:
+    path = Path(out_dir) / MANIFEST_NAME
+    if not path.is_file() or not db_rating_change.db_path.is_file():
+        return False
+    manifest = storage.load_json(path)
+    return manifest.get('format') == FORMAT and manifest.get('source_version') == db_rating_change.get_data_version()
+
+def export(out_dir: Path = RATING_TIMELINE_DIR):
+    version = db_rating_change.get_data_version()
+    timeline = RatingTimeline.from_db()
+    timeline.save(out_dir, version)
+    print(f'[rating_timeline] saved {len(timeline)} rating entries to {out_dir}')
+
+def load_or_build(out_dir: Path = RATING_TIMELINE_DIR, handle_ids: Optional[list[int]] = None) -> RatingTimeline:
+    # the saved file when it still matches the db, otherwise an in-memory build of the given
+    # handles, or of every handle without them
+    if is_fresh(out_dir):
+        return RatingTimeline.load(out_dir)
+    return RatingTimeline.from_db(handle_ids)
+
+if __name__ == "__main__":
+    export()
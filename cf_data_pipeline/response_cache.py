@@ -0,0 +1,181 @@
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Union
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from config import RES_CACHE_DATA_DIR, RES_CACHE_MAX_BYTES, RES_CACHE_TTL, RES_CACHE_UNFINISHED_TTL
+
+
+def get_endpoint(url: str) -> str:
+    return urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1]
+
+def normalize_url(url: str) -> str:
+    # the host stays in the key so answers of a test server never stand in for the real api's,
+    # the scheme and parameter order do not matter
+    parts = urlsplit(url)
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True))
+    return f'{parts.netloc.lower()}/{get_endpoint(url)}?{urlencode(query)}'
+
+def get_ttl(url: str, data: dict) -> Optional[float]:
+    # None means the entry never expires
+    endpoint = get_endpoint(url)
+    ttl = RES_CACHE_TTL.get(endpoint, RES_CACHE_UNFINISHED_TTL)
+    result = data.get('result')
+
+    if endpoint == 'contest.standings':
+        phase = result.get('contest', {}).get('phase') if isinstance(result, dict) else None
+        if phase != 'FINISHED':
+            return RES_CACHE_UNFINISHED_TTL
+    elif endpoint == 'contest.ratingChanges':
+        # ratings are applied some time after the contest ends
+        if not result:
+            return RES_CACHE_UNFINISHED_TTL
+    return ttl
+
+
+class ResponseCache:
+    def __init__(self, cache_dir: Union[str, Path] = RES_CACHE_DATA_DIR, max_bytes: int = RES_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.cache_dir / 'index.db', check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)')
+        self.conn.commit()
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f'{key}.json.gz'
+
+    def _delete(self, key: str, size: int):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self.total_bytes -= size
+
+    def get(self, url: str, ignore_expiry: bool = False) -> Optional[dict]:
+        normalized = normalize_url(url)
+        key = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        now = time.time()
+
+        with self.lock:
+            row = self.conn.execute('SELECT size, expires_at FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            size, expires_at = row
+            if not ignore_expiry and expires_at is not None and expires_at < now:
+                self._delete(key, size)
+                self.conn.commit()
+                self.misses += 1
+                return None
+
+            try:
+                with gzip.open(self._path(key), 'rt', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f'[response_cache] Broken entry {normalized}: {e}')
+                self._delete(key, size)
+                self.conn.commit()
+                self.misses += 1
+                return None
+
+            self.conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return data
+
+    def put(self, url: str, data: dict):
+        normalized = normalize_url(url)
+        key = hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+        ttl = get_ttl(url, data)
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+
+        payload = gzip.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.tmp{threading.get_ident()}')
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            row = self.conn.execute('SELECT size FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.total_bytes -= row[0]
+            self.conn.execute('''
+                INSERT OR REPLACE INTO entries(key, url, endpoint, size, expires_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)''', (key, normalized, get_endpoint(url), len(payload), expires_at, now))
+            self.total_bytes += len(payload)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        cursor = self.conn.execute('SELECT key, size FROM entries ORDER BY last_access')
+        victims = list()
+        remaining = self.total_bytes
+        for key, size in cursor:
+            if remaining <= target:
+                break
+            victims.append((key, size))
+            remaining -= size
+        for key, size in victims:
+            self._delete(key, size)
+        print(f'[response_cache] Evicted {len(victims)} entries')
+
+    def stats(self) -> dict:
+        with self.lock:
+            count = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total > 0 else 0.0,
+            'entries': count,
+            'bytes': self.total_bytes,
+        }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+cache_enabled = True
+
+def get_cache() -> Optional[ResponseCache]:
+    global _cache
+    if not cache_enabled:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+def print_stats():
+    cache = get_cache()
+    if cache is not None:
+        print(f'[response_cache] {cache.stats()}')
@@ -0,0 +1,220 @@
+import random
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+from config import PROCESSED_DATA_DIR, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_MAX_ATTEMPTS, RETRY_DRAIN_WORKERS
+
+
+db_path = PROCESSED_DATA_DIR / 'retry_queue.db'
+
+# kinds of fetch units that can be retried
+CONTEST_HANDLES = 'contest_handles'
+CONTEST_STATISTICS = 'contest_statistics'
+CONTEST_STANDINGS = 'contest_standings'
+PROBLEM_METADATA = 'problem_metadata'
+RATING_HISTORY = 'rating_history'
+
+_lock = threading.Lock()
+_initialized = False
+
+
+def _connect() -> sqlite3.Connection:
+    global _initialized
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    if not _initialized:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS work_queue (
+                kind TEXT NOT NULL,
+                unit TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                next_eligible REAL NOT NULL,
+                last_error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (kind, unit)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_work_queue_due ON work_queue(status, next_eligible)')
+        # units claimed by a process that died go back to the queue
+        conn.execute("UPDATE work_queue SET status = 'pending' WHERE status = 'running'")
+        conn.commit()
+        _initialized = True
+    return conn
+
+def get_backoff(attempts: int) -> float:
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+def enqueue(kind: str, unit, error: str = ''):
+    # a unit that is already queued keeps its attempt count and schedule
+    now = time.time()
+    with _lock, _connect() as conn:
+        conn.execute('''
+            INSERT INTO work_queue(kind, unit, status, attempts, next_eligible, last_error, updated_at)
+            VALUES (?, ?, 'pending', 1, ?, ?, ?)
+            ON CONFLICT(kind, unit) DO UPDATE SET
+                status = CASE WHEN status = 'done' THEN 'pending' ELSE status END,
+                last_error = excluded.last_error,
+                updated_at = excluded.updated_at
+        ''', (kind, str(unit), now + get_backoff(1), error, now))
+        conn.commit()
+
+def enqueue_many(kind: str, units: list, error: str = ''):
+    for unit in units:
+        enqueue(kind, unit, error)
+    if units:
+        print(f'[retry_queue] {len(units)} {kind} units queued for retry')
+
+def claim(kinds: Optional[list[str]] = None) -> Optional[tuple[str, str, int]]:
+    now = time.time()
+    with _lock, _connect() as conn:
+        qry = "SELECT kind, unit, attempts FROM work_queue WHERE status = 'pending' AND next_eligible <= ?"
+        params = [now]
+        if kinds:
+            qry += f" AND kind IN ({','.join('?' * len(kinds))})"
+            params.extend(kinds)
+        row = conn.execute(qry + ' ORDER BY next_eligible LIMIT 1', params).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE work_queue SET status = 'running', updated_at = ? WHERE kind = ? AND unit = ?",
+            (now, row[0], row[1])
+        )
+        conn.commit()
+        return row
+
+def complete(kind: str, unit: str):
+    with _lock, _connect() as conn:
+        conn.execute(
+            "UPDATE work_queue SET status = 'done', last_error = NULL, updated_at = ? WHERE kind = ? AND unit = ?",
+            (time.time(), kind, unit)
+        )
+        conn.commit()
+
+def fail(kind: str, unit: str, attempts: int, error: str):
+    now = time.time()
+    attempts += 1
+    status = 'dead' if attempts > RETRY_MAX_ATTEMPTS else 'pending'
+    with _lock, _connect() as conn:
+        conn.execute('''
+            UPDATE work_queue SET status = ?, attempts = ?, next_eligible = ?, last_error = ?, updated_at = ?
+            WHERE kind = ? AND unit = ?''', (status, attempts, now + get_backoff(attempts), error, now, kind, unit))
+        conn.commit()
+    if status == 'dead':
+        print(f'[retry_queue] {kind} {unit} gave up after {attempts - 1} attempts: {error}')
+
+def get_counts() -> dict[tuple[str, str], int]:
+    with _lock, _connect() as conn:
+        cursor = conn.execute('SELECT kind, status, COUNT(*) FROM work_queue GROUP BY kind, status')
+        return {(kind, status): count for kind, status, count in cursor.fetchall()}
+
+def get_next_eligible(kinds: Optional[list[str]] = None) -> Optional[float]:
+    with _lock, _connect() as conn:
+        qry = "SELECT MIN(next_eligible) FROM work_queue WHERE status = 'pending'"
+        params = list()
+        if kinds:
+            qry += f" AND kind IN ({','.join('?' * len(kinds))})"
+            params.extend(kinds)
+        return conn.execute(qry, params).fetchone()[0]
+
+
+def _retry_contest_handles(unit: str) -> bool:
+    from extract_participant_handles import append_handles_from_contest
+    return append_handles_from_contest(int(unit))
+
+def _retry_contest_statistics(unit: str) -> bool:
+    from contest_standing_fetcher import append_contest_statistics
+    return len(append_contest_statistics([int(unit)], enqueue_failed=False)) == 0
+
+def _retry_contest_standings(unit: str) -> bool:
+    from contest_standing_fetcher import process_user_result_streaming
+    return len(process_user_result_streaming(contest_ids=[int(unit)], enqueue_failed=False)) == 0
+
+def _retry_problem_metadata(unit: str) -> bool:
+    from problem_fetcher import fetch_problems
+    from config import CONTEST_PROBLEMS_DATA_PATH
+    return len(fetch_problems([int(unit)], CONTEST_PROBLEMS_DATA_PATH, CONTEST_PROBLEMS_DATA_PATH)) == 0
+
+def _retry_rating_history(unit: str) -> bool:
+    from rating_change_fetcher import fetch_and_store
+    return fetch_and_store(unit)
+
+# handler, and whether units of that kind rewrite a shared file and must not overlap
+HANDLERS: dict[str, tuple[Callable[[str], bool], bool]] = {
+    CONTEST_HANDLES: (_retry_contest_handles, True),
+    CONTEST_STATISTICS: (_retry_contest_statistics, True),
+    CONTEST_STANDINGS: (_retry_contest_standings, False),
+    PROBLEM_METADATA: (_retry_problem_metadata, True),
+    RATING_HISTORY: (_retry_rating_history, False),
+}
+_kind_locks = {kind: threading.Lock() for kind in HANDLERS}
+
+
+def run_one(kinds: Optional[list[str]] = None) -> bool:
+    item = claim(kinds)
+    if item is None:
+        return False
+
+    kind, unit, attempts = item
+    handler, exclusive = HANDLERS[kind]
+    try:
+        if exclusive:
+            with _kind_locks[kind]:
+                ok = handler(unit)
+        else:
+            ok = handler(unit)
+        error = '' if ok else 'handler reported failure'
+    except Exception:
+        ok = False
+        error = traceback.format_exc(limit=3)
+
+    if ok:
+        complete(kind, unit)
+        print(f'[retry_queue] {kind} {unit} succeeded on attempt {attempts + 1}')
+    else:
+        fail(kind, unit, attempts, error)
+    return True
+
+def drain(kinds: Optional[list[str]] = None, wait_for_backoff: bool = False):
+    # runs due units in the calling thread, optionally sleeping until backed-off units become eligible
+    while True:
+        if run_one(kinds):
+            continue
+        next_eligible = get_next_eligible(kinds)
+        if not wait_for_backoff or next_eligible is None:
+            return
+        time.sleep(max(0.0, next_eligible - time.time()))
+
+
+class DrainWorkers:
+    def __init__(self, worker_count: int = RETRY_DRAIN_WORKERS, kinds: Optional[list[str]] = None, poll_interval: float = 5.0):
+        self.kinds = kinds
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.threads = [
+            threading.Thread(target=self._loop, name=f'retry-drain-{i}', daemon=True)
+            for i in range(worker_count)
+        ]
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            try:
+                worked = run_one(self.kinds)
+            except Exception as e:
+                print(f'[retry_queue] drain worker error: {e}')
+                worked = False
+            if not worked:
+                self.stop_event.wait(self.poll_interval)
+
+    def start(self) -> 'DrainWorkers':
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join()
@@ -1,104 +1,179 @@
+import sys
 from user_fetcher import get_cf_handles
 from contest_fetcher import process_rated_contest_csv, get_rated_contest_df
-from problem_fetcher import process_contest_problem_metadata, fetch_problems
+from problem_fetcher import process_contest_problem_metadata
 from user_selector import stratified_sample_by_rating
-from extract_participant_handles import extract_handles_from_contests
+from stage_runner import Stage, StageRunner, fingerprint_files, fingerprint_values
 import build_dataset
+import columnar_store
+import contest_standing_fetcher
+import db_connection
+import db_rating_change
+import feature_store
+import ingest_writer
+import rating_change_fetcher
+import rating_timeline
+import retry_queue
 import storage
-from config import PROCESSED_DATA_DIR, CONTEST_PROBLEMS_BASENAME, DATASET_DIR
-
-def run_all():
-    # print("Step 1: Fetching handles...")
-    # get_cf_handles()
-
-    # print("Step 2: Fetching contest metadata...")
-    # process_rated_contest_csv("2020-01-01", "2025-03-01")
-
-    # print("Step 3: Fetching contest problem metadata...")
-    # failed = process_contest_problem_metadata()
-    # meta_data_path = PROCESSED_DATA_DIR / f'{CONTEST_PROBLEMS_BASENAME}.json'
-    # retry_failed_problems(failed, meta_data_path, meta_data_path)
-    # print('Contest problem metadata fetching completed.')
-
-    # Optional: retry logic (if you want to)
-    # retry_failed_problems([1234, 5678], '...', '...')
-
-    # users_df = storage.load_csv(f'./{PROCESSED_BASENAME}/selected_users.csv')
-    # rating_buckets = {
-    #     "newbie": (0, 1199),
-    #     "pupil": (1200, 1399),
-    #     "specialist": (1400, 1599),
-    #     "expert": (1600, 1899),
-    #     "candidate_master": (1900, 2099),
-    #     "master_plus": (2100, 5000)
-    # }
-
-    # sampled_df = stratified_sample_by_rating(
-    #     df=users_df,
-    #     rating_column='max_rating',
-    #     buckets=rating_buckets,
-    #     total_target=80000
-    # )
-
-    # save_path = f'./{PROCESSED_BASENAME}/sampled_handles.csv'
-    # storage.save_csv(save_path, sampled_df)
-    # print(f'Sampled {len(sampled_df)} users saved to {save_path}')
-    # df = get_rated_contest_df()
-    # extract_handles_from_contests(df['contest_id'].tolist())
-
-    """Fetch and store user's contest rating"""
-    # import db_rating_change
-    # db_rating_change.init_db()
-
-    # import rating_change_fetcher
-    # import time
-    
-    # handle_path = PROCESSED_DATA_DIR / 'sampled_handles.csv'
-    # handles = storage.load_csv(handle_path)['handle'].tolist()
-    # failed_handles = list()
-    # success_count = 0
-    # for handle in handles:
-    #     if not rating_change_fetcher.fetch_and_store(handle):
-    #         failed_handles.append(handle)
-    #     else:
-    #         success_count += 1
-    #         time.sleep(SLEEP_TIME)
-    # for handle in failed_handles:
-    #     if rating_change_fetcher.fetch_and_store(handle):
-    #         success_count += 1
-    #         time.sleep(SLEEP_TIME)
-    # print(f'Total {success_count}/{len(handles)} handles data stored.')
-
-    """Fetch contest data"""
-    # import contest_standing_fetcher
-    # print('Start fetching contest data...')
-    # contest_standing_fetcher.process_contest_standings()
-    # print('Contest data fetching completed.')
-
-    # print('Start fetching user data from contest...')
-    # contest_standing_fetcher.process_user_result()
-    # print('User contest data fetching completed.')
-
-    """Build dataset"""
-    print("Start building dataset...")
-    build_dataset.create_dataset(False, 23)
-    print("Dataset building completed.")
-
-    """Modify dataset"""
-    # import os
-    # import glob
-    # pat = 'dataset_group_*.csv'
-    # paths = os.path.join(DATASET_DIR, pat)
-    # files = glob.glob(paths)
-    # for file in files:
-    #     print(f"Processing file: {file}")
-    #     df = storage.load_csv(file)
-    #     df = build_dataset.filter_dataframe(df)
-    #     df = build_dataset.scale_dataframe(df)
-    #     save_path = os.path.join(DATASET_DIR, 'modified_' + os.path.basename(file))
-    #     storage.save_csv(save_path, df)
-    #     print(f"Modified dataset saved to: {save_path}")
-    pass
+from config import (
+    CONTEST_MIN_DATE, CONTEST_MAX_DATE, SELECTED_USERS_PATH, SAMPLED_HANDLE_PATH,
+    RATED_CONTEST_METADATA_PATH, CONTEST_PROBLEMS_DATA_PATH, CONTEST_STATISTICS_PATH,
+    COLUMNAR_CONTEST_RANGE,
+)
+
+RATING_BUCKETS = {
+    "newbie": (0, 1199),
+    "pupil": (1200, 1399),
+    "specialist": (1400, 1599),
+    "expert": (1600, 1899),
+    "candidate_master": (1900, 2099),
+    "master_plus": (2100, 5000)
+}
+SAMPLE_TARGET = 80000
+DATASET_SEED = 42
+
+
+def single_unit_stage(name: str, deps: list[str], get_fingerprint, func) -> Stage:
+    def run_units(units, mark_done):
+        func()
+        mark_done('all')
+    return Stage(name, lambda: {'all': get_fingerprint()}, run_units, deps)
+
+def fetch_problem_metadata():
+    failed = process_contest_problem_metadata()
+    retry_queue.enqueue_many(retry_queue.PROBLEM_METADATA, failed)
+    print('Contest problem metadata fetching completed.')
+
+def sample_handles():
+    users_df = storage.load_csv(SELECTED_USERS_PATH)
+    sampled_df = stratified_sample_by_rating(
+        df=users_df,
+        rating_column='max_rating',
+        buckets=RATING_BUCKETS,
+        total_target=SAMPLE_TARGET
+    )
+    storage.save_csv(SAMPLED_HANDLE_PATH, sampled_df)
+    print(f'Sampled {len(sampled_df)} users saved to {SAMPLED_HANDLE_PATH}')
+
+def get_sampled_handle_units() -> dict:
+    handles = storage.load_csv(SAMPLED_HANDLE_PATH)['handle'].tolist()
+    return {handle: fingerprint_values(handle) for handle in handles}
+
+def run_rating_change_units(handles: list, mark_done):
+    # most histories already came in bulk with the contest statistics stage
+    db_rating_change.init_db()
+    stored = db_rating_change.get_handles_with_rating_data(handles)
+    failed_handles = list()
+    for handle in handles:
+        if handle in stored:
+            mark_done(handle)
+        elif not rating_change_fetcher.fetch_and_submit(handle, lambda handle=handle: mark_done(handle)):
+            failed_handles.append(handle)
+    ingest_writer.flush()
+    retry_queue.enqueue_many(retry_queue.RATING_HISTORY, failed_handles)
+
+def get_contest_units() -> dict:
+    contests = get_rated_contest_df()['contest_id'].tolist()
+    return {cid: fingerprint_values(cid) for cid in contests}
+
+def run_user_result_units(contest_ids: list, mark_done):
+    contest_standing_fetcher.process_user_result_streaming(contest_ids=contest_ids, on_contest_done=mark_done)
+
+def backfill_build_inputs():
+    handles = storage.load_csv(SAMPLED_HANDLE_PATH)['handle'].tolist()
+    failed_contests, failed_handles = build_dataset.backfill_build_inputs(handles)
+    print(f'Build backfill completed, {len(failed_contests)} contests and {len(failed_handles)} handles still missing.')
+
+def get_dataset_units() -> dict:
+    # new rating rows, results or a timeline format change invalidate every chunk, like the feature store
+    inputs = fingerprint_values(
+        fingerprint_files(CONTEST_PROBLEMS_DATA_PATH, CONTEST_STATISTICS_PATH),
+        db_rating_change.get_data_version(),
+        columnar_store.get_source_version('contest_user_result'),
+        rating_timeline.FORMAT,
+    )
+    groups = build_dataset.get_handle_groups(DATASET_SEED)
+    return {i: fingerprint_values(inputs, group) for i, group in enumerate(groups)}
+
+def run_dataset_units(chunk_indices: list, mark_done):
+    # only this stage thread reads read-only, drain workers and other stages keep writing
+    with db_connection.read_only_mode():
+        groups = build_dataset.get_handle_groups(DATASET_SEED)
+        build_dataset.build_dataset_groups(groups, sorted(chunk_indices), on_done=mark_done)
+
+def build_stages() -> list[Stage]:
+    return [
+        single_unit_stage('handles', [], lambda: fingerprint_values('user.ratedList'), get_cf_handles),
+        single_unit_stage(
+            'contest_metadata', [],
+            lambda: fingerprint_values(CONTEST_MIN_DATE, CONTEST_MAX_DATE),
+            lambda: process_rated_contest_csv(CONTEST_MIN_DATE, CONTEST_MAX_DATE)
+        ),
+        single_unit_stage(
+            'problem_metadata', ['contest_metadata'],
+            lambda: fingerprint_files(RATED_CONTEST_METADATA_PATH),
+            fetch_problem_metadata
+        ),
+        single_unit_stage(
+            'contest_statistics', ['contest_metadata'],
+            lambda: fingerprint_files(RATED_CONTEST_METADATA_PATH),
+            contest_standing_fetcher.process_contest_standings
+        ),
+        single_unit_stage(
+            'sampling', ['handles'],
+            lambda: fingerprint_values(fingerprint_files(SELECTED_USERS_PATH), RATING_BUCKETS, SAMPLE_TARGET),
+            sample_handles
+        ),
+        Stage('rating_changes', get_sampled_handle_units, run_rating_change_units, ['sampling', 'contest_statistics']),
+        Stage('user_results', get_contest_units, run_user_result_units, ['contest_metadata']),
+        single_unit_stage(
+            'columnar_export', ['rating_changes', 'user_results'],
+            lambda: fingerprint_values(
+                {table: columnar_store.get_source_version(table) for table in columnar_store.TABLES},
+                COLUMNAR_CONTEST_RANGE
+            ),
+            columnar_store.export_all
+        ),
+        # everything the dataset build would fetch, so the build itself stays offline
+        single_unit_stage(
+            'build_backfill', ['problem_metadata', 'rating_changes', 'user_results', 'sampling'],
+            lambda: fingerprint_values(
+                fingerprint_files(SAMPLED_HANDLE_PATH), columnar_store.get_source_version('contest_user_result')
+            ),
+            backfill_build_inputs
+        ),
+        single_unit_stage(
+            'rating_timeline', ['rating_changes', 'build_backfill'],
+            lambda: fingerprint_values(db_rating_change.get_data_version(), rating_timeline.FORMAT),
+            rating_timeline.export
+        ),
+        single_unit_stage(
+            'features', ['problem_metadata', 'contest_statistics', 'rating_timeline', 'user_results', 'sampling', 'build_backfill'],
+            lambda: fingerprint_values([feature_store.get_fingerprint(name) for name in feature_store.FAMILIES]),
+            feature_store.export_training_set
+        ),
+        Stage(
+            'dataset', get_dataset_units, run_dataset_units,
+            [
+                'problem_metadata', 'contest_statistics', 'rating_changes', 'user_results', 'sampling',
+                'columnar_export', 'rating_timeline', 'build_backfill',
+            ]
+        ),
+    ]
+
+def run_all(targets: list[str] = None):
+    # failed units are retried with backoff in the background while later stages run
+    workers = retry_queue.DrainWorkers().start()
+    runner = StageRunner(build_stages())
+    try:
+        results = runner.run(targets)
+    finally:
+        workers.stop()
+
+    for name, (done, failed) in results.items():
+        print(f'[PIPELINE] {name}: {done} units completed, {failed} failed')
+    for (kind, status), count in sorted(retry_queue.get_counts().items()):
+        print(f'[PIPELINE] retry queue {kind} {status}: {count}')
 
 if __name__ == "__main__":
-    run_all()
+    run_all(sys.argv[1:] or None)
@@ -0,0 +1,170 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Hashable, Iterable, Optional, Union
+from config import PROCESSED_DATA_DIR
+
+
+MANIFEST_PATH = PROCESSED_DATA_DIR / 'pipeline_manifest.db'
+
+
+def fingerprint_values(*values) -> str:
+    h = hashlib.sha256()
+    for value in values:
+        h.update(repr(value).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+def fingerprint_files(*paths: Union[str, Path]) -> str:
+    # size and mtime are enough to notice a rewritten input without hashing gigabytes
+    values = list()
+    for path in paths:
+        path = Path(path)
+        if path.is_file():
+            st = path.stat()
+            values.append((str(path), st.st_size, st.st_mtime_ns))
+        else:
+            values.append((str(path), None))
+    return fingerprint_values(*values)
+
+
+@dataclass
+class Stage:
+    name: str
+    # unit -> fingerprint of the inputs that unit depends on
+    get_units: Callable[[], dict[Hashable, str]]
+    # runs the pending units, calling mark_done(unit) once each unit is durably stored
+    run_units: Callable[[list, Callable[[Hashable], None]], None]
+    deps: list[str] = field(default_factory=list)
+
+
+class Manifest:
+    def __init__(self, path: Union[str, Path] = MANIFEST_PATH):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS completed_units (
+                stage TEXT NOT NULL,
+                unit TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (stage, unit)
+            )
+        ''')
+        self.conn.commit()
+
+    def get_completed(self, stage: str) -> dict[str, str]:
+        with self.lock:
+            cursor = self.conn.execute('SELECT unit, fingerprint FROM completed_units WHERE stage = ?', (stage,))
+            return dict(cursor.fetchall())
+
+    def mark_done(self, stage: str, unit: Hashable, fingerprint: str):
+        with self.lock:
+            self.conn.execute('''
+                INSERT OR REPLACE INTO completed_units(stage, unit, fingerprint, completed_at)
+                VALUES (?, ?, ?, ?)''', (stage, str(unit), fingerprint, time.time()))
+            self.conn.commit()
+
+    def reset(self, stage: str):
+        with self.lock:
+            self.conn.execute('DELETE FROM completed_units WHERE stage = ?', (stage,))
+            self.conn.commit()
+
+
+class StageRunner:
+    def __init__(self, stages: list[Stage], manifest: Optional[Manifest] = None, max_workers: int = 4):
+        self.stages = {stage.name: stage for stage in stages}
+        self.manifest = manifest if manifest is not None else Manifest()
+        self.max_workers = max_workers
+
+        for stage in stages:
+            for dep in stage.deps:
+                if dep not in self.stages:
+                    raise ValueError(f'Stage {stage.name} depends on unknown stage {dep}')
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        visiting, visited = set(), set()
+
+        def visit(name: str):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f'Stage dependency cycle at {name}')
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _closure(self, targets: Iterable[str]) -> set[str]:
+        selected = set()
+        stack = list(targets)
+        while stack:
+            name = stack.pop()
+            if name in selected:
+                continue
+            selected.add(name)
+            stack.extend(self.stages[name].deps)
+        return selected
+
+    def run_stage(self, stage: Stage) -> tuple[int, int]:
+        units = stage.get_units()
+        completed = self.manifest.get_completed(stage.name)
+        pending = [unit for unit, fp in units.items() if completed.get(str(unit)) != fp]
+        print(f'[STAGE] {stage.name}: {len(units) - len(pending)} / {len(units)} units already done')
+        if not pending:
+            return 0, 0
+
+        done_count = 0
+
+        def mark_done(unit: Hashable):
+            nonlocal done_count
+            self.manifest.mark_done(stage.name, unit, units[unit])
+            done_count += 1
+
+        stage.run_units(pending, mark_done)
+        print(f'[STAGE] {stage.name}: {done_count} / {len(pending)} pending units completed')
+        return done_count, len(pending) - done_count
+
+    def run(self, targets: Optional[Iterable[str]] = None) -> dict[str, tuple[int, int]]:
+        selected = self._closure(targets) if targets is not None else set(self.stages)
+        finished: set[str] = set()
+        broken: set[str] = set()
+        results: dict[str, tuple[int, int]] = dict()
+        running = dict()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                for name in sorted(selected - finished - broken - set(running.values())):
+                    deps = self.stages[name].deps
+                    if any(dep in broken for dep in deps):
+                        print(f'[STAGE] {name} skipped, a dependency raised')
+                        broken.add(name)
+                        continue
+                    if all(dep in finished for dep in deps):
+                        running[executor.submit(self.run_stage, self.stages[name])] = name
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        finished.add(name)
+                    except Exception:
+                        print(f'[STAGE] {name} raised:\n{traceback.format_exc()}')
+                        broken.add(name)
+        return results
@@ -2,6 +2,8 @@ import json
 from typing import Optional, Union
 from pathlib import Path
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 
 def save_json(path: Union[str, Path], data: dict):
@@ -40,4 +42,74 @@ def load_csv(path: Union[str, Path]) -> Optional[pd.DataFrame]:
         return pd.read_csv(path)
     except Exception as e:
         print(f'[load_csv] Failed to read CSV: {e}')
-        return None
\ No newline at end of file
+        return None
+
+class ParquetChunkWriter:
+    # streams typed batches into one parquet file; rows are cast to the schema as they arrive and
+    # written out as a row group every batch_rows rows, so only one batch is ever held in memory
+    def __init__(self, path: Union[str, Path], schema: pa.Schema, batch_rows: int = 65536):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(f'{self.path.name}.tmp')
+        self.schema = schema
+        self.batch_rows = batch_rows
+        self.pending: list[pa.Table] = list()
+        self.pending_rows = 0
+        self.rows_written = 0
+        self.writer: Optional[pq.ParquetWriter] = None
+
+    def __enter__(self) -> 'ParquetChunkWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _open(self) -> pq.ParquetWriter:
+        if self.writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression='zstd')
+        return self.writer
+
+    def write(self, df: pd.DataFrame):
+        # columns are picked and cast by the schema, an out-of-range value raises instead of wrapping
+        if df.empty:
+            return
+        self.pending.append(pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False))
+        self.pending_rows += len(df)
+        if self.pending_rows >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        table = pa.concat_tables(self.pending)
+        self._open().write_table(table, row_group_size=self.batch_rows)
+        self.rows_written += len(table)
+        self.pending.clear()
+        self.pending_rows = 0
+
+    def close(self):
+        self.flush()
+        # a chunk without rows still gets a file with the schema
+        self._open().close()
+        self.tmp_path.replace(self.path)
+
+    def abort(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+def load_parquet(path: Union[str, Path], columns: Optional[list[str]] = None) -> Optional[pd.DataFrame]:
+    path = Path(path)
+
+    if not path.is_file():
+        print(f'[load_parquet] File not found: {path}')
+        return None
+
+    try:
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    except Exception as e:
+        print(f'[load_parquet] Failed to read parquet: {e}')
+        return None
@@ -0,0 +1,78 @@
+import numpy as np
+
+
+# a problem's tags are bits of one uint64, so the tag list can hold at most 64 tags
+MAX_TAGS = 64
+OTHER_GROUP = 'other'
+
+
+class TagEncoding:
+    # the tag list as bit positions: problems are encoded once into a uint64 mask and
+    # masks expand in bulk into int8 multi-hot rows over the list
+    def __init__(self, tag_list: list[str]):
+        if len(tag_list) > MAX_TAGS:
+            raise ValueError(f'{len(tag_list)} tags do not fit in a uint64 mask')
+        self.tag_list = list(tag_list)
+        self.index = {tag: i for i, tag in enumerate(self.tag_list)}
+        self.bits = np.left_shift(np.uint64(1), np.arange(len(self.tag_list), dtype=np.uint64))
+
+    @classmethod
+    def from_columns(cls, columns: list[str], prefix: str = 'problem_tag_') -> 'TagEncoding':
+        # the encoding of a dataset, from the order of its problem_tag_* columns
+        return cls([col[len(prefix):] for col in columns if col.startswith(prefix)])
+
+    def __len__(self) -> int:
+        return len(self.tag_list)
+
+    def mask(self, tags: list[str]) -> int:
+        # tags outside the list are dropped
+        ret = 0
+        for tag in tags:
+            i = self.index.get(tag)
+            if i is not None:
+                ret |= 1 << i
+        return ret
+
+    def masks(self, tag_lists: list[list[str]]) -> np.ndarray:
+        return np.fromiter((self.mask(tags) for tags in tag_lists), dtype=np.uint64, count=len(tag_lists))
+
+    def to_matrix(self, masks) -> np.ndarray:
+        # [..., tags] int8 rows, a single mask gives a single row
+        masks = np.asarray(masks, dtype=np.uint64)
+        return ((masks[..., None] & self.bits) != 0).astype(np.int8)
+
+    def from_matrix(self, matrix: np.ndarray) -> np.ndarray:
+        return np.bitwise_or.reduce(np.where(np.asarray(matrix) != 0, self.bits, np.uint64(0)), axis=-1)
+
+
+class TagGroups:
+    # preprocess.normalize_tags as a [tags, groups] 0/1 matrix: a tag belongs to the groups
+    # of its tag_map entry, tags without one to 'other'
+    def __init__(self, encoding: TagEncoding, tag_map: dict[str, str]):
+        members = [tag_map[tag].split(',') if tag in tag_map else [OTHER_GROUP] for tag in encoding.tag_list]
+        self.names = sorted({group for groups in members for group in groups})
+        group_index = {group: i for i, group in enumerate(self.names)}
+        self.matrix = np.zeros((len(encoding), len(self.names)), dtype=np.int8)
+        for i, groups in enumerate(members):
+            self.matrix[i, [group_index[group] for group in groups]] = 1
+        self.group_encoding = TagEncoding(self.names) if len(self.names) <= MAX_TAGS else None
+        self.encoding = encoding
+
+    def any(self, multi_hot: np.ndarray) -> np.ndarray:
+        # [n, groups] int8, 1 when the row has a tag of the group
+        return (np.asarray(multi_hot, dtype=np.int32) @ self.matrix > 0).astype(np.int8)
+
+    def max(self, values: np.ndarray) -> np.ndarray:
+        # [n, groups] max of the values of the group's tags, like accepted_max_rating_* per group
+        values = np.asarray(values)
+        ret = np.zeros((len(values), len(self.names)), dtype=values.dtype)
+        for g in range(len(self.names)):
+            members = np.flatnonzero(self.matrix[:, g])
+            ret[:, g] = values[:, members].max(axis=1)
+        return ret
+
+    def masks(self, masks) -> np.ndarray:
+        # tag masks to group masks
+        if self.group_encoding is None:
+            raise ValueError(f'{len(self.names)} groups do not fit in a uint64 mask')
+        return self.group_encoding.from_matrix(self.any(self.encoding.to_matrix(masks)))
@@ -94,6 +94,6 @@ def plot_feature_importance(model, feature_names, top_n=20):
     plt.show()
 
 if __name__ == "__main__":
-    df = utils.load_and_merge_datasets('dataset')
+    df = utils.load_training_set('dataset')
     model_list = ['RandomForest', 'LogisticRegression', 'XGBoost', 'LightGBM', 'CatBoost']
     analyze_all_models(df, model_list, title_suffix='Dieted features')
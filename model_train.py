@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
@@ -37,8 +38,11 @@ def train_model(model_name: str, x_train, y_train, x_valid=None, y_valid=None, u
             print(f"Calibration failed: {e}")
     return model
 
-def train_and_save_all_models(df: pd.DataFrame, save_dir='models'):
+def train_and_save_all_models(df: pd.DataFrame, save_dir='models', tag_map: Optional[dict[str, str]] = None):
     os.makedirs(save_dir, exist_ok=True)
+    if tag_map is not None:
+        # train on tag groups instead of single tags
+        df = utils.group_tag_columns(df, tag_map)
     trainset, validset, testset = utils.split_by_contest(df, test_ratio=0.1, valid_ratio=0.1)
     x_train, y_train = trainset.drop(columns=['verdict']), trainset['verdict']
     x_valid, y_valid = validset.drop(columns=['verdict']), validset['verdict']
@@ -60,5 +64,6 @@ def train_and_save_all_models(df: pd.DataFrame, save_dir='models'):
         print(f"Model {model_name} saved to {model_path}")
 
 if __name__ == "__main__":
-    dataset = utils.load_and_merge_datasets('dataset')
-    train_and_save_all_models(dataset)
+    dataset = utils.load_training_set('dataset')
+    tag_map = utils.load_tag_group_map(os.environ['TAG_GROUP_MAP']) if os.environ.get('TAG_GROUP_MAP') else None
+    train_and_save_all_models(dataset, tag_map=tag_map)
@@ -1,7 +1,10 @@
 import pandas as pd
 import os
 import glob
+from typing import Optional
+import pyarrow.parquet as pq
 from sklearn.model_selection import train_test_split
+from cf_data_pipeline.tag_encoding import TagEncoding, TagGroups
 
 
 normalize_target_columns: set = None
@@ -33,20 +36,32 @@ def get_normalize_target_columns():
             normalize_target_columns.add(line)
     return normalize_target_columns
     
-def load_and_merge_datasets(dir_path: str, pattern: str = 'dataset_group_*.csv') -> pd.DataFrame:
-    path = os.path.join(dir_path, pattern)
-    files = glob.glob(path)
-
-    df_list = list()
-    for file in files:
-        df = pd.read_csv(file)
-        df_list.append(df)
-    merged_df = pd.concat(df_list, ignore_index=True)
+def load_and_merge_datasets(dir_path: str, pattern: Optional[str] = None, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    # parquet chunks are memory-mapped and only the requested columns are read,
+    # directories built before the parquet output still load from csv
+    if pattern is None:
+        pattern = 'dataset_group_*.parquet' if glob.glob(os.path.join(dir_path, 'dataset_group_*.parquet')) else 'dataset_group_*.csv'
+    files = sorted(glob.glob(os.path.join(dir_path, pattern)))
+
+    if pattern.endswith('.parquet'):
+        merged_df = pq.ParquetDataset(files, memory_map=True).read(columns=columns).to_pandas()
+    else:
+        merged_df = pd.concat([pd.read_csv(file, usecols=columns) for file in files], ignore_index=True)
     print(f'Total merged shape: {merged_df.shape}')
     return merged_df
 
+def load_training_set(dir_path: str = 'dataset', columns: Optional[list[str]] = None) -> pd.DataFrame:
+    # the feature store's export when the pipeline wrote one, the dataset chunks otherwise
+    path = os.path.join(dir_path, 'training_set.parquet')
+    if not os.path.isfile(path):
+        return load_and_merge_datasets(dir_path, columns=columns)
+    df = pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    print(f'Training set shape: {df.shape}')
+    return df
+
 def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-    drop_cols = ['handle', 'contest_id', 'problem_index']
+    # older chunks carry the handle string, newer ones its handle_id
+    drop_cols = ['handle', 'handle_id', 'contest_id', 'problem_index']
     drop_cols.extend(['25th_percentile_rated', '75th_percentile_rated', 'count_unrated', 'unrated_ratio', 'median_rating_rated', 'avg_rating_rated_only', 'count_total'])
 
     # pattern_cols = [col for col in df.columns if col.startswith('accepted_max') or col.startswith('problem_tag_')]
@@ -56,9 +71,35 @@ def filter_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     filtered_df = df
     limit_rating_scaled = min_max_scale_value(2100, 0, 4000)
     # filtered_df = df[df[mx_rating_key] > limit_rating_scaled]
-    filtered_df = filtered_df.drop(columns=drop_cols, axis=1)
+    filtered_df = filtered_df.drop(columns=drop_cols, axis=1, errors='ignore')
     return filtered_df
 
+def load_tag_group_map(path: str) -> dict[str, str]:
+    # same file as preprocess.get_tag_group_map, tag -> comma separated groups
+    return pd.read_csv(path).set_index('tag')['groups'].to_dict()
+
+def group_tag_columns(df: pd.DataFrame, tag_map: dict[str, str]) -> pd.DataFrame:
+    # per-tag columns to per-group columns with the builder's tag encoding, problem_group_* is 1
+    # when the problem has a tag of the group and accepted_max_rating_group_* the max over its tags
+    encoding = TagEncoding.from_columns(df.columns)
+    groups = TagGroups(encoding, tag_map)
+    tag_cols = [f'problem_tag_{tag}' for tag in encoding.tag_list]
+    max_cols = [f'accepted_max_rating_{tag}' for tag in encoding.tag_list]
+
+    grouped = {f'problem_group_{name}': col for name, col in zip(groups.names, groups.any(df[tag_cols].to_numpy()).T)}
+    drop_cols = tag_cols
+    if all(col in df.columns for col in max_cols):
+        max_values = groups.max(df[max_cols].to_numpy())
+        grouped.update({f'accepted_max_rating_group_{name}': col for name, col in zip(groups.names, max_values.T)})
+        drop_cols = tag_cols + max_cols
+
+    df = df.drop(columns=drop_cols)
+    verdict = df.pop('verdict') if 'verdict' in df.columns else None
+    df = pd.concat([df, pd.DataFrame(grouped, index=df.index)], axis=1)
+    if verdict is not None:
+        df['verdict'] = verdict
+    return df
+
 def scale_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     for col in df.columns:
         if 'max_rating_before_contest' in col or 'currnet_rating_before_contest' in col or 'percentile_rated' in col: